@@ -46,6 +46,8 @@ INSTALLED_APPS = [
     'django_cleanup.apps.CleanupConfig',
     'crispy_forms',
     'crispy_bootstrap4',
+    # Genres moved to movies.Genre, taggit stays for the migrations that
+    # copy them out of its tables.
     'taggit',
     'users',
     'movies',
@@ -102,6 +104,35 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# The default is a per-process memory cache, set CACHE_BACKEND to
+# django.core.cache.backends.filebased.FileBasedCache (with CACHE_LOCATION
+# set to a directory) to share it between processes. Cached pages are keyed
+# on the version stamps in the database, so either way a change made by any
+# process is seen by all of them.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            "CACHE_BACKEND", 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get("CACHE_LOCATION", 'cookie'),
+    }
+}
+
+# Anonymous catalog pages, see movies/page_cache.py
+PAGE_CACHE_ENABLED = os.environ.get("PAGE_CACHE_ENABLED", 'true') == 'true'
+PAGE_CACHE_TIMEOUT = int(os.environ.get("PAGE_CACHE_TIMEOUT", 600))
+
+# Task queue of thumbnails, file deletions and related movies refreshes,
+# and of the periodic leaderboards and similar movies recomputations (the
+# latter needs numpy and scipy), see movies/tasks.py. Run `manage.py
+# run_tasks` next to the web process (the worker of the Procfile), or set
+# TASKS_RUN_INLINE=true to run them in the request instead and the
+# periodic ones from cron.
+TASKS_RUN_INLINE = os.environ.get("TASKS_RUN_INLINE", 'false') == 'true'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -150,6 +181,13 @@ MEDIA_URL = '/media/'
 
 DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
 
+# MEDIA_STORAGE=local keeps uploads in MEDIA_ROOT instead of Cloudinary,
+# e.g. to work offline. Run `manage.py refresh_media_urls` after switching,
+# rows store the URLs of their images.
+if os.environ.get('MEDIA_STORAGE') == 'local':
+    DEFAULT_FILE_STORAGE = 'django.core.files.storage.FileSystemStorage'
+    MEDIA_ROOT = BASE_DIR / 'media'
+
 LOGIN_URL = reverse_lazy('users:become-user')
 
 MESSAGE_TAGS = {
@@ -160,8 +198,6 @@ MESSAGE_TAGS = {
     messages.ERROR: 'alert-danger',
 }
 
-TAGGIT_CASE_INSENSITIVE = True
-
 AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',
     'users.authentication.EmailAuthBackend'
@@ -23,8 +23,13 @@ from django.conf.urls.static import static
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('movies.urls')),
+    path('api/v1/', include('movies.api_urls')),
     path('', include('users.urls')),
 ]
 
 
+if settings.DEBUG:
+    # Uploads kept in MEDIA_ROOT with MEDIA_STORAGE=local.
+    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
 handler404 = 'movies.views.error_404_handler'
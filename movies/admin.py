@@ -1,15 +1,23 @@
 from typing import Any
 from django.contrib import admin
+from django.db import IntegrityError, transaction
 from django.db.models.query import QuerySet
 from django.http.request import HttpRequest
+from django.utils import timezone
 from django.utils.html import format_html
-from movies.models import Movie, Director, Actor
+from movies.models import Movie, Director, Actor, Genre, Task
+from movies.thumbnails import thumbnail_url
 
 
 class ActorInline(admin.TabularInline):
     model = Movie.actors.through
 
 
+class GenreInline(admin.TabularInline):
+    model = Movie.genres.through
+    autocomplete_fields = ['genre']
+
+
 @admin.register(Director)
 class DirectorAdmin(admin.ModelAdmin):
     list_display = ['name', 'photo_tag', 'slugged_name']
@@ -19,7 +27,7 @@ class DirectorAdmin(admin.ModelAdmin):
     exclude = ['slugged_name']
 
     def photo_tag(self, obj):
-        return format_html(f'<img src="{obj.photo.url}" width="60" height="100">')
+        return format_html('<img src="{}" width="60" height="90">', thumbnail_url(obj))
     photo_tag.short_description = 'Photo'
 
 
@@ -32,10 +40,17 @@ class ActorAdmin(admin.ModelAdmin):
     exclude = ['slugged_name']
 
     def photo_tag(self, obj):
-        return format_html(f'<img src="{obj.photo.url}" width="60" height="100">')
+        return format_html('<img src="{}" width="60" height="90">', thumbnail_url(obj))
     photo_tag.short_description = 'Photo'
 
 
+@admin.register(Genre)
+class GenreAdmin(admin.ModelAdmin):
+    list_display = ['name', 'slug', 'number_of_movies']
+    search_fields = ['name']
+    exclude = ['slug']
+
+
 @admin.register(Movie)
 class MovieAdmin(admin.ModelAdmin):
     list_display = [
@@ -47,7 +62,7 @@ class MovieAdmin(admin.ModelAdmin):
     search_fields = ['title', 'slug', 'country']
     readonly_fields = ['poster_tag']
     exclude = ['slug', 'actors']
-    inlines = (ActorInline, )
+    inlines = (ActorInline, GenreInline)
     autocomplete_fields = ['director']
 
     def get_queryset(self, request: HttpRequest) -> QuerySet[Any]:
@@ -55,8 +70,30 @@ class MovieAdmin(admin.ModelAdmin):
             prefetch_related('genres')
 
     def poster_tag(self, obj):
-        return format_html(f'<img src="{obj.poster.url}" width="60" height="100">')
+        return format_html('<img src="{}" width="60" height="90">', thumbnail_url(obj))
     poster_tag.short_description = 'Poster'
 
     def genres_list(self, obj):
         return u", ".join(o.name for o in obj.genres.all())
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ['name', 'status', 'attempts', 'run_after', 'created']
+    list_filter = ['status', 'name']
+    search_fields = ['name', 'key']
+    readonly_fields = ['locked_by', 'locked_until', 'last_error', 'created']
+    actions = ['retry']
+
+    @admin.action(description='Retry the selected failed tasks')
+    def retry(self, request, queryset):
+        retried = 0
+        for task in queryset.filter(status=Task.FAILED):
+            try:
+                with transaction.atomic():
+                    retried += Task.objects.filter(pk=task.pk, status=Task.FAILED).update(
+                        status=Task.PENDING, attempts=0, run_after=timezone.now())
+            except IntegrityError:
+                # A pending task with the same key will do it.
+                task.delete()
+        self.message_user(request, f'{retried} task(s) will run again.')
@@ -0,0 +1,444 @@
+"""
+Read-only JSON API, version 1.
+
+List and detail endpoints select only the columns of the requested fields
+with values() and serialize the resulting dicts, no model instances are
+created. Query parameters:
+
+    fields=title,slug      sparse fieldset, see the FIELDS of each resource
+    include=director       related objects, fetched with one query each
+    limit=24               page size, at most MAX_LIMIT
+    cursor=...             next/previous page, from the links of a response
+
+List responses have the form {"data": [...], "next": url, "previous": url}.
+Responses carry an ETag and answer If-None-Match with 304.
+"""
+import abc
+from django.core.files.storage import default_storage
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, set_response_etag
+from django.utils.decorators import method_decorator
+from django.views.generic import View
+from movies import leaderboards
+from movies.models import Movie, Director, Actor, Genre, MovieGenre, \
+    LeaderboardEntry, Review, RATING_VALUES
+from movies.page_cache import conditional_page
+from movies.pagination import KeysetPaginator
+
+DEFAULT_LIMIT = 24
+MAX_LIMIT = 100
+
+
+class ApiError(Exception):
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def column(name):
+    return (name, ), lambda row: row[name]
+
+
+def date_column(name):
+    return (name, ), lambda row: row[name].isoformat() if row[name] else None
+
+
+def file_column(name):
+    # The URL stored on the row by MediaURLField, resolved by the storage
+    # only for rows saved before it existed.
+    url = f'{name}_url'
+    return (name, url), lambda row: row[url] or \
+        (default_storage.url(row[name]) if row[name] else None)
+
+
+def average(row):
+    if not row['rating_count']:
+        return None
+    return round(row['rating_sum'] / row['rating_count'], 2)
+
+
+def include_director(rows):
+    directors = {director['id']: director for director in Director.objects.
+                 filter(id__in={row['director_id'] for row in rows}).
+                 values('id', 'name', 'slugged_name')}
+    for row in rows:
+        row['director'] = directors.get(row['director_id'])
+
+
+def include_actors(rows):
+    actors = {row['pk']: [] for row in rows}
+    for cast in Movie.actors.through.objects.filter(movie_id__in=actors).\
+            values('movie_id', 'actor_id', 'actor__name', 'actor__slugged_name').\
+            order_by('actor__name'):
+        actors[cast['movie_id']].append({
+            'id': cast['actor_id'], 'name': cast['actor__name'],
+            'slugged_name': cast['actor__slugged_name']
+        })
+    for row in rows:
+        row['actors'] = actors[row['pk']]
+
+
+def include_genres(rows):
+    genres = {row['pk']: [] for row in rows}
+    for item in MovieGenre.objects.filter(movie_id__in=genres).\
+            values('movie_id', 'genre__name', 'genre__slug').order_by('genre__name'):
+        genres[item['movie_id']].append(
+            {'name': item['genre__name'], 'slug': item['genre__slug']})
+    for row in rows:
+        row['genres'] = genres[row['pk']]
+
+
+def include_movies_of(lookup):
+    """Include the movies of directors or actors, lookup is the filter on Movie."""
+    def include(rows):
+        movies = {row['pk']: [] for row in rows}
+        for movie in Movie.objects.filter(**{f'{lookup}__in': movies}).\
+                values(lookup, 'id', 'title', 'slug').order_by('title'):
+            movies[movie[lookup]].append(
+                {'id': movie['id'], 'title': movie['title'], 'slug': movie['slug']})
+        for row in rows:
+            row['movies'] = movies[row['pk']]
+    return include
+
+
+class Resource:
+    """
+    FIELDS maps the name of a field to (columns it is computed from,
+    function of the row). INCLUDES maps a name to (columns it needs,
+    function adding related objects to a page of rows).
+    """
+    model = None
+    ordering = ['pk']
+    lookup_field = 'slug'
+    FIELDS = {}
+    INCLUDES = {}
+    # Filters of list endpoints, query parameter -> lookup.
+    FILTERS = {}
+
+    def __init__(self, request):
+        self.request = request
+        self.fields = self.parse_list('fields', self.FIELDS) or list(self.FIELDS)
+        self.includes = self.parse_list('include', self.INCLUDES)
+
+    def parse_list(self, parameter, allowed):
+        names = [name for name in self.request.GET.get(parameter, '').split(',') if name]
+        unknown = [name for name in names if name not in allowed]
+        if unknown:
+            raise ApiError(f'Unknown {parameter}: {", ".join(unknown)}. '
+                           f'Allowed: {", ".join(allowed)}')
+        return names
+
+    def get_queryset(self):
+        return self.model.objects.all()
+
+    def columns(self):
+        columns = {'pk'} | {name.lstrip('-') for name in self.ordering}
+        for name in self.fields:
+            columns.update(self.FIELDS[name][0])
+        for name in self.includes:
+            columns.update(self.INCLUDES[name][0])
+        return sorted(columns)
+
+    def serialize(self, rows):
+        for name in self.includes:
+            self.INCLUDES[name][1](rows)
+        return [self.serialize_row(row) for row in rows]
+
+    def serialize_row(self, row):
+        data = {name: self.FIELDS[name][1](row) for name in self.fields}
+        for name in self.includes:
+            data[name] = row[name]
+        return data
+
+    def filtered(self, queryset):
+        for parameter, lookup in self.FILTERS.items():
+            value = self.request.GET.get(parameter)
+            if value:
+                queryset = queryset.filter(**{lookup: value})
+        return queryset
+
+    def page(self):
+        try:
+            limit = int(self.request.GET.get('limit', DEFAULT_LIMIT))
+        except ValueError:
+            raise ApiError('limit must be a number')
+        if not 1 <= limit <= MAX_LIMIT:
+            raise ApiError(f'limit must be between 1 and {MAX_LIMIT}')
+        rows = self.filtered(self.get_queryset()).values(*self.columns())
+        page = KeysetPaginator(rows, self.ordering, limit).\
+            get_page(self.request.GET.get('cursor'))
+        return {
+            'data': self.serialize(page.object_list),
+            'next': self.link(page.next_cursor),
+            'previous': self.link(page.previous_cursor),
+        }
+
+    def link(self, cursor):
+        if cursor is None:
+            return None
+        parameters = self.request.GET.copy()
+        parameters['cursor'] = cursor
+        return f'{self.request.path}?{parameters.urlencode()}'
+
+    def detail(self, value):
+        row = self.get_queryset().filter(**{self.lookup_field: value}).\
+            values(*self.columns()).first()
+        if row is None:
+            raise ApiError('Not found', status=404)
+        return {'data': self.serialize([row])[0]}
+
+
+class MovieResource(Resource):
+    model = Movie
+    ordering = ['title', 'pk']
+    FIELDS = {
+        'id': column('pk'),
+        'title': column('title'),
+        'slug': column('slug'),
+        'synopsis': column('synopsis'),
+        'release_date': date_column('release_date'),
+        'country': column('country'),
+        'poster': file_column('poster'),
+        'director_id': column('director_id'),
+        'avg_rating': (('rating_sum', 'rating_count'), average),
+        'number_of_ratings': column('rating_count'),
+    }
+    INCLUDES = {
+        'director': (('director_id', ), include_director),
+        'actors': ((), include_actors),
+        'genres': ((), include_genres),
+    }
+    FILTERS = {
+        'genre': 'genres__slug',
+        'director': 'director__slugged_name',
+        'actor': 'actors__slugged_name',
+        'country': 'country',
+    }
+
+
+class GenreResource(Resource):
+    model = Genre
+    ordering = ['name', 'pk']
+    FIELDS = {
+        'name': column('name'),
+        'slug': column('slug'),
+        'number_of_movies': column('number_of_movies'),
+    }
+
+    def get_queryset(self):
+        return Genre.objects.filter(number_of_movies__gt=0)
+
+
+class DirectorResource(Resource):
+    model = Director
+    ordering = ['name', 'pk']
+    lookup_field = 'slugged_name'
+    FIELDS = {
+        'id': column('pk'),
+        'name': column('name'),
+        'slugged_name': column('slugged_name'),
+        'photo': file_column('photo'),
+    }
+    INCLUDES = {
+        'movies': ((), include_movies_of('director_id')),
+    }
+
+
+class ActorResource(DirectorResource):
+    model = Actor
+    INCLUDES = {
+        'movies': ((), include_movies_of('actors')),
+    }
+
+
+class ReviewResource(Resource):
+    model = Review
+    ordering = ['-published', '-pk']
+    FIELDS = {
+        'id': column('pk'),
+        'owner': column('owner__username'),
+        'content': column('content'),
+        'published': date_column('published'),
+        'updated': date_column('updated'),
+    }
+
+    def __init__(self, request, movie_id):
+        super().__init__(request)
+        self.movie_id = movie_id
+
+    def get_queryset(self):
+        return Review.objects.filter(movie_id=self.movie_id)
+
+
+def json_response(request, payload, status=200):
+    response = JsonResponse(payload, status=status)
+    if status != 200:
+        return response
+    set_response_etag(response)
+    return get_conditional_response(request, etag=response['ETag'], response=response)
+
+
+# Endpoints decorated with conditional_page answer If-None-Match from the
+# version stamps of their tags before any query runs, the others get an
+# ETag of their content.
+
+class ApiView(View, metaclass=abc.ABCMeta):
+    resource_class = None
+    http_method_names = ['get', 'head', 'options']
+
+    def get_resource(self):
+        return self.resource_class(self.request)
+
+    @abc.abstractmethod
+    def get_payload(self, resource):
+        """Data of the response, raises ApiError to answer with an error."""
+
+    def get(self, request, *args, **kwargs):
+        try:
+            payload = self.get_payload(self.get_resource())
+        except ApiError as error:
+            return json_response(request, {'error': str(error)}, status=error.status)
+        return json_response(request, payload)
+
+
+class ResourceListView(ApiView):
+
+    def get_payload(self, resource):
+        return resource.page()
+
+
+class ResourceDetailView(ApiView):
+
+    def get_payload(self, resource):
+        return resource.detail(self.kwargs['slug'])
+
+
+class MovieListView(ResourceListView):
+    resource_class = MovieResource
+
+
+class MovieDetailView(ResourceDetailView):
+    resource_class = MovieResource
+
+    @method_decorator(conditional_page('movie:{slug}', shared=True))
+    def dispatch(self, request, *args, **kwargs):
+        return super().dispatch(request, *args, **kwargs)
+
+
+class MovieRatingsView(ApiView):
+
+    def get_payload(self, resource):
+        movie = Movie.objects.filter(id=self.kwargs['pk']).only(
+            'rating_sum', 'rating_count',
+            *[f'histogram_{value}' for value in RATING_VALUES]
+        ).first()
+        if movie is None:
+            raise ApiError('Not found', status=404)
+        return {'data': {
+            'movie_id': movie.id,
+            'number_of_ratings': movie.rating_count,
+            'avg_rating': average({'rating_sum': movie.rating_sum,
+                                   'rating_count': movie.rating_count}),
+            'histogram': movie.rating_histogram,
+            'median': movie.rating_median,
+            'percentiles': {percent: movie.rating_percentile(percent)
+                            for percent in (10, 25, 75, 90)},
+            'stddev': movie.rating_stddev and round(movie.rating_stddev, 3),
+        }}
+
+    def get_resource(self):
+        return None
+
+    @method_decorator(conditional_page('movie:{pk}', shared=True))
+    def dispatch(self, request, *args, **kwargs):
+        return super().dispatch(request, *args, **kwargs)
+
+
+class LeaderboardView(ApiView):
+    """Ranked movies of a leaderboard, of a genre or country with ?genre= or
+    ?country=, see movies/leaderboards.py."""
+
+    def get_payload(self, resource):
+        board = self.kwargs['board']
+        if board not in leaderboards.BOARDS:
+            raise ApiError('Not found', status=404)
+        try:
+            limit = int(self.request.GET.get('limit', leaderboards.LEADERBOARD_SIZE))
+        except ValueError:
+            raise ApiError('limit must be a number')
+        if not 1 <= limit <= leaderboards.LEADERBOARD_SIZE:
+            raise ApiError(f'limit must be between 1 and {leaderboards.LEADERBOARD_SIZE}')
+        scope = leaderboards.scope_name(genre=self.request.GET.get('genre'),
+                                        country=self.request.GET.get('country'))
+        entries = LeaderboardEntry.objects.filter(board=board, scope=scope).\
+            values('rank', 'score', 'movie_id', 'movie__title', 'movie__slug')[:limit]
+        return {'board': board, 'scope': scope, 'data': [{
+            'rank': entry['rank'],
+            'score': round(entry['score'], 4),
+            'movie': {'id': entry['movie_id'], 'title': entry['movie__title'],
+                      'slug': entry['movie__slug']},
+        } for entry in entries]}
+
+    def get_resource(self):
+        return None
+
+    @method_decorator(conditional_page('leaderboards', shared=True))
+    def dispatch(self, request, *args, **kwargs):
+        return super().dispatch(request, *args, **kwargs)
+
+
+class ReviewListView(ResourceListView):
+    resource_class = ReviewResource
+
+    def get_resource(self):
+        return ReviewResource(self.request, self.kwargs['pk'])
+
+    def get_payload(self, resource):
+        if not Movie.objects.filter(id=self.kwargs['pk']).exists():
+            raise ApiError('Not found', status=404)
+        return super().get_payload(resource)
+
+    @method_decorator(conditional_page('movie:{pk}', shared=True))
+    def dispatch(self, request, *args, **kwargs):
+        return super().dispatch(request, *args, **kwargs)
+
+
+class GenreListView(ResourceListView):
+    resource_class = GenreResource
+
+    @method_decorator(conditional_page('genres', shared=True))
+    def dispatch(self, request, *args, **kwargs):
+        return super().dispatch(request, *args, **kwargs)
+
+
+class GenreDetailView(ResourceDetailView):
+    resource_class = GenreResource
+
+    @method_decorator(conditional_page('genre:{slug}', 'genres', shared=True))
+    def dispatch(self, request, *args, **kwargs):
+        return super().dispatch(request, *args, **kwargs)
+
+
+class DirectorListView(ResourceListView):
+    resource_class = DirectorResource
+
+
+class DirectorDetailView(ResourceDetailView):
+    resource_class = DirectorResource
+
+    @method_decorator(conditional_page('director:{slug}', shared=True))
+    def dispatch(self, request, *args, **kwargs):
+        return super().dispatch(request, *args, **kwargs)
+
+
+class ActorListView(ResourceListView):
+    resource_class = ActorResource
+
+
+class ActorDetailView(ResourceDetailView):
+    resource_class = ActorResource
+
+    @method_decorator(conditional_page('actor:{slug}', shared=True))
+    def dispatch(self, request, *args, **kwargs):
+        return super().dispatch(request, *args, **kwargs)
@@ -0,0 +1,17 @@
+from django.urls import path
+from movies import api
+
+app_name = 'api'
+urlpatterns = [
+    path('movies/', api.MovieListView.as_view(), name='movie-list'),
+    path('movies/<slug:slug>/', api.MovieDetailView.as_view(), name='movie-detail'),
+    path('movies/<int:pk>/ratings/', api.MovieRatingsView.as_view(), name='movie-ratings'),
+    path('movies/<int:pk>/reviews/', api.ReviewListView.as_view(), name='review-list'),
+    path('leaderboards/<slug:board>/', api.LeaderboardView.as_view(), name='leaderboard'),
+    path('genres/', api.GenreListView.as_view(), name='genre-list'),
+    path('genres/<str:slug>/', api.GenreDetailView.as_view(), name='genre-detail'),
+    path('directors/', api.DirectorListView.as_view(), name='director-list'),
+    path('directors/<str:slug>/', api.DirectorDetailView.as_view(), name='director-detail'),
+    path('actors/', api.ActorListView.as_view(), name='actor-list'),
+    path('actors/<str:slug>/', api.ActorDetailView.as_view(), name='actor-detail'),
+]
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class MoviesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'movies'
+
+    def ready(self):
+        # leaderboards and recommendations register their periodic tasks
+        # with movies.tasks.
+        from movies import leaderboards, recommendations, signals  # noqa: F401
@@ -0,0 +1,146 @@
+"""
+In-process prefix index over movie titles, actor and director names used by
+the navbar autocomplete.
+
+The index is a sorted list of (key, kind, pk) tuples searched with bisect,
+with one key per word of a name so that "pitt" finds "Brad Pitt". It is
+built on first use and patched by the signals in movies/signals.py. Those
+only fire in the process that made the change, so other processes rebuild
+their copy once it is older than AUTOCOMPLETE_MAX_AGE seconds.
+"""
+import time
+from bisect import bisect_left, insort
+from threading import Lock
+from django.conf import settings
+from django.urls import reverse
+from movies.models import Movie, Actor, Director
+
+AUTOCOMPLETE_MAX_AGE = getattr(settings, 'AUTOCOMPLETE_MAX_AGE', 300)
+
+SOURCES = {
+    'movie': (Movie, 'title', 'slug', 'movies:movie-detail'),
+    'actor': (Actor, 'name', 'slugged_name', 'movies:actor-page'),
+    'director': (Director, 'name', 'slugged_name', 'movies:director-page'),
+}
+KIND_BY_MODEL = {source[0]: kind for kind, source in SOURCES.items()}
+
+
+def normalize(text):
+    return ' '.join(text.casefold().split())
+
+
+def keys_of(name):
+    words = normalize(name).split(' ')
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+class PrefixIndex:
+
+    def __init__(self):
+        self._keys = []
+        self._entries = {}
+        self._built_at = None
+        # Bumped by every change, a build that started before one is not
+        # marked built, so the index is rebuilt once more.
+        self._generation = 0
+        self._lock = Lock()
+        self._build_lock = Lock()
+
+    # Writers patch a copy of the key list and swap it in, so lookups
+    # running in other threads never see a list that is being modified.
+    def _add(self, keys, kind, pk, name, slug, url_name):
+        self._entries[(kind, pk)] = (name, reverse(url_name, args=(slug, )))
+        for key in keys_of(name):
+            insort(keys, (key, kind, pk))
+
+    def _remove(self, keys, kind, pk):
+        entry = self._entries.pop((kind, pk), None)
+        if not entry:
+            return
+        for key in keys_of(entry[0]):
+            position = bisect_left(keys, (key, kind, pk))
+            if position < len(keys) and keys[position] == (key, kind, pk):
+                del keys[position]
+
+    def build(self):
+        with self._lock:
+            generation = self._generation
+        keys = []
+        entries = {}
+        for kind, (model, name_field, slug_field, url_name) in SOURCES.items():
+            rows = model.objects.order_by().values_list('pk', name_field, slug_field)
+            for pk, name, slug in rows.iterator():
+                entries[(kind, pk)] = (name, reverse(url_name, args=(slug, )))
+                keys.extend((key, kind, pk) for key in keys_of(name))
+        keys.sort()
+        with self._lock:
+            self._keys = keys
+            self._entries = entries
+            if generation == self._generation:
+                self._built_at = time.monotonic()
+
+    def invalidate(self):
+        """Drop the index, it is rebuilt on the next lookup."""
+        with self._lock:
+            self._generation += 1
+            self._built_at = None
+
+    def is_stale(self):
+        return self._built_at is None or \
+            time.monotonic() - self._built_at > AUTOCOMPLETE_MAX_AGE
+
+    def ensure_built(self):
+        if not self.is_stale():
+            return
+        # Threads that find the index stale at the same time wait for the
+        # first one to rebuild it instead of all rebuilding it.
+        with self._build_lock:
+            if self.is_stale():
+                self.build()
+
+    def update(self, obj):
+        kind = KIND_BY_MODEL[type(obj)]
+        model, name_field, slug_field, url_name = SOURCES[kind]
+        with self._lock:
+            self._generation += 1
+            if self._built_at is None:
+                return
+            keys = list(self._keys)
+            self._remove(keys, kind, obj.pk)
+            self._add(keys, kind, obj.pk, getattr(obj, name_field),
+                      getattr(obj, slug_field), url_name)
+            self._keys = keys
+
+    def remove(self, obj):
+        with self._lock:
+            self._generation += 1
+            if self._built_at is None:
+                return
+            keys = list(self._keys)
+            self._remove(keys, KIND_BY_MODEL[type(obj)], obj.pk)
+            self._keys = keys
+
+    def lookup(self, prefix, limit=10):
+        """Return up to limit dicts with kind, title and url matching prefix."""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        self.ensure_built()
+        results = []
+        seen = set()
+        keys = self._keys
+        position = bisect_left(keys, (prefix, ))
+        while position < len(keys) and len(results) < limit:
+            key, kind, pk = keys[position]
+            if not key.startswith(prefix):
+                break
+            position += 1
+            entry = self._entries.get((kind, pk))
+            if entry is None or (kind, pk) in seen:
+                continue
+            seen.add((kind, pk))
+            results.append({'kind': kind, 'title': entry[0], 'url': entry[1]})
+        return results
+
+
+index = PrefixIndex()
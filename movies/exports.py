@@ -0,0 +1,96 @@
+"""
+Streaming exports of ratings and reviews for analytics.
+
+Rows are read with values() and iterator(chunk_size), which uses a
+server-side cursor on PostgreSQL, and written out chunk by chunk, so an
+export of any size runs in constant memory. Output is NDJSON or CSV,
+optionally gzip-compressed on the fly.
+"""
+import csv
+import datetime
+import io
+import json
+import zlib
+from django.utils import timezone
+from movies.models import Rating, Review
+
+CHUNK_SIZE = 2000
+
+EXPORTS = {
+    'ratings': (Rating, ['id', 'movie_id', 'movie__slug', 'owner_id', 'rating',
+                         'updated']),
+    'reviews': (Review, ['id', 'movie_id', 'movie__slug', 'owner_id', 'content',
+                         'published', 'updated']),
+}
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def _start_of(date):
+    """Midnight at the start of date in the current time zone."""
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
+
+
+def export_rows(kind, movie_id=None, since=None, until=None):
+    """Rows of an export as dicts, in id order. since and until are dates
+    of the last change of a row, until is inclusive."""
+    model, fields = EXPORTS[kind]
+    rows = model.objects.values(*fields).order_by('id')
+    if movie_id is not None:
+        rows = rows.filter(movie_id=movie_id)
+    # Bounds on the column itself rather than on its date, so that
+    # rating_updated_idx can serve them.
+    if since is not None:
+        rows = rows.filter(updated__gte=_start_of(since))
+    if until is not None:
+        rows = rows.filter(updated__lt=_start_of(until + datetime.timedelta(days=1)))
+    return rows.iterator(chunk_size=CHUNK_SIZE)
+
+
+def _json_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def render(kind, rows, file_format):
+    """Yield the export as text, one chunk of rows at a time."""
+    fields = EXPORTS[kind][1]
+    names = [field.replace('__', '_') for field in fields]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if file_format == 'csv':
+        writer.writerow(names)
+    count = 0
+    for row in rows:
+        if file_format == 'csv':
+            writer.writerow([row[field].isoformat() if isinstance(
+                row[field], (datetime.date, datetime.datetime)) else row[field]
+                for field in fields])
+        else:
+            buffer.write(json.dumps(dict(zip(names, (row[field] for field in fields))),
+                                    default=_json_value))
+            buffer.write('\n')
+        count += 1
+        if count % CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def encode(chunks, compress=False):
+    """Encode text chunks as UTF-8, gzip-compressed if compress is True."""
+    if not compress:
+        for chunk in chunks:
+            yield chunk.encode()
+        return
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,245 @@
+"""
+In-process facet index behind the browse page.
+
+Every movie gets a position in title order and each facet option (a
+genre, a country, a decade of release, a director, "rated at least r") is a
+bitmap of the positions of its movies, kept as a Python int. Filtering
+ANDs the bitmaps of the selected options and a facet count is the
+popcount of the filter AND the bitmap of the option, so counts for every
+option take a few big-integer operations and no queries.
+
+Counts of a facet are computed with the filter of that facet left out,
+so they tell how many movies picking another option gives, except for
+genres, which narrow down (a movie has to be in all selected genres).
+
+Like the autocomplete index, the index is built on first use, dropped by
+the signals in movies/signals.py when the catalog changes and rebuilt by
+other processes once it is older than FACETS_MAX_AGE seconds. Ratings do
+not drop it, the average ratings are at most that old.
+"""
+import time
+from collections import defaultdict
+from threading import Lock
+from django.conf import settings
+from movies.models import Movie, Director, Genre, MovieGenre
+
+FACETS_MAX_AGE = getattr(settings, 'FACETS_MAX_AGE', 60)
+RATING_THRESHOLDS = range(1, 10)
+DIRECTORS_SHOWN = 20
+
+
+def to_bitmap(positions, size):
+    bits = bytearray(size // 8 + 1)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def positions(bitmap, start, stop):
+    """Positions of the set bits of bitmap number start to stop."""
+    bits = bin(bitmap)[:1:-1]
+    result = []
+    position = bits.find('1')
+    number = 0
+    while position != -1 and number < stop:
+        if number >= start:
+            result.append(position)
+        number += 1
+        position = bits.find('1', position + 1)
+    return result
+
+
+class Filters:
+    """Selected options, parsed from query parameters. Unknown values are ignored."""
+
+    def __init__(self, facets, params):
+        self.genres = [slug for slug in params.getlist('genre') if slug in facets.genres]
+        country = params.get('country')
+        self.country = country if country in facets.countries else None
+        director = params.get('director')
+        self.director = director if director in facets.directors else None
+        self.year_from = self._number(params.get('year_from'))
+        self.year_to = self._number(params.get('year_to'))
+        min_rating = self._number(params.get('min_rating'))
+        self.min_rating = min_rating if min_rating in RATING_THRESHOLDS else None
+
+    def _number(self, value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    def query(self, **changes):
+        """Query string of the filters with some of them changed."""
+        values = {
+            'genre': self.genres, 'country': self.country, 'director': self.director,
+            'year_from': self.year_from, 'year_to': self.year_to,
+            'min_rating': self.min_rating
+        }
+        values.update(changes)
+        params = []
+        for name, value in values.items():
+            for item in (value if isinstance(value, list) else [value]):
+                if item is not None:
+                    params.append((name, item))
+        return params
+
+
+class Facets:
+    """Bitmaps of one build of the index, never modified after that."""
+
+    def __init__(self):
+        movies = list(Movie.objects.order_by('title', 'id').values_list(
+            'id', 'country', 'release_date', 'director_id', 'rating_sum', 'rating_count'))
+        size = len(movies)
+        position_of = {movie[0]: position for position, movie in enumerate(movies)}
+        countries, years, by_director, ratings = \
+            defaultdict(list), defaultdict(list), defaultdict(list), defaultdict(list)
+        for position, (_, country, release_date, director_id, rating_sum,
+                       rating_count) in enumerate(movies):
+            countries[country].append(position)
+            years[release_date.year].append(position)
+            by_director[director_id].append(position)
+            average = rating_sum / rating_count if rating_count else 0
+            for threshold in RATING_THRESHOLDS:
+                if average < threshold:
+                    break
+                ratings[threshold].append(position)
+        by_genre = defaultdict(list)
+        for movie_id, genre_id in MovieGenre.objects.values_list('movie_id', 'genre_id'):
+            if movie_id in position_of:
+                by_genre[genre_id].append(position_of[movie_id])
+        country_names = dict(Movie.COUNTRIES)
+        self.movie_ids = [movie[0] for movie in movies]
+        self.everything = (1 << size) - 1
+        self.genres = {slug: (name, to_bitmap(by_genre[genre_id], size))
+                       for genre_id, slug, name in Genre.objects.order_by('name').
+                       values_list('id', 'slug', 'name') if genre_id in by_genre}
+        self.countries = {code: (country_names.get(code, code), to_bitmap(members, size))
+                          for code, members in sorted(countries.items())}
+        self.directors = {slug: (name, to_bitmap(by_director[director_id], size))
+                          for director_id, slug, name in
+                          Director.objects.filter(id__in=by_director).order_by('name').
+                          values_list('id', 'slugged_name', 'name')}
+        self.years = {year: to_bitmap(members, size) for year, members in sorted(years.items())}
+        self.decades = {}
+        for year, members in self.years.items():
+            decade = year // 10 * 10
+            self.decades[decade] = self.decades.get(decade, 0) | members
+        self.ratings = {threshold: to_bitmap(members, size)
+                        for threshold, members in ratings.items()}
+
+    def years_bitmap(self, year_from, year_to):
+        result = 0
+        for year, members in self.years.items():
+            if (year_from is None or year >= year_from) and \
+                    (year_to is None or year <= year_to):
+                result |= members
+        return result
+
+    def bitmaps(self, filters):
+        """Bitmap of each facet's filter, everything when it is not set."""
+        genres = self.everything
+        for slug in filters.genres:
+            genres &= self.genres[slug][1]
+        return {
+            'genre': genres,
+            'country': self.countries[filters.country][1] if filters.country
+            else self.everything,
+            'director': self.directors[filters.director][1] if filters.director
+            else self.everything,
+            'year': self.years_bitmap(filters.year_from, filters.year_to)
+            if filters.year_from is not None or filters.year_to is not None
+            else self.everything,
+            'rating': self.ratings.get(filters.min_rating, 0) if filters.min_rating
+            else self.everything,
+        }
+
+    def browse(self, params, offset, limit):
+        filters = Filters(self, params)
+        bitmaps = self.bitmaps(filters)
+
+        def without(facet):
+            bitmap = self.everything
+            for name, other in bitmaps.items():
+                if name != facet:
+                    bitmap &= other
+            return bitmap
+
+        matching = without(None)
+        page = [self.movie_ids[position]
+                for position in positions(matching, offset, offset + limit)]
+        by_country, by_director = without('country'), without('director')
+        by_year, by_rating = without('year'), without('rating')
+        directors = [(slug, name, (bitmap & by_director).bit_count(),
+                      slug == filters.director)
+                     for slug, (name, bitmap) in self.directors.items()]
+        directors = sorted([director for director in directors if director[2] or director[3]],
+                           key=lambda director: (not director[3], -director[2], director[1]))
+        facets = {
+            'genre': [(slug, name, (bitmap & matching).bit_count(), slug in filters.genres)
+                      for slug, (name, bitmap) in self.genres.items()],
+            'country': [(code, name, (bitmap & by_country).bit_count(),
+                         code == filters.country)
+                        for code, (name, bitmap) in self.countries.items()],
+            'director': directors[:DIRECTORS_SHOWN],
+            'decade': [(decade, f'{decade}s', (bitmap & by_year).bit_count(),
+                        filters.year_from == decade and filters.year_to == decade + 9)
+                       for decade, bitmap in self.decades.items()],
+            'rating': [(threshold, f'{threshold}+', (self.ratings.get(threshold, 0) &
+                                                     by_rating).bit_count(),
+                        threshold == filters.min_rating)
+                       for threshold in RATING_THRESHOLDS],
+        }
+        return filters, page, matching.bit_count(), facets
+
+
+class FacetIndex:
+
+    def __init__(self):
+        self._facets = None
+        self._built_at = None
+        # Bumped by invalidate(), a build that started before is not
+        # marked built, so the index is rebuilt once more.
+        self._generation = 0
+        self._lock = Lock()
+        self._build_lock = Lock()
+
+    def build(self):
+        with self._lock:
+            generation = self._generation
+        facets = Facets()
+        with self._lock:
+            self._facets = facets
+            if generation == self._generation:
+                self._built_at = time.monotonic()
+
+    def invalidate(self):
+        """Drop the index, it is rebuilt on the next lookup."""
+        with self._lock:
+            self._generation += 1
+            self._built_at = None
+
+    def is_stale(self):
+        return self._built_at is None or \
+            time.monotonic() - self._built_at > FACETS_MAX_AGE
+
+    def ensure_built(self):
+        if not self.is_stale():
+            return
+        # Threads that find the index stale at the same time wait for the
+        # first one to rebuild it instead of all rebuilding it.
+        with self._build_lock:
+            if self.is_stale():
+                self.build()
+
+    def browse(self, params, offset=0, limit=24):
+        """
+        Filters, movie ids of the page, number of matching movies and the
+        facets, name -> list of (value, label, count, selected).
+        """
+        self.ensure_built()
+        return self._facets.browse(params, offset, limit)
+
+
+index = FacetIndex()
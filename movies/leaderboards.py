@@ -0,0 +1,104 @@
+"""
+Leaderboards of the catalog, globally and per genre and country.
+
+compute_leaderboards() ranks every movie from the rating aggregates kept
+on Movie (and the recent ratings for trending) in one pass and stores the
+first LEADERBOARD_SIZE of each board and scope in LeaderboardEntry, so
+pages and the API read a board with one indexed query. The task runner
+(`manage.py run_tasks`) runs it every LEADERBOARD_INTERVAL seconds,
+`manage.py compute_leaderboards` runs it at once.
+
+Boards:
+
+    top-rated   Bayesian average, the mean rating of the movie pulled
+                towards the mean of all ratings by PRIOR_RATINGS ratings,
+                so a movie with a single 10/10 does not win
+    most-rated  number of ratings
+    trending    ratings of the last TRENDING_DAYS days, each weighted by
+                0.5 ** (age / TRENDING_HALF_LIFE)
+
+Scopes are '' for the whole catalog, 'genre:<slug>' and 'country:<code>'.
+"""
+import datetime
+import heapq
+import math
+from collections import defaultdict
+from django.db import transaction
+from django.utils import timezone
+from movies import page_cache
+from movies.models import Movie, MovieGenre, Rating, LeaderboardEntry
+from movies.tasks import task
+
+LEADERBOARD_SIZE = 100
+PRIOR_RATINGS = 10
+TRENDING_DAYS = 30
+TRENDING_HALF_LIFE = 7
+LEADERBOARD_INTERVAL = 300
+
+BOARDS = {
+    'top-rated': 'Top rated',
+    'most-rated': 'Most rated',
+    'trending': 'Trending',
+}
+
+
+def scope_name(genre=None, country=None):
+    if genre:
+        return f'genre:{genre}'
+    if country:
+        return f'country:{country}'
+    return ''
+
+
+def trending_scores(now=None):
+    now = now or timezone.now()
+    scores = defaultdict(float)
+    decay = math.log(2) / (TRENDING_HALF_LIFE * 86400)
+    for movie_id, updated in Rating.objects.\
+            filter(updated__gte=now - datetime.timedelta(days=TRENDING_DAYS)).\
+            values_list('movie_id', 'updated').order_by().iterator(chunk_size=10000):
+        scores[movie_id] += math.exp(-decay * (now - updated).total_seconds())
+    return scores
+
+
+@task(every=LEADERBOARD_INTERVAL)
+def compute_leaderboards(size=LEADERBOARD_SIZE, prior=PRIOR_RATINGS):
+    """Recompute every board and scope, returns the number of entries."""
+    movies = list(Movie.objects.filter(rating_count__gt=0).
+                  values_list('id', 'country', 'rating_sum', 'rating_count'))
+    genres = defaultdict(list)
+    for movie_id, slug in MovieGenre.objects.values_list('movie_id', 'genre__slug'):
+        genres[movie_id].append(slug)
+    total = sum(movie[3] for movie in movies)
+    mean = sum(movie[2] for movie in movies) / total if total else 0
+    trending = trending_scores()
+    scores = {'top-rated': {}, 'most-rated': {}, 'trending': trending}
+    scopes = defaultdict(list)
+    for movie_id, country, rating_sum, rating_count in movies:
+        scores['top-rated'][movie_id] = (prior * mean + rating_sum) / (prior + rating_count)
+        scores['most-rated'][movie_id] = rating_count
+        scopes[''].append(movie_id)
+        scopes[scope_name(country=country)].append(movie_id)
+        for slug in genres[movie_id]:
+            scopes[scope_name(genre=slug)].append(movie_id)
+    entries = []
+    for board, board_scores in scores.items():
+        for scope, movie_ids in scopes.items():
+            ranked = heapq.nlargest(
+                size, (movie_id for movie_id in movie_ids if movie_id in board_scores),
+                key=lambda movie_id: (board_scores[movie_id], -movie_id))
+            entries.extend(
+                LeaderboardEntry(board=board, scope=scope, rank=rank, movie_id=movie_id,
+                                 score=board_scores[movie_id])
+                for rank, movie_id in enumerate(ranked, 1))
+    with transaction.atomic():
+        LeaderboardEntry.objects.all().delete()
+        LeaderboardEntry.objects.bulk_create(entries, batch_size=2000)
+        page_cache.invalidate('leaderboards')
+    return len(entries)
+
+
+def leaderboard(board, scope='', limit=LEADERBOARD_SIZE):
+    """Entries of a board with their movies, by rank."""
+    return LeaderboardEntry.objects.filter(board=board, scope=scope).\
+        select_related('movie')[:limit]
@@ -0,0 +1,179 @@
+import json
+import statistics
+import time
+import tracemalloc
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, \
+    teardown_test_environment
+from django.urls import reverse
+from movies.seeding import QUERY_STRINGS, ROUTES, Catalog, sample_objects, \
+    seed_catalog
+
+CATALOG_OPTIONS = ('movies', 'directors', 'actors', 'genres', 'users',
+                   'actors_per_movie', 'genres_per_movie', 'ratings_per_movie',
+                   'reviews_per_movie', 'seed')
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def percentile(sorted_samples, p):
+    if len(sorted_samples) == 1:
+        return sorted_samples[0]
+    return statistics.quantiles(sorted_samples, n=100, method='inclusive')[p - 1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a synthetic catalog into a throwaway test database, request every '
+        'route of movies and users as an anonymous and an authenticated visitor '
+        'and report p50/p95/p99 latency, queries and peak memory per route. '
+        'With --baseline, fail if a route got slower, heavier or runs more '
+        'queries than in a saved run.'
+    )
+
+    def add_arguments(self, parser):
+        defaults = Catalog(movies=1000, directors=100, actors=2000, genres=12,
+                           users=500, ratings_per_movie=20, reviews_per_movie=5)
+        for name in CATALOG_OPTIONS:
+            parser.add_argument(f'--{name.replace("_", "-")}', type=int,
+                                default=getattr(defaults, name))
+        parser.add_argument(
+            '--requests', type=int, default=50,
+            help='Timed requests per route and visitor.'
+        )
+        parser.add_argument(
+            '--page-cache', action='store_true',
+            help='Keep the anonymous page cache on, pages are rendered every time otherwise.'
+        )
+        parser.add_argument(
+            '--output', default='benchmark.json', help='Where to save the results.'
+        )
+        parser.add_argument(
+            '--baseline', help='Results of an earlier run to compare with.'
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=20.0,
+            help='Allowed growth of p95 latency and peak memory, in percent.'
+        )
+        parser.add_argument(
+            '--min-delta', type=float, default=2.0,
+            help='p95 latency growth in milliseconds that is always treated as noise.'
+        )
+
+    def measure(self, url, params, user, requests):
+        client = Client()
+        if user:
+            client.force_login(user)
+        response = client.get(url, params)
+        if response.status_code >= 500:
+            raise CommandError(f'{url} answered {response.status_code}')
+        samples = []
+        counter = QueryCounter()
+        for _ in range(requests):
+            if user:
+                # Logging in again keeps routes like logout authenticated.
+                client.force_login(user)
+            with connection.execute_wrapper(counter):
+                start = time.perf_counter()
+                client.get(url, params)
+                samples.append((time.perf_counter() - start) * 1000)
+        # Memory is traced in a separate request, tracing slows Python down.
+        if user:
+            client.force_login(user)
+        tracemalloc.start()
+        try:
+            client.get(url, params)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        samples.sort()
+        return {
+            'requests': requests,
+            'p50_ms': round(percentile(samples, 50), 3),
+            'p95_ms': round(percentile(samples, 95), 3),
+            'p99_ms': round(percentile(samples, 99), 3),
+            'queries': counter.count // requests,
+            'peak_memory_kb': round(peak / 1024, 1)
+        }
+
+    def run(self, sample, requests):
+        results = {}
+        for label, name, arguments, visitors in ROUTES:
+            url = reverse(name, args=arguments(sample))
+            params = QUERY_STRINGS.get(label, lambda c: {})(sample)
+            for visitor, user in (('anonymous', None), ('authenticated', sample['user'])):
+                if visitor not in visitors:
+                    continue
+                result = self.measure(url, params, user, requests)
+                results[f'{label} ({visitor})'] = result
+                self.stdout.write(
+                    f'{label + " (" + visitor + ")":<32}'
+                    f'p50 {result["p50_ms"]:>8.2f}  p95 {result["p95_ms"]:>8.2f}  '
+                    f'p99 {result["p99_ms"]:>8.2f} ms  queries {result["queries"]:>3}  '
+                    f'peak {result["peak_memory_kb"]:>8.1f} KiB'
+                )
+        return results
+
+    def compare(self, results, baseline, threshold, min_delta):
+        regressions = []
+        allowed = 1 + threshold / 100
+        for route, result in results.items():
+            old = baseline['routes'].get(route)
+            if old is None:
+                continue
+            if result['queries'] > old['queries']:
+                regressions.append(f'{route}: {result["queries"]} queries, '
+                                   f'was {old["queries"]}')
+            if result['p95_ms'] > max(old['p95_ms'] * allowed, old['p95_ms'] + min_delta):
+                regressions.append(f'{route}: p95 {result["p95_ms"]} ms, '
+                                   f'was {old["p95_ms"]} ms')
+            if result['peak_memory_kb'] > old['peak_memory_kb'] * allowed:
+                regressions.append(f'{route}: peak memory {result["peak_memory_kb"]} KiB, '
+                                   f'was {old["peak_memory_kb"]} KiB')
+        return regressions
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+        catalog = Catalog(**{name: options[name] for name in CATALOG_OPTIONS})
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            start = time.perf_counter()
+            sample = sample_objects(seed_catalog(catalog, prefix='bench'))
+            self.stdout.write(f'Seeded the catalog in {time.perf_counter() - start:.1f}s')
+            with override_settings(PAGE_CACHE_ENABLED=options['page_cache']):
+                results = self.run(sample, options['requests'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        with open(options['output'], 'w') as file:
+            json.dump({
+                'database': connection.vendor,
+                'catalog': vars(catalog),
+                'page_cache': options['page_cache'],
+                'routes': results
+            }, file, indent=2)
+        self.stdout.write(f'Results were saved to {options["output"]}')
+        if baseline is None:
+            return
+        if baseline.get('catalog') != vars(catalog):
+            self.stdout.write(self.style.WARNING(
+                'The baseline was measured on a different catalog'))
+        regressions = self.compare(results, baseline, options['threshold'],
+                                   options['min_delta'])
+        if regressions:
+            raise CommandError('Regressions against the baseline:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
@@ -0,0 +1,111 @@
+import copy
+import statistics
+import time
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+from django.test.utils import override_settings, setup_test_environment, \
+    teardown_test_environment
+from movies.models import Movie
+from movies.seeding import Catalog, seed_catalog
+
+STORAGES = {
+    'local': 'django.core.files.storage.FileSystemStorage',
+    'cloudinary': 'cloudinary_storage.storage.MediaCloudinaryStorage',
+}
+
+
+class StorageCallCounter:
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.url = storage.url
+        self.count = 0
+
+    def __call__(self, name):
+        self.count += 1
+        return self.url(name)
+
+
+class Command(BaseCommand):
+    help = (
+        'Render the genre page template with a number of movie cards, with the '
+        'image URLs stored on the rows and with every URL resolved by the '
+        'storage at render time as before, and report the render times and '
+        'storage calls. Runs on a throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cards', type=int, default=500)
+        parser.add_argument('--renders', type=int, default=20,
+                            help='Timed renders of each variant.')
+        parser.add_argument('--storage', choices=['configured', *STORAGES],
+                            default='configured',
+                            help='File storage to resolve URLs with.')
+
+    def handle(self, *args, **options):
+        storage = STORAGES.get(options['storage'])
+        settings = {'DEFAULT_FILE_STORAGE': storage} if storage else {}
+        if options['storage'] == 'cloudinary':
+            import cloudinary
+            # Configures cloudinary from CLOUDINARY_STORAGE when imported.
+            import cloudinary_storage.storage  # noqa: F401
+            if not cloudinary.config().cloud_name:
+                # URLs are built locally, nothing is uploaded.
+                cloudinary.config(cloud_name='benchmark')
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(**settings):
+                storage_name = default_storage.__class__.__name__
+                results = self.run(options['cards'], options['renders'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        self.stdout.write(f'{options["cards"]} cards, {storage_name}')
+        for variant, (times, calls) in results.items():
+            median = statistics.median(times)
+            self.stdout.write(
+                f'{variant:<10} median {median * 1000:8.1f} ms  '
+                f'{median / options["cards"] * 1e6:6.1f} us/card  '
+                f'{calls} storage calls per render'
+            )
+
+    def run(self, cards, renders):
+        seed_catalog(Catalog(movies=cards, directors=max(2, cards // 10), actors=20,
+                             genres=1, genres_per_movie=1, users=30, actors_per_movie=1,
+                             ratings_per_movie=2, reviews_per_movie=0), prefix='cards')
+        movies = list(Movie.objects.select_related('director').
+                      prefetch_related('genres').order_by('title', 'id'))
+        if not movies or not movies[0].poster_url:
+            raise CommandError('The seeded movies have no stored poster URL')
+        genre = movies[0].genres.all()[0]
+        # The URLs as rows saved before they were stored, resolved by the
+        # storage for every card like {{ movie.poster.url }} did.
+        unresolved = []
+        for movie in movies:
+            movie = copy.copy(movie)
+            movie.poster_url = ''
+            unresolved.append(movie)
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        counter = StorageCallCounter(default_storage)
+        default_storage.url = counter
+        results = {}
+        try:
+            for variant, objects in (('resolved', unresolved), ('stored', movies)):
+                context = {'movies': objects, 'genre': genre, 'number_of_movies': len(objects)}
+                render_to_string('movies/movies_by_genre.html', context, request)
+                times = []
+                counter.count = 0
+                for _ in range(renders):
+                    start = time.perf_counter()
+                    render_to_string('movies/movies_by_genre.html', context, request)
+                    times.append(time.perf_counter() - start)
+                results[variant] = (times, counter.count // renders)
+        finally:
+            del default_storage.url
+        return results
@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from movies.leaderboards import LEADERBOARD_SIZE, PRIOR_RATINGS, compute_leaderboards
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the top rated, most rated and trending leaderboards of the '
+        'whole catalog, of each genre and of each country. The task runner '
+        '(run_tasks) does it every few minutes, this command does it now.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=LEADERBOARD_SIZE,
+                            help='Movies kept per leaderboard.')
+        parser.add_argument('--prior', type=int, default=PRIOR_RATINGS,
+                            help='Weight of the mean of all ratings in the top rated '
+                                 'leaderboard, in ratings.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        entries = compute_leaderboards(options['size'], options['prior'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Computed {entries} leaderboard entries in {time.perf_counter() - start:.1f}s'
+        ))
@@ -0,0 +1,89 @@
+import time
+import tracemalloc
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from movies import recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        'Compute the movies most similar to each movie from the ratings '
+        '(item-item collaborative filtering) and store them for the movie '
+        'pages. By default only movies rated since the last run and the movies '
+        'listing them are refreshed, which misses deleted ratings, a full run is '
+        'done when there is no previous one or with --full. The task runner '
+        '(run_tasks) does a full run every day. '
+        'With --benchmark, time the computation on a synthetic rating matrix '
+        'instead, nothing is read from or written to the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Recompute every movie.')
+        parser.add_argument('--top-k', type=int, default=recommendations.TOP_K)
+        parser.add_argument('--shrinkage', type=float, default=recommendations.SHRINKAGE)
+        parser.add_argument('--benchmark', action='store_true')
+        parser.add_argument('--users', type=int, default=200000,
+                            help='Users of the synthetic matrix.')
+        parser.add_argument('--movies', type=int, default=20000,
+                            help='Movies of the synthetic matrix.')
+        parser.add_argument('--ratings', type=int, default=5000000,
+                            help='Ratings of the synthetic matrix.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            if options['benchmark']:
+                self.benchmark(options)
+            else:
+                self.compute(options)
+        except ImproperlyConfigured as error:
+            raise CommandError(error)
+
+    def compute(self, options):
+        since = None if options['full'] else recommendations.last_computed()
+        movie_ids = None
+        if since is not None:
+            movie_ids = recommendations.changed_movies(since)
+            if not movie_ids:
+                self.stdout.write('No movie was rated since the last run')
+                return
+        start = time.perf_counter()
+        refreshed = recommendations.compute_similar_movies(
+            movie_ids, options['top_k'], options['shrinkage'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Refreshed the similar movies of {refreshed} movie(s) '
+            f'in {time.perf_counter() - start:.1f}s'
+        ))
+
+    def benchmark(self, options):
+        np, _ = recommendations.require_scipy()
+        rng = np.random.default_rng(options['seed'])
+        users, movies = options['users'], options['movies']
+        # Popularity of movies and activity of users follow a power law,
+        # like real ratings; repeated (user, movie) pairs are dropped.
+        owners = (rng.pareto(1.5, options['ratings']) * users / 20).astype(np.int64) % users
+        rated = (rng.pareto(1.2, options['ratings']) * movies / 50).astype(np.int64) % movies
+        pairs = np.unique(owners * movies + rated)
+        owners, rated = pairs // movies, pairs % movies
+        ratings = rng.integers(0, 11, len(pairs))
+        self.stdout.write(f'{len(pairs)} ratings of {len(np.unique(rated))} movies '
+                          f'by {len(np.unique(owners))} users')
+        tracemalloc.start()
+        try:
+            start = time.perf_counter()
+            matrix, _ = recommendations.build_matrix(owners, rated, ratings)
+            built = time.perf_counter()
+            neighbours = 0
+            for _, columns, _ in recommendations.top_k_neighbours(
+                    matrix, options['top_k'], shrinkage=options['shrinkage']):
+                neighbours += len(columns)
+            done = time.perf_counter()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.stdout.write(
+            f'matrix {built - start:.2f}s, neighbours {done - built:.2f}s '
+            f'({matrix.shape[1] / (done - built):.0f} movies/s), '
+            f'{neighbours} neighbours, peak memory {peak / 2 ** 20:.0f} MiB'
+        )
@@ -0,0 +1,42 @@
+import datetime
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from movies import exports
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream all ratings or reviews as NDJSON or CSV to a file or stdout, '
+        'in constant memory, optionally gzip-compressed and filtered by movie '
+        'and by the date of their last change.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(exports.EXPORTS))
+        parser.add_argument('--format', choices=sorted(exports.FORMATS), default='ndjson')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--movie', type=int, help='Id of a movie.')
+        parser.add_argument('--since', type=datetime.date.fromisoformat,
+                            help='YYYY-MM-DD, rows changed on or after it.')
+        parser.add_argument('--until', type=datetime.date.fromisoformat,
+                            help='YYYY-MM-DD, rows changed on or before it.')
+        parser.add_argument('--output', help='File to write, stdout by default.')
+
+    def handle(self, *args, **options):
+        rows = exports.export_rows(options['kind'], options['movie'],
+                                   options['since'], options['until'])
+        chunks = exports.encode(
+            exports.render(options['kind'], rows, options['format']), options['gzip'])
+        if options['output']:
+            try:
+                file = open(options['output'], 'wb')
+            except OSError as error:
+                raise CommandError(error)
+        else:
+            file = sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                file.write(chunk)
+        finally:
+            if options['output']:
+                file.close()
@@ -0,0 +1,32 @@
+import time
+from django.core.management.base import BaseCommand
+from movies.thumbnails import IMAGE_FIELDS, generate, missing
+
+
+class Command(BaseCommand):
+    help = (
+        'Make the missing or out of date renditions of movie posters and of '
+        'director and actor photos. Saves in the admin make them in the task '
+        'queue, this catches up on images inserted in bulk or whose '
+        'renditions failed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Remake the renditions of every image, e.g. after '
+                                 'changing their sizes.')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        done, failed = 0, 0
+        for model in IMAGE_FIELDS:
+            for obj in missing(model, everything=options['all']):
+                try:
+                    done += generate(obj)
+                except (OSError, ValueError) as error:
+                    failed += 1
+                    self.stderr.write(f'{model.__name__} {obj.pk}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Made the renditions of {done} image(s) in '
+            f'{time.perf_counter() - start:.1f}s, {failed} failed'
+        ))
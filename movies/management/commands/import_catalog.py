@@ -0,0 +1,288 @@
+import csv
+import datetime
+import io
+import json
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.template.defaultfilters import slugify
+from movies import autocomplete, facets, page_cache
+from movies.models import Movie, Director, Actor, Genre, MovieGenre, \
+    update_genre_counts
+from movies.related import rebuild_related_movies
+from movies.search import index_objects
+
+COUNTRY_CODES = {code for code, _ in Movie.COUNTRIES}
+MOVIE_FIELDS = ['title', 'synopsis', 'release_date', 'country', 'poster', 'director']
+
+
+def read_records(file, file_format):
+    """Yield the records of a CSV or NDJSON file one at a time."""
+    text = io.TextIOWrapper(file, encoding='utf-8', newline='')
+    if file_format == 'csv':
+        yield from csv.DictReader(text)
+        return
+    for line in text:
+        if line.strip():
+            try:
+                record = json.loads(line)
+            except ValueError as error:
+                yield {'_error': f'invalid JSON ({error})'}
+                continue
+            if isinstance(record, dict):
+                yield record
+            else:
+                yield {'_error': f'expected a JSON object, got {type(record).__name__}'}
+
+
+def as_text(record, field):
+    value = record.get(field)
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f'{field} must be a string')
+    return value or ''
+
+
+def as_list(value, separator):
+    if isinstance(value, list):
+        names = value
+    else:
+        names = (value or '').split(separator)
+    if not all(isinstance(name, str) for name in names):
+        raise ValueError('actors and genres must be names')
+    return [name.strip() for name in names if name and name.strip()]
+
+
+class CatalogImporter:
+    """
+    Upserts batches of catalog records. Directors, actors and genres are
+    looked up by name once and kept in name -> (id, slug) maps, so a name
+    that appears in many records costs one lookup for the whole import.
+    """
+
+    def __init__(self, default_image, separator, replace_relations):
+        self.default_image = default_image
+        self.separator = separator
+        self.replace_relations = replace_relations
+        self.maps = {Director: {}, Actor: {}, Genre: {}}
+
+    def clean(self, record):
+        if '_error' in record:
+            raise ValueError(record['_error'])
+        title = as_text(record, 'title').strip()
+        director = as_text(record, 'director').strip()
+        if not title or not director:
+            raise ValueError('title and director are required')
+        country = as_text(record, 'country').strip().upper()
+        if country not in COUNTRY_CODES:
+            raise ValueError(f'unknown country {country!r}')
+        return {
+            'title': title,
+            'slug': slugify(title),
+            'synopsis': as_text(record, 'synopsis'),
+            'release_date': datetime.date.fromisoformat(as_text(record, 'release_date')),
+            'country': country,
+            'poster': as_text(record, 'poster') or self.default_image,
+            'director': director,
+            'director_photo': as_text(record, 'director_photo') or self.default_image,
+            'actors': as_list(record.get('actors'), self.separator),
+            'genres': as_list(record.get('genres'), self.separator),
+        }
+
+    def resolve(self, model, photos):
+        """Map names (with the photo of new ones) to (id, slug), creating missing rows."""
+        cache = self.maps[model]
+        slug_field = 'slug' if model is Genre else 'slugged_name'
+        missing = [name for name in photos if name not in cache]
+        if not missing:
+            return
+        for name, pk, slug in model.objects.filter(name__in=missing).\
+                values_list('name', 'id', slug_field):
+            cache[name] = (pk, slug)
+        new = [name for name in missing if name not in cache]
+        if model is Genre:
+            rows = [Genre(name=name, slug=slugify(name)) for name in new]
+        else:
+            rows = [model(name=name, slugged_name=slugify(name), photo=photos[name])
+                    for name in new]
+        # A concurrent import may have created some of them meanwhile, rows
+        # whose slug is taken by another name are left out and reported.
+        model.objects.bulk_create(rows, ignore_conflicts=True)
+        for name, pk, slug in model.objects.filter(name__in=new).\
+                values_list('name', 'id', slug_field):
+            cache[name] = (pk, slug)
+
+    def import_batch(self, records):
+        """Upsert one batch, returns a list of errors of skipped records."""
+        errors = []
+        cleaned = {}
+        for number, record in records:
+            try:
+                movie = self.clean(record)
+            except (ValueError, TypeError) as error:
+                errors.append(f'record {number}: {error}')
+                continue
+            # The last record of a movie wins within a batch.
+            cleaned[movie['slug']] = movie
+        movies = list(cleaned.values())
+        self.resolve(Director, {movie['director']: movie['director_photo'] for movie in movies})
+        self.resolve(Actor, {name: self.default_image
+                             for movie in movies for name in movie['actors']})
+        self.resolve(Genre, {name: None for movie in movies for name in movie['genres']})
+        directors, actors, genres = self.maps[Director], self.maps[Actor], self.maps[Genre]
+        rows = []
+        for movie in movies:
+            if movie['director'] not in directors:
+                errors.append(f'{movie["title"]}: director slug is taken by another name')
+                continue
+            rows.append(Movie(
+                title=movie['title'], slug=movie['slug'], synopsis=movie['synopsis'],
+                release_date=movie['release_date'], country=movie['country'],
+                poster=movie['poster'], director_id=directors[movie['director']][0]
+            ))
+        Movie.objects.bulk_create(
+            rows, update_conflicts=True, unique_fields=['slug'],
+            update_fields=[field for field in MOVIE_FIELDS if field != 'director'] +
+            ['director_id', 'poster_url']
+        )
+        movie_ids = dict(Movie.objects.filter(slug__in=[row.slug for row in rows]).
+                         values_list('slug', 'id'))
+        Through = Movie.actors.through
+        tags = {'genres', 'search'}
+        if self.replace_relations:
+            # Pages of the actors and genres the movies are removed from.
+            tags.update(f'actor:{slug}' for slug in Through.objects.
+                        filter(movie_id__in=movie_ids.values()).
+                        values_list('actor__slugged_name', flat=True))
+            tags.update(f'genre:{slug}' for slug in MovieGenre.objects.
+                        filter(movie_id__in=movie_ids.values()).
+                        values_list('genre__slug', flat=True))
+            # Deleted without the per-row signals, like the inserts below:
+            # the movies are reindexed and the genre counts updated once
+            # for the whole import.
+            Through.objects.filter(movie_id__in=movie_ids.values()).\
+                _raw_delete(Through.objects.db)
+            MovieGenre.objects.filter(movie_id__in=movie_ids.values()).\
+                _raw_delete(MovieGenre.objects.db)
+        cast, movie_genres = [], []
+        for movie in movies:
+            movie_id = movie_ids.get(movie['slug'])
+            if movie_id is None:
+                continue
+            tags.update((f'movie:{movie_id}', f'movie:{movie["slug"]}',
+                         f'director:{directors[movie["director"]][1]}'))
+            for name in movie['actors']:
+                if name in actors:
+                    cast.append(Through(movie_id=movie_id, actor_id=actors[name][0]))
+                    tags.add(f'actor:{actors[name][1]}')
+            for name in movie['genres']:
+                if name in genres:
+                    movie_genres.append(MovieGenre(movie_id=movie_id,
+                                                   genre_id=genres[name][0]))
+                    tags.add(f'genre:{genres[name][1]}')
+        Through.objects.bulk_create(cast, ignore_conflicts=True)
+        MovieGenre.objects.bulk_create(movie_genres, ignore_conflicts=True)
+        # bulk_create bypasses the signals that keep the search documents
+        # and the page cache up to date.
+        index_objects(Movie.objects.filter(id__in=movie_ids.values()).
+                      select_related('director').prefetch_related('actors'))
+        index_objects(Director.objects.filter(
+            name__in={movie['director'] for movie in movies}))
+        index_objects(Actor.objects.filter(
+            name__in={name for movie in movies for name in movie['actors']}))
+        page_cache.invalidate(*tags)
+        return errors
+
+
+class Command(BaseCommand):
+    help = (
+        'Import a catalog from a CSV or NDJSON file in batches, creating or '
+        'updating directors, actors, genres and movies (matched by slug). Fields: '
+        'title, synopsis, release_date (YYYY-MM-DD), country (e.g. US), director, '
+        'actors and genres (lists, or separated by --separator in CSV), and '
+        'optionally poster and director_photo, names of already uploaded files.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('csv', 'ndjson'),
+                            help='Guessed from the extension of the file by default.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--separator', default='|',
+                            help='Separator of actors and genres in CSV files.')
+        parser.add_argument('--default-image', default='movies/images/default.jpg',
+                            help='Poster and photo of records that do not name one.')
+        parser.add_argument('--replace-relations', action='store_true',
+                            help='Replace the actors and genres of existing movies '
+                                 'instead of adding to them.')
+        parser.add_argument('--checkpoint',
+                            help='Progress file, <path>.checkpoint by default.')
+        parser.add_argument('--resume', action='store_true',
+                            help='Skip the records imported before the checkpoint.')
+
+    def save_checkpoint(self, path, source, records):
+        with open(path + '.tmp', 'w') as file:
+            json.dump({'source': source, 'records': records}, file)
+        os.replace(path + '.tmp', path)
+
+    def import_batch(self, importer, batch):
+        """Import a batch, write its errors and return how many records were skipped."""
+        with transaction.atomic():
+            errors = importer.import_batch(batch)
+        for error in errors:
+            self.stderr.write(error)
+        return len(errors)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or \
+            ('csv' if path.lower().endswith('.csv') else 'ndjson')
+        checkpoint = options['checkpoint'] or path + '.checkpoint'
+        source = os.path.abspath(path)
+        skip = 0
+        if options['resume'] and os.path.exists(checkpoint):
+            with open(checkpoint) as file:
+                saved = json.load(file)
+            if saved['source'] != source:
+                raise CommandError(f'{checkpoint} belongs to {saved["source"]}')
+            skip = saved['records']
+            self.stdout.write(f'Resuming after record {skip}')
+        importer = CatalogImporter(options['default_image'], options['separator'],
+                                   options['replace_relations'])
+        size = os.path.getsize(path)
+        # Errors are written out batch by batch and only counted, a file
+        # of any size is imported in constant memory.
+        skipped = 0
+        done = skip
+        start = time.perf_counter()
+        with open(path, 'rb') as file:
+            batch = []
+            for number, record in enumerate(read_records(file, file_format), 1):
+                if number <= skip:
+                    continue
+                batch.append((number, record))
+                if len(batch) < options['batch_size']:
+                    continue
+                skipped += self.import_batch(importer, batch)
+                done = number
+                self.save_checkpoint(checkpoint, source, done)
+                batch = []
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f'{done} records ({file.tell() / max(size, 1):.0%}), '
+                    f'{(done - skip) / elapsed:.0f} records/s, {skipped} skipped'
+                )
+            if batch:
+                skipped += self.import_batch(importer, batch)
+                done = batch[-1][0]
+        update_genre_counts()
+        rebuild_related_movies()
+        autocomplete.index.invalidate()
+        facets.index.invalidate()
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {done - skip - skipped} record(s) in {elapsed:.1f}s, '
+            f'skipped {skipped}'
+        ))
@@ -0,0 +1,421 @@
+import io
+import json
+import multiprocessing
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.urls import reverse
+from movies.models import Movie, Genre
+from movies.seeding import SEED_PASSWORD, WORDS, Catalog, seed_catalog
+
+# Weights of the actions of a virtual visitor, mostly anonymous reads.
+TRAFFIC_MIX = {
+    'index': 15,
+    'genre': 20,
+    'detail': 30,
+    'search': 15,
+    'reviews': 8,
+    'login': 4,
+    'rate': 5,
+    'review': 3,
+}
+
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+_opened = [0]
+_opened_lock = threading.Lock()
+
+
+def count_connection(sender, **kwargs):
+    with _opened_lock:
+        _opened[0] += 1
+
+
+connection_created.connect(count_connection)
+
+
+class WSGIClient:
+    """Calls a WSGI application directly, keeping cookies between requests."""
+
+    def __init__(self, application, host):
+        self.application = application
+        self.host = host
+        self.cookies = SimpleCookie()
+
+    def cookie(self, name):
+        return self.cookies[name].value if name in self.cookies else None
+
+    def request(self, method, path, data=None):
+        body = urlencode(data).encode() if data else b''
+        url = urlsplit(path)
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': url.path,
+            'QUERY_STRING': url.query,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'HTTP_HOST': self.host,
+            'HTTP_COOKIE': '; '.join(
+                f'{name}={morsel.value}' for name, morsel in self.cookies.items()),
+            'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split()[0])
+            started['headers'] = headers
+
+        result = self.application(environ, start_response)
+        try:
+            for _ in result:
+                pass
+        finally:
+            # Sends request_finished, which closes the database connection
+            # the same way a WSGI server does.
+            if hasattr(result, 'close'):
+                result.close()
+        for header, value in started['headers']:
+            if header.lower() == 'set-cookie':
+                cookie = SimpleCookie(value)
+                for name, morsel in cookie.items():
+                    if morsel.value:
+                        self.cookies[name] = morsel.value
+                    else:
+                        self.cookies.pop(name, None)
+        return started['status']
+
+
+class HTTPClient:
+    """Sends requests to a running server, e.g. gunicorn."""
+
+    def __init__(self, url):
+        import requests
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+
+    def cookie(self, name):
+        return self.session.cookies.get(name)
+
+    def request(self, method, path, data=None):
+        response = self.session.request(method, self.url + path, data=data,
+                                        allow_redirects=False, timeout=30)
+        return response.status_code
+
+
+class Visitor:
+    """One virtual visitor, picking weighted actions until the time is up."""
+
+    def __init__(self, client, plan, rng):
+        self.client = client
+        self.plan = plan
+        self.rng = rng
+        self.logged_in = False
+
+    def post(self, path, data):
+        data = dict(data, csrfmiddlewaretoken=self.client.cookie('csrftoken') or '')
+        return self.client.request('POST', path, data)
+
+    def index(self):
+        return self.client.request('GET', self.plan['index']) == 200
+
+    def genre(self):
+        return self.client.request('GET', self.rng.choice(self.plan['genres'])) == 200
+
+    def detail(self):
+        return self.client.request('GET', self.rng.choice(self.plan['movies'])[1]) == 200
+
+    def search(self):
+        query = urlencode({'q': self.rng.choice(WORDS)})
+        return self.client.request('GET', f'{self.plan["search"]}?{query}') == 200
+
+    def reviews(self):
+        movie_id = self.rng.choice(self.plan['movies'])[0]
+        return self.client.request('GET', self.plan['reviews'].format(movie_id)) == 200
+
+    def login(self):
+        if not self.plan['users']:
+            return self.index()
+        self.client.request('GET', self.plan['login'])
+        status = self.post(self.plan['login'], {
+            'username': self.rng.choice(self.plan['users']), 'password': SEED_PASSWORD
+        })
+        self.logged_in = status == 302
+        return self.logged_in
+
+    def rate(self):
+        if not self.logged_in and not self.login():
+            return False
+        movie_id = self.rng.choice(self.plan['movies'])[0]
+        # Movies rated earlier redirect with a message instead.
+        return self.post(self.plan['rate'].format(movie_id),
+                         {'rating': self.rng.randint(0, 10)}) == 302
+
+    def review(self):
+        if not self.logged_in and not self.login():
+            return False
+        movie_id = self.rng.choice(self.plan['movies'])[0]
+        content = ' '.join(self.rng.choice(WORDS) for _ in range(20))
+        return self.post(self.plan['review'].format(movie_id), {'content': content}) == 302
+
+
+def make_client(options):
+    if options['url']:
+        return HTTPClient(options['url'])
+    from cookie.wsgi import application
+    return WSGIClient(application, options['host'])
+
+
+def run_visitor(options, plan, seed):
+    """Samples of (action, latency in ms, ok) of one visitor, plus the
+    number of database connections opened in this process meanwhile."""
+    opened = _opened[0]
+    rng = random.Random(seed)
+    visitor = Visitor(make_client(options), plan, rng)
+    actions, weights = zip(*TRAFFIC_MIX.items())
+    samples = []
+    deadline = time.monotonic() + options['duration']
+    while time.monotonic() < deadline:
+        action = rng.choices(actions, weights)[0]
+        start = time.perf_counter()
+        try:
+            ok = getattr(visitor, action)()
+        except Exception:
+            ok = False
+        samples.append((action, (time.perf_counter() - start) * 1000, ok))
+    connection.close()
+    return samples, _opened[0] - opened
+
+
+class ConnectionSampler(threading.Thread):
+    """Samples the number of connections to the database on PostgreSQL."""
+
+    def __init__(self, interval=0.5):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        'SELECT COUNT(*) FROM pg_stat_activity '
+                        'WHERE datname = current_database()')
+                    # Not counting the connection of the sampler itself.
+                    self.samples.append(cursor.fetchone()[0] - 1)
+                self.stopped.wait(self.interval)
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def wait_for_port(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise CommandError(f'Nothing is listening on {host}:{port}')
+
+
+def percentile(sorted_samples, p):
+    if len(sorted_samples) == 1:
+        return sorted_samples[0]
+    return statistics.quantiles(sorted_samples, n=100, method='inclusive')[p - 1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Run a weighted mix of virtual visitors (mostly anonymous reads, some '
+        'logins, ratings and reviews) concurrently against cookie.wsgi.application, '
+        'in this process or through a running or locally launched gunicorn, and '
+        'report throughput, latency histograms, error rates and database '
+        'connection usage. It writes to the configured database, do not point it '
+        'at production.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=30,
+                            help='Seconds every visitor keeps sending requests.')
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help='Number of concurrent visitors.')
+        parser.add_argument('--pool', choices=('thread', 'process'), default='thread',
+                            help='Run visitors in threads or in forked processes.')
+        parser.add_argument('--url', help='Base URL of a running server, e.g. '
+                            'http://127.0.0.1:8000. The app is called in process otherwise.')
+        parser.add_argument('--gunicorn-workers', type=int,
+                            help='Launch gunicorn with this many workers and load it.')
+        parser.add_argument('--gunicorn-threads', type=int, default=1)
+        parser.add_argument('--port', type=int, default=8765,
+                            help='Port of the launched gunicorn.')
+        parser.add_argument('--host', default='127.0.0.1',
+                            help='Host header of in-process requests, see ALLOWED_HOSTS.')
+        parser.add_argument('--seed-movies', type=int, default=0,
+                            help='Seed a synthetic catalog of this many movies first.')
+        parser.add_argument('--user-prefix', default='load',
+                            help='Visitors log in as the seeded users <prefix>_user_<n>.')
+        parser.add_argument('--output', help='Save the results as JSON.')
+
+    def plan(self, options):
+        prefix = options['user_prefix']
+        if options['seed_movies']:
+            size = options['seed_movies']
+            seed_catalog(Catalog(movies=size, directors=max(2, size // 10),
+                                 actors=size, genres=12, users=max(30, size // 5)),
+                         prefix=prefix)
+        movies = [(movie_id, reverse('movies:movie-detail', args=(slug, )))
+                  for movie_id, slug in Movie.objects.values_list('id', 'slug')[:5000]]
+        genres = [reverse('movies:genre-movies', args=(slug, ))
+                  for slug in Genre.objects.values_list('slug', flat=True)[:500]]
+        if not movies or not genres:
+            raise CommandError('There are no movies to load, use --seed-movies')
+        users = list(get_user_model().objects.
+                     filter(username__startswith=f'{prefix}_user_').
+                     values_list('email', flat=True)[:1000])
+        if not users:
+            self.stdout.write(self.style.WARNING(
+                f'No {prefix}_user_<n> users, visitors will not log in, rate or review'))
+        return {
+            'index': reverse('movies:index'),
+            'search': reverse('movies:search'),
+            'login': reverse('users:login'),
+            'reviews': reverse('movies:review-list', args=(0, )).replace('/0/', '/{}/'),
+            'rate': reverse('movies:rate-movie', args=(0, )).replace('/0/', '/{}/'),
+            'review': reverse('movies:review-movie', args=(0, )).replace('/0/', '/{}/'),
+            'movies': movies, 'genres': genres, 'users': users
+        }
+
+    def run(self, options, plan):
+        concurrency = options['concurrency']
+        if options['pool'] == 'process':
+            # Forked processes must not share the parent's database connection.
+            connections.close_all()
+            executor = ProcessPoolExecutor(
+                concurrency, mp_context=multiprocessing.get_context('fork'))
+        else:
+            executor = ThreadPoolExecutor(concurrency)
+        opened = _opened[0]
+        with executor:
+            futures = [executor.submit(run_visitor, options, plan, seed)
+                       for seed in range(concurrency)]
+            results = [future.result() for future in futures]
+        samples = [sample for visitor_samples, _ in results for sample in visitor_samples]
+        if options['pool'] == 'process':
+            opened = sum(visitor_opened for _, visitor_opened in results)
+        else:
+            opened = _opened[0] - opened
+        return samples, opened
+
+    def summarize(self, samples, elapsed):
+        by_action = {}
+        for action, latency, ok in samples:
+            by_action.setdefault(action, []).append((latency, ok))
+        summary = {'requests': len(samples),
+                   'throughput': round(len(samples) / elapsed, 1),
+                   'errors': sum(not ok for _, _, ok in samples),
+                   'actions': {}}
+        for action in TRAFFIC_MIX:
+            if action not in by_action:
+                continue
+            latencies = sorted(latency for latency, _ in by_action[action])
+            histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+            for latency in latencies:
+                bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS)
+                               if latency <= bound), len(LATENCY_BUCKETS_MS))
+                histogram[bucket] += 1
+            summary['actions'][action] = {
+                'requests': len(latencies),
+                'errors': sum(not ok for _, ok in by_action[action]),
+                'p50_ms': round(percentile(latencies, 50), 2),
+                'p95_ms': round(percentile(latencies, 95), 2),
+                'p99_ms': round(percentile(latencies, 99), 2),
+                'histogram': histogram
+            }
+        return summary
+
+    def report(self, summary):
+        self.stdout.write(
+            f'{summary["requests"]} actions, {summary["throughput"]}/s, '
+            f'{summary["errors"]} errors '
+            f'({summary["errors"] / max(summary["requests"], 1):.2%})'
+        )
+        for action, result in summary['actions'].items():
+            self.stdout.write(
+                f'\n{action:<8} {result["requests"]:>7} actions  '
+                f'{result["errors"]:>5} errors  p50 {result["p50_ms"]:>8.2f}  '
+                f'p95 {result["p95_ms"]:>8.2f}  p99 {result["p99_ms"]:>8.2f} ms'
+            )
+            labels = [f'<= {bound} ms' for bound in LATENCY_BUCKETS_MS] + \
+                [f'> {LATENCY_BUCKETS_MS[-1]} ms']
+            for label, count in zip(labels, result['histogram']):
+                if count:
+                    bar = '#' * max(1, round(40 * count / result['requests']))
+                    self.stdout.write(f'    {label:>12} {count:>7} {bar}')
+        connections_used = summary['connections']
+        if connections_used['opened'] is not None:
+            self.stdout.write(f'\nDatabase connections opened: {connections_used["opened"]}')
+        if connections_used['peak'] is not None:
+            self.stdout.write(f'Database connections open at peak: {connections_used["peak"]}')
+
+    def handle(self, *args, **options):
+        plan = self.plan(options)
+        server = None
+        if options['gunicorn_workers']:
+            server = subprocess.Popen([
+                sys.executable, '-m', 'gunicorn', 'cookie.wsgi:application',
+                '--workers', str(options['gunicorn_workers']),
+                '--threads', str(options['gunicorn_threads']),
+                '--bind', f'127.0.0.1:{options["port"]}'
+            ])
+            options['url'] = f'http://127.0.0.1:{options["port"]}'
+            wait_for_port('127.0.0.1', options['port'])
+        sampler = ConnectionSampler() if connection.vendor == 'postgresql' else None
+        try:
+            if sampler:
+                sampler.start()
+            start = time.perf_counter()
+            samples, opened = self.run(options, plan)
+            elapsed = time.perf_counter() - start
+        finally:
+            if sampler:
+                sampler.stop()
+            if server:
+                server.terminate()
+                server.wait()
+        summary = self.summarize(samples, elapsed)
+        summary['connections'] = {
+            # Connections opened by a separate server are not seen from here.
+            'opened': None if options['url'] else opened,
+            'peak': max(sampler.samples, default=None) if sampler else None
+        }
+        self.report(summary)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(summary, file, indent=2)
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from movies import page_cache
+
+
+class Command(BaseCommand):
+    help = (
+        'Show the hit, miss and stale counters of the anonymous page cache. '
+        'Counters are per process unless the cache backend is shared.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset', action='store_true', help='Reset the counters to zero.'
+        )
+
+    def handle(self, *args, **options):
+        stats = page_cache.stats()
+        served = sum(stats.values())
+        for counter, value in stats.items():
+            self.stdout.write(f'{counter}: {value}')
+        if served:
+            hit_ratio = (stats['hits'] + stats['stale']) / served
+            self.stdout.write(f'hit ratio: {hit_ratio:.1%}')
+        if options['reset']:
+            page_cache.reset_stats()
+            self.stdout.write(self.style.SUCCESS('Counters were reset'))
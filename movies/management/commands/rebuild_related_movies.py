@@ -0,0 +1,21 @@
+import time
+from django.core.management.base import BaseCommand
+from movies.related import TOP_K, rebuild_related_movies
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the related movies of every movie from their directors, '
+        'actors and genres. Signals keep them up to date after that, this is '
+        'for bulk changes that bypass them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=TOP_K)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        rebuild_related_movies(options['top_k'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt the related movies in {time.perf_counter() - start:.1f}s'
+        ))
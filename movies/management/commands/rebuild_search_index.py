@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from movies.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Recreate the search documents of all movies, actors and directors.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            number_of_documents = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {number_of_documents} search document(s)'
+        ))
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from movies.models import Movie, Rating, Review, RATING_VALUES
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute rating_sum, rating_count and the rating histogram of movies, '
+        'and the author ratings of reviews, from the Rating table.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only report movies with drifted aggregates, do not fix them.'
+        )
+
+    def handle(self, *args, **options):
+        ratings = Rating.objects.filter(movie=OuterRef('pk')).\
+            order_by().values('movie')
+
+        def actual(queryset, aggregate):
+            return Coalesce(Subquery(
+                queryset.annotate(total=aggregate).values('total'),
+                output_field=IntegerField()
+            ), 0)
+
+        actual_values = {
+            'rating_sum': actual(ratings, Sum('rating')),
+            'rating_count': actual(ratings, Count('id')),
+        }
+        for value in RATING_VALUES:
+            actual_values[f'histogram_{value}'] = \
+                actual(ratings.filter(rating=value), Count('id'))
+        author_rating = Subquery(Rating.objects.filter(
+            movie=OuterRef('movie'), owner=OuterRef('owner')).values('rating')[:1])
+        drifted_reviews = Review.objects.annotate(actual=author_rating).\
+            exclude(author_rating__isnull=True, actual__isnull=True).\
+            filter(Q(author_rating__isnull=True) | Q(actual__isnull=True) |
+                   ~Q(author_rating=F('actual')))
+        if options['check']:
+            self.stdout.write(
+                f'{drifted_reviews.count()} review(s) with a drifted author rating')
+        else:
+            reconciled = Review.objects.filter(id__in=list(
+                drifted_reviews.values_list('id', flat=True))).\
+                update(author_rating=author_rating)
+            if reconciled:
+                self.stdout.write(f'Reconciled author ratings of {reconciled} review(s)')
+        with transaction.atomic():
+            drifted = Movie.objects.select_for_update().\
+                annotate(**{f'actual_{field}': expression
+                            for field, expression in actual_values.items()}).\
+                exclude(**{field: F(f'actual_{field}') for field in actual_values})
+            drifted_ids = list(drifted.values_list('id', flat=True))
+            if options['check'] or not drifted_ids:
+                self.stdout.write(
+                    f'{len(drifted_ids)} movie(s) with drifted rating aggregates'
+                )
+                return
+            Movie.objects.filter(id__in=drifted_ids).update(**actual_values)
+        self.stdout.write(self.style.SUCCESS(
+            f'Reconciled rating aggregates of {len(drifted_ids)} movie(s)'
+        ))
@@ -0,0 +1,43 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from movies import page_cache
+from movies.models import Movie, Director, Actor, Genre
+from movies.thumbnails import IMAGE_FIELDS, describe, thumbnails_field
+
+
+class Command(BaseCommand):
+    help = (
+        'Resolve again the image and rendition URLs stored on movies, directors '
+        'and actors. Rows store them when saved, run this after changing the '
+        'storage or its settings, e.g. switching to MEDIA_STORAGE=local.'
+    )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        updated = 0
+        for model, image_field in IMAGE_FIELDS.items():
+            url_field = model._meta.get_field(f'{image_field}_url')
+            field = thumbnails_field(model)
+            objects = list(model.objects.only('pk', image_field, url_field.name, field))
+            for obj in objects:
+                setattr(obj, url_field.name, url_field.resolve(obj))
+                thumbnails = getattr(obj, field)
+                if thumbnails.get('files'):
+                    setattr(obj, field, describe(thumbnails['source'], thumbnails['files']))
+            with transaction.atomic():
+                model.objects.bulk_update(objects, [url_field.name, field], batch_size=1000)
+            updated += len(objects)
+        # Every cached page shows images.
+        tags = ['genres', 'search', 'leaderboards']
+        for movie_id, slug in Movie.objects.values_list('id', 'slug'):
+            tags += [f'movie:{movie_id}', f'movie:{slug}']
+        for kind, model, field in (('director', Director, 'slugged_name'),
+                                   ('actor', Actor, 'slugged_name'),
+                                   ('genre', Genre, 'slug')):
+            tags += [f'{kind}:{slug}' for slug in model.objects.values_list(field, flat=True)]
+        page_cache.invalidate(*tags)
+        self.stdout.write(self.style.SUCCESS(
+            f'Resolved the media URLs of {updated} row(s) in '
+            f'{time.perf_counter() - start:.1f}s'
+        ))
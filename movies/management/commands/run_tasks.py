@@ -0,0 +1,57 @@
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from movies.tasks import claim, run, schedule_periodic
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the tasks of the database task queue (movies/tasks.py): thumbnails, '
+        'file deletions, related movies refreshes and the periodic leaderboards '
+        'and similar movies recomputations. Claims due tasks in batches '
+        'and runs them on a pool of threads. Run several workers for more '
+        'processes, they do not run the same task twice.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--batch', type=int, default=20,
+                            help='Tasks claimed at a time.')
+        parser.add_argument('--poll', type=float, default=1.0,
+                            help='Seconds to wait when there is nothing to do.')
+        parser.add_argument('--once', action='store_true',
+                            help='Run the due tasks and exit instead of waiting for more.')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        schedule_periodic()
+        succeeded = failed = 0
+        with ThreadPoolExecutor(max_workers=options['threads'],
+                                thread_name_prefix='tasks') as pool:
+            while not self.stopping:
+                try:
+                    claimed = claim(options['batch'])
+                except KeyboardInterrupt:
+                    break
+                if not claimed:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll'])
+                    continue
+                try:
+                    for result in pool.map(run, claimed):
+                        succeeded += result
+                        failed += not result
+                except KeyboardInterrupt:
+                    # The rest of the batch is finished before exiting.
+                    self.stopping = True
+        self.stdout.write(self.style.SUCCESS(
+            f'Ran {succeeded + failed} task(s), {failed} failed'
+        ))
+
+    def stop(self, signum, frame):
+        # Finish the current batch, its tasks would otherwise wait for
+        # their lease to expire.
+        self.stopping = True
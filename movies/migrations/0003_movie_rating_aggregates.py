@@ -0,0 +1,38 @@
+# Generated by Django 4.2.4 on 2026-10-16 20:25
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def populate_rating_aggregates(apps, schema_editor):
+    Movie = apps.get_model('movies', 'Movie')
+    Rating = apps.get_model('movies', 'Rating')
+    aggregates = Rating.objects.order_by().values('movie').\
+        annotate(total=Sum('rating'), number=Count('id'))
+    for row in aggregates.iterator():
+        Movie.objects.filter(pk=row['movie']).update(
+            rating_sum=row['total'], rating_count=row['number']
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(
+            populate_rating_aggregates, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.4 on 2026-10-16 20:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Q
+
+
+def populate_genre_summaries(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Tag = apps.get_model('taggit', 'Tag')
+    GenreSummary = apps.get_model('movies', 'GenreSummary')
+    movie_type = ContentType.objects.filter(
+        app_label='movies', model='movie').first()
+    tags = Tag.objects.annotate(number_of_movies=Count(
+        'taggit_taggeditem_items',
+        filter=Q(taggit_taggeditem_items__content_type=movie_type)
+    ))
+    GenreSummary.objects.bulk_create([
+        GenreSummary(genre_id=tag.id, name=tag.name, slug=tag.slug,
+                     number_of_movies=tag.number_of_movies)
+        for tag in tags
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('taggit', '0005_auto_20220424_2025'),
+        ('movies', '0003_movie_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenreSummary',
+            fields=[
+                ('genre', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='taggit.tag')),
+                ('name', models.CharField(max_length=100)),
+                ('slug', models.SlugField(max_length=100, unique=True)),
+                ('number_of_movies', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['name'],
+                'indexes': [models.Index(condition=models.Q(('number_of_movies__gt', 0)), fields=['name'], name='genre_summary_listed_idx')],
+            },
+        ),
+        migrations.RunPython(
+            populate_genre_summaries, migrations.RunPython.noop
+        ),
+    ]
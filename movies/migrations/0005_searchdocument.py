@@ -0,0 +1,115 @@
+# Generated by Django 4.2.4 on 2026-10-16 20:27
+
+from django.db import migrations, models
+
+# The search structures of movies/search.py as they were when this
+# migration was written.
+SCHEMA = {
+    'postgresql': ([
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+        """ALTER TABLE movies_searchdocument ADD COLUMN document tsvector
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+                setweight(to_tsvector('english', coalesce(body, '')), 'B')
+            ) STORED""",
+        'CREATE INDEX movies_searchdocument_document_idx ON movies_searchdocument '
+        'USING gin (document)',
+        'CREATE INDEX movies_searchdocument_title_trgm_idx ON movies_searchdocument '
+        'USING gin (title gin_trgm_ops)',
+    ], [
+        'DROP INDEX IF EXISTS movies_searchdocument_title_trgm_idx',
+        'DROP INDEX IF EXISTS movies_searchdocument_document_idx',
+        'ALTER TABLE movies_searchdocument DROP COLUMN IF EXISTS document',
+    ]),
+    'sqlite': ([
+        """CREATE VIRTUAL TABLE movies_searchdocument_fts USING fts5(
+            title, body, content='movies_searchdocument', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2')""",
+        """CREATE TRIGGER movies_searchdocument_ai AFTER INSERT ON movies_searchdocument BEGIN
+            INSERT INTO movies_searchdocument_fts(rowid, title, body)
+            VALUES (new.id, new.title, new.body);
+        END""",
+        """CREATE TRIGGER movies_searchdocument_ad AFTER DELETE ON movies_searchdocument BEGIN
+            INSERT INTO movies_searchdocument_fts(movies_searchdocument_fts, rowid, title, body)
+            VALUES ('delete', old.id, old.title, old.body);
+        END""",
+        """CREATE TRIGGER movies_searchdocument_au AFTER UPDATE ON movies_searchdocument BEGIN
+            INSERT INTO movies_searchdocument_fts(movies_searchdocument_fts, rowid, title, body)
+            VALUES ('delete', old.id, old.title, old.body);
+            INSERT INTO movies_searchdocument_fts(rowid, title, body)
+            VALUES (new.id, new.title, new.body);
+        END""",
+        "INSERT INTO movies_searchdocument_fts(movies_searchdocument_fts) VALUES ('rebuild')",
+    ], [
+        'DROP TRIGGER IF EXISTS movies_searchdocument_au',
+        'DROP TRIGGER IF EXISTS movies_searchdocument_ad',
+        'DROP TRIGGER IF EXISTS movies_searchdocument_ai',
+        'DROP TABLE IF EXISTS movies_searchdocument_fts',
+    ]),
+}
+
+
+def create_search_structures(apps, schema_editor):
+    statements = SCHEMA.get(schema_editor.connection.vendor, ([], []))[0]
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_structures(apps, schema_editor):
+    statements = SCHEMA.get(schema_editor.connection.vendor, ([], []))[1]
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def populate_search_documents(apps, schema_editor):
+    Movie = apps.get_model('movies', 'Movie')
+    Actor = apps.get_model('movies', 'Actor')
+    Director = apps.get_model('movies', 'Director')
+    SearchDocument = apps.get_model('movies', 'SearchDocument')
+    documents = []
+    movies = Movie.objects.select_related('director').\
+        prefetch_related('actors')
+    for movie in movies:
+        names = [movie.director.name] + \
+            [actor.name for actor in movie.actors.all()]
+        documents.append(SearchDocument(
+            kind='movie', object_id=movie.id, title=movie.title,
+            slug=movie.slug, body=movie.synopsis + '\n' + ' '.join(names)
+        ))
+    for kind, model in (('actor', Actor), ('director', Director)):
+        for person in model.objects.all():
+            documents.append(SearchDocument(
+                kind=kind, object_id=person.id, title=person.name,
+                slug=person.slugged_name
+            ))
+    SearchDocument.objects.bulk_create(documents, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0004_genresummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('movie', 'Movie'), ('actor', 'Actor'), ('director', 'Director')], max_length=8)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('title', models.CharField(max_length=200)),
+                ('slug', models.SlugField(max_length=300)),
+                ('body', models.TextField(blank=True)),
+            ],
+            options={
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+        migrations.RunPython(
+            create_search_structures, drop_search_structures
+        ),
+        migrations.RunPython(
+            populate_search_documents, migrations.RunPython.noop
+        ),
+    ]
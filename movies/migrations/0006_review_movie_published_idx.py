@@ -0,0 +1,17 @@
+# Generated by Django 4.2.4 on 2026-10-16 20:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0005_searchdocument'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['movie', '-published', '-id'], name='review_movie_published_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.4 on 2026-10-16 20:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0006_review_movie_published_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionStamp',
+            fields=[
+                ('tag', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('modified', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.4 on 2026-10-16 20:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0007_versionstamp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rating',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['updated'], name='rating_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 4.2.4 on 2026-10-16 20:48
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_rating_histograms(apps, schema_editor):
+    Movie = apps.get_model('movies', 'Movie')
+    Rating = apps.get_model('movies', 'Rating')
+    buckets = Rating.objects.order_by().values('movie', 'rating').\
+        annotate(number=Count('id'))
+    for row in buckets.iterator():
+        Movie.objects.filter(pk=row['movie']).update(
+            **{f'histogram_{row["rating"]}': row['number']}
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0008_rating_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='histogram_0',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='histogram_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='histogram_10',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='histogram_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='histogram_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='histogram_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='histogram_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='histogram_6',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='histogram_7',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='histogram_8',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='histogram_9',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(
+            populate_rating_histograms, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 4.2.4 on 2026-10-16 21:06
+
+from django.core.management.color import no_style
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_genres(apps, schema_editor):
+    """Copy the taggit tags of movies into Genre, keeping their ids and slugs."""
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    Genre = apps.get_model('movies', 'Genre')
+    MovieGenre = apps.get_model('movies', 'MovieGenre')
+    movie_type = ContentType.objects.filter(
+        app_label='movies', model='movie').first()
+    if not movie_type:
+        return
+    tagged = TaggedItem.objects.filter(content_type=movie_type)
+    counts = {}
+    for tag_id in tagged.values_list('tag_id', flat=True).iterator():
+        counts[tag_id] = counts.get(tag_id, 0) + 1
+    Genre.objects.bulk_create([
+        Genre(id=tag_id, name=name, slug=slug, number_of_movies=counts[tag_id])
+        for tag_id, name, slug in apps.get_model('taggit', 'Tag').objects.
+        filter(id__in=counts).values_list('id', 'name', 'slug')
+    ])
+    MovieGenre.objects.bulk_create(
+        (MovieGenre(movie_id=movie_id, genre_id=tag_id) for movie_id, tag_id in
+         tagged.values_list('object_id', 'tag_id').iterator()),
+        batch_size=5000, ignore_conflicts=True
+    )
+    # Explicit ids do not advance the id sequence on PostgreSQL.
+    for statement in schema_editor.connection.ops.sequence_reset_sql(
+            no_style(), [Genre]):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('taggit', '0005_auto_20220424_2025'),
+        ('movies', '0012_leaderboardentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Genre',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('slug', models.SlugField(max_length=100, unique=True)),
+                ('number_of_movies', models.PositiveIntegerField(default=0, editable=False)),
+            ],
+            options={
+                'ordering': ['name'],
+                'indexes': [models.Index(condition=models.Q(('number_of_movies__gt', 0)), fields=['name'], name='genre_listed_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MovieGenre',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('genre', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='movies.genre')),
+                ('movie', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='movies.movie')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['genre', 'movie'], name='genre_movie_idx')],
+                'unique_together': {('movie', 'genre')},
+            },
+        ),
+        migrations.RunPython(copy_genres, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='movie',
+            name='genres',
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='genres',
+            field=models.ManyToManyField(blank=True, related_name='movies', through='movies.MovieGenre', to='movies.genre'),
+        ),
+        migrations.DeleteModel(
+            name='GenreSummary',
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.4 on 2026-10-16 21:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0013_genre_moviegenre'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='actor',
+            name='photo_thumbnails',
+            field=models.JSONField(default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='director',
+            name='photo_thumbnails',
+            field=models.JSONField(default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='poster_thumbnails',
+            field=models.JSONField(default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.4 on 2026-10-16 21:12
+
+from django.db import migrations
+import movies.models
+
+
+def resolve_media_urls(apps, schema_editor):
+    for model_name, field_name in (('Movie', 'poster_url'), ('Director', 'photo_url'),
+                                   ('Actor', 'photo_url')):
+        model = apps.get_model('movies', model_name)
+        field = model._meta.get_field(field_name)
+        objects = list(model.objects.only('pk', field.source))
+        for obj in objects:
+            setattr(obj, field_name, field.resolve(obj))
+        model.objects.bulk_update(objects, [field_name], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0014_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='actor',
+            name='photo_url',
+            field=movies.models.MediaURLField(source='photo'),
+        ),
+        migrations.AddField(
+            model_name='director',
+            name='photo_url',
+            field=movies.models.MediaURLField(source='photo'),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='poster_url',
+            field=movies.models.MediaURLField(source='poster'),
+        ),
+        migrations.RunPython(resolve_media_urls, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 4.2.4 on 2026-10-16 22:23
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+HIGHEST_INDEX = models.Index(fields=['movie', '-author_rating', '-published', '-id'],
+                             name='review_movie_highest_idx')
+
+# PostgreSQL puts nulls first in descending indexes, while the highest
+# rated reviews are listed with the unrated ones last. SQLite already
+# orders nulls last there.
+HIGHEST_INDEX_SQL = {
+    'postgresql': (
+        'CREATE INDEX review_movie_highest_idx ON movies_review '
+        '(movie_id, author_rating DESC NULLS LAST, published DESC, id DESC)',
+        'DROP INDEX IF EXISTS review_movie_highest_idx',
+    ),
+}
+
+
+def populate_author_ratings(apps, schema_editor):
+    Rating = apps.get_model('movies', 'Rating')
+    Review = apps.get_model('movies', 'Review')
+    Review.objects.update(author_rating=Subquery(Rating.objects.filter(
+        movie=OuterRef('movie'), owner=OuterRef('owner')).values('rating')[:1]))
+
+
+def create_highest_index(apps, schema_editor):
+    statements = HIGHEST_INDEX_SQL.get(schema_editor.connection.vendor)
+    if statements:
+        schema_editor.execute(statements[0])
+    else:
+        schema_editor.add_index(apps.get_model('movies', 'Review'), HIGHEST_INDEX)
+
+
+def drop_highest_index(apps, schema_editor):
+    statements = HIGHEST_INDEX_SQL.get(schema_editor.connection.vendor)
+    if statements:
+        schema_editor.execute(statements[1])
+    else:
+        schema_editor.remove_index(apps.get_model('movies', 'Review'), HIGHEST_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0016_task'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='author_rating',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(
+            populate_author_ratings, migrations.RunPython.noop
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_highest_index, drop_highest_index),
+            ],
+            state_operations=[
+                migrations.AddIndex(model_name='review', index=HIGHEST_INDEX),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['movie', 'author_rating', '-published', '-id'], name='review_movie_lowest_idx'),
+        ),
+    ]
@@ -1,7 +1,14 @@
-from django.db import models
+import math
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.core.exceptions import ValidationError
 from django.template.defaultfilters import slugify
-from taggit.managers import TaggableManager
+from django.urls import reverse
+from django_cleanup import cleanup
+
+
+RATING_VALUES = range(11)
 
 
 def validate_file_size(image):
@@ -12,11 +19,50 @@ def validate_file_size(image):
         raise ValidationError(f"Maximum size of the image is {limit_mb} MB")
 
 
+class MediaURLField(models.CharField):
+    """
+    URL of the file in the source field of the same model, resolved by the
+    storage whenever the row is saved or bulk created, so pages render it
+    without a storage call per image. Declare it after the source field,
+    whose upload is committed, and possibly renamed, first. Run
+    `manage.py refresh_media_urls` after changing the storage.
+    """
+
+    def __init__(self, source, **kwargs):
+        self.source = source
+        kwargs.setdefault('max_length', 500)
+        kwargs.setdefault('blank', True)
+        kwargs.setdefault('editable', False)
+        super().__init__(**kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['source'] = self.source
+        for option, default in (('max_length', 500), ('blank', True), ('editable', False)):
+            if kwargs.get(option) == default:
+                del kwargs[option]
+        return name, path, args, kwargs
+
+    def resolve(self, instance):
+        file = getattr(instance, self.source)
+        return file.storage.url(file.name) if file.name else ''
+
+    def pre_save(self, instance, add):
+        url = self.resolve(instance)
+        setattr(instance, self.attname, url)
+        return url
+
+
+# Replaced and deleted images are deleted by the signals in movies/signals.py.
+@cleanup.ignore
 class Director(models.Model):
     name = models.CharField(max_length=200, unique=True)
     slugged_name = models.SlugField(max_length=300, unique=True)
     photo = models.ImageField(
         upload_to='movies/images/', validators=[validate_file_size])
+    photo_url = MediaURLField('photo')
+    # Renditions of the photo, made by movies/thumbnails.py.
+    photo_thumbnails = models.JSONField(default=dict, editable=False)
 
     def save(self, *args, **kwargs):
         self.slugged_name = slugify(self.name)
@@ -29,11 +75,15 @@ class Director(models.Model):
         ordering = ['name']
 
 
+@cleanup.ignore
 class Actor(models.Model):
     name = models.CharField(max_length=200, unique=True)
     slugged_name = models.SlugField(max_length=300, unique=True)
     photo = models.ImageField(
         upload_to='movies/images/', validators=[validate_file_size])
+    photo_url = MediaURLField('photo')
+    # Renditions of the photo, made by movies/thumbnails.py.
+    photo_thumbnails = models.JSONField(default=dict, editable=False)
 
     def save(self, *args, **kwargs):
         self.slugged_name = slugify(self.name)
@@ -46,6 +96,29 @@ class Actor(models.Model):
         ordering = ['name']
 
 
+class Genre(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    slug = models.SlugField(max_length=100, unique=True)
+    # Maintained by the MovieGenre signals in movies/signals.py so the index
+    # page does not have to count movies on every request.
+    number_of_movies = models.PositiveIntegerField(default=0, editable=False)
+
+    def save(self, *args, **kwargs):
+        self.slug = slugify(self.name)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        ordering = ['name']
+        indexes = [
+            models.Index(fields=['name'], name='genre_listed_idx',
+                         condition=models.Q(number_of_movies__gt=0))
+        ]
+
+
+@cleanup.ignore
 class Movie(models.Model):
     UNITED_STATES = 'US'
     UNITED_KINGDOM = 'UK'
@@ -70,21 +143,247 @@ class Movie(models.Model):
     country = models.CharField(max_length=2, choices=COUNTRIES)
     poster = models.ImageField(
         upload_to='movies/images', validators=[validate_file_size])
+    poster_url = MediaURLField('poster')
+    # Renditions of the poster, made by movies/thumbnails.py.
+    poster_thumbnails = models.JSONField(default=dict, editable=False)
     director = models.ForeignKey(
         Director, on_delete=models.PROTECT, related_name='movies')
     actors = models.ManyToManyField(Actor)
-    genres = TaggableManager(
-        verbose_name='genres', help_text='A comma-separated list of genres.'
-    )
+    genres = models.ManyToManyField(
+        Genre, through='MovieGenre', related_name='movies', blank=True)
+    # Maintained by Rating.save() and the Rating post_delete signal,
+    # run `manage.py reconcile_ratings` after bulk changes to ratings.
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    # Number of ratings of each value, 0 to 10, see rating_histogram.
+    histogram_0 = models.PositiveIntegerField(default=0, editable=False)
+    histogram_1 = models.PositiveIntegerField(default=0, editable=False)
+    histogram_2 = models.PositiveIntegerField(default=0, editable=False)
+    histogram_3 = models.PositiveIntegerField(default=0, editable=False)
+    histogram_4 = models.PositiveIntegerField(default=0, editable=False)
+    histogram_5 = models.PositiveIntegerField(default=0, editable=False)
+    histogram_6 = models.PositiveIntegerField(default=0, editable=False)
+    histogram_7 = models.PositiveIntegerField(default=0, editable=False)
+    histogram_8 = models.PositiveIntegerField(default=0, editable=False)
+    histogram_9 = models.PositiveIntegerField(default=0, editable=False)
+    histogram_10 = models.PositiveIntegerField(default=0, editable=False)
+
+    RATING_AGGREGATES = ['rating_sum', 'rating_count'] + \
+        [f'histogram_{value}' for value in RATING_VALUES]
 
     def save(self, *args, **kwargs):
         self.slug = slugify(self.title)
+        if not self._state.adding and kwargs.get('update_fields') is None and \
+                not kwargs.get('force_insert'):
+            # The rating aggregates are only changed by update_movie_rating(),
+            # saving a copy of the movie loaded earlier must not undo them.
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.RATING_AGGREGATES
+            ]
         super(Movie, self).save(*args, **kwargs)
 
+    @property
+    def avg_rating(self):
+        if not self.rating_count:
+            return None
+        return self.rating_sum / self.rating_count
+
+    @property
+    def rating_histogram(self):
+        """Number of ratings of each value, indexed by the value."""
+        return [getattr(self, f'histogram_{value}') for value in RATING_VALUES]
+
+    @property
+    def rating_distribution(self):
+        """(value, number of ratings, percentage of all ratings) of each value."""
+        return [(value, count, 100 * count / self.rating_count if self.rating_count else 0)
+                for value, count in enumerate(self.rating_histogram)]
+
+    def rating_percentile(self, percent):
+        """Percentile of the ratings, interpolated like numpy.percentile."""
+        if not self.rating_count:
+            return None
+        position = percent / 100 * (self.rating_count - 1)
+        lower, upper = int(position), min(int(position) + 1, self.rating_count - 1)
+        values = []
+        seen = 0
+        for value, count in enumerate(self.rating_histogram):
+            # Values at the two sorted positions around the percentile.
+            while len(values) < 2 and [lower, upper][len(values)] < seen + count:
+                values.append(value)
+            seen += count
+        return values[0] + (values[1] - values[0]) * (position - lower)
+
+    @property
+    def rating_median(self):
+        return self.rating_percentile(50)
+
+    @property
+    def rating_quartiles(self):
+        return self.rating_percentile(25), self.rating_percentile(75)
+
+    @property
+    def rating_stddev(self):
+        if not self.rating_count:
+            return None
+        mean = self.avg_rating
+        return math.sqrt(sum(count * (value - mean) ** 2 for value, count
+                             in enumerate(self.rating_histogram)) / self.rating_count)
+
     def __str__(self):
         return self.title
 
 
+class MovieGenre(models.Model):
+    # The unique constraint indexes the genres of a movie, genre_movie_idx
+    # the movies of a genre, both without touching the table rows.
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, db_index=False)
+    genre = models.ForeignKey(Genre, on_delete=models.CASCADE, db_index=False)
+
+    class Meta:
+        unique_together = ("movie", "genre")
+        indexes = [
+            models.Index(fields=['genre', 'movie'], name='genre_movie_idx')
+        ]
+
+    def __str__(self):
+        return f'{self.movie_id} in {self.genre_id}'
+
+
+class SearchDocument(models.Model):
+    # Denormalized text of a movie, actor or director, maintained by the
+    # signals in movies/signals.py. The full-text structures on top of this
+    # table are backend specific, see movies/search.py.
+    MOVIE = 'movie'
+    ACTOR = 'actor'
+    DIRECTOR = 'director'
+    KINDS = (
+        (MOVIE, 'Movie'),
+        (ACTOR, 'Actor'),
+        (DIRECTOR, 'Director')
+    )
+    URL_NAMES = {
+        MOVIE: 'movies:movie-detail',
+        ACTOR: 'movies:actor-page',
+        DIRECTOR: 'movies:director-page'
+    }
+    kind = models.CharField(max_length=8, choices=KINDS)
+    object_id = models.PositiveBigIntegerField()
+    title = models.CharField(max_length=200)
+    slug = models.SlugField(max_length=300)
+    body = models.TextField(blank=True)
+
+    class Meta:
+        unique_together = ("kind", "object_id")
+
+    def get_absolute_url(self):
+        return reverse(self.URL_NAMES[self.kind], args=(self.slug, ))
+
+    def __str__(self):
+        return self.kind + ' ' + self.title
+
+
+class SimilarMovie(models.Model):
+    # Nearest neighbours of a movie by item-item collaborative filtering over
+    # the ratings, written by `manage.py compute_similar_movies`, see
+    # movies/recommendations.py. rank 0 is the most similar movie.
+    movie = models.ForeignKey(
+        Movie, on_delete=models.CASCADE, related_name='similar_movies')
+    similar = models.ForeignKey(
+        Movie, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    computed = models.DateTimeField()
+
+    class Meta:
+        ordering = ['movie', 'rank']
+        unique_together = ("movie", "rank")
+
+    def __str__(self):
+        return f'{self.movie_id} -> {self.similar_id}'
+
+
+class RelatedMovie(models.Model):
+    # Movies related by director, actors and genres, kept up to date by
+    # movies/related.py. rank 0 is the most related movie.
+    movie = models.ForeignKey(
+        Movie, on_delete=models.CASCADE, related_name='related_movies')
+    related = models.ForeignKey(
+        Movie, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['movie', 'rank']
+        unique_together = ("movie", "rank")
+
+    def __str__(self):
+        return f'{self.movie_id} -> {self.related_id}'
+
+
+class LeaderboardEntry(models.Model):
+    # Ranked movies of a leaderboard, written by movies/leaderboards.py.
+    # scope is '' for the whole catalog, 'genre:<slug>' or 'country:<code>'.
+    board = models.CharField(max_length=20)
+    scope = models.CharField(max_length=120, blank=True)
+    rank = models.PositiveIntegerField()
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['board', 'scope', 'rank']
+        unique_together = ("board", "scope", "rank")
+
+    def __str__(self):
+        return f'{self.board} {self.scope} #{self.rank}'
+
+
+class VersionStamp(models.Model):
+    # Time of the last change to the pages depending on a page cache tag,
+    # e.g. 'movie:<slug>', written by page_cache.invalidate() inside the
+    # transaction making the change. Used for ETag and Last-Modified.
+    tag = models.CharField(max_length=255, primary_key=True)
+    modified = models.DateTimeField()
+
+    def __str__(self):
+        return self.tag
+
+
+class Task(models.Model):
+    # A job of the task queue in movies/tasks.py, run by `manage.py run_tasks`.
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUSES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (FAILED, 'Failed')]
+
+    name = models.CharField(max_length=200)
+    arguments = models.JSONField(default=list)
+    # Pending tasks with the same key are enqueued once.
+    key = models.CharField(max_length=255, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField()
+    # Set when a worker claims the task, another worker may claim it again
+    # once locked_until has passed, e.g. when the first one was killed.
+    locked_by = models.CharField(max_length=32, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='task_due_idx')
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['key'], condition=models.Q(status='pending'),
+                                    name='task_pending_key_uniq')
+        ]
+
+    def __str__(self):
+        return f'{self.name} {self.status}'
+
+
 class Review(models.Model):
     movie = models.ForeignKey(
         Movie, related_name='reviews', on_delete=models.CASCADE)
@@ -93,9 +392,23 @@ class Review(models.Model):
     content = models.TextField()
     published = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+    # The rating the owner gave the movie, None if they have not rated it.
+    # Kept in sync by the Rating signals in movies/signals.py, run
+    # `manage.py reconcile_ratings` after bulk changes to ratings.
+    author_rating = models.PositiveSmallIntegerField(null=True, blank=True, editable=False)
 
     class Meta:
         unique_together = ("movie", "owner")
+        indexes = [
+            models.Index(fields=['movie', '-published', '-id'],
+                         name='review_movie_published_idx'),
+            # Created with author_rating DESC NULLS LAST on PostgreSQL,
+            # see migration 0017.
+            models.Index(fields=['movie', '-author_rating', '-published', '-id'],
+                         name='review_movie_highest_idx'),
+            models.Index(fields=['movie', 'author_rating', '-published', '-id'],
+                         name='review_movie_lowest_idx'),
+        ]
 
     def __str__(self):
         return self.movie.title + ' ' + self.owner.username
@@ -110,9 +423,58 @@ class Rating(models.Model):
         'users.CustomUser', related_name='ratings', on_delete=models.CASCADE
     )
     rating = models.PositiveSmallIntegerField(choices=rating_choices)
+    updated = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ("movie", "owner")
+        indexes = [
+            models.Index(fields=['updated'], name='rating_updated_idx')
+        ]
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                previous = Rating.objects.select_for_update().\
+                    filter(pk=self.pk).values_list('movie_id', 'rating').first()
+            super(Rating, self).save(*args, **kwargs)
+            if not previous:
+                update_movie_rating(self.movie_id, added=self.rating)
+            elif previous[0] == self.movie_id:
+                update_movie_rating(self.movie_id, added=self.rating, removed=previous[1])
+            else:
+                update_movie_rating(previous[0], removed=previous[1])
+                update_movie_rating(self.movie_id, added=self.rating)
 
     def __str__(self):
         return self.movie.title + ' ' + self.owner.username
+
+
+def update_movie_rating(movie_id, added=None, removed=None):
+    """
+    Apply a rating value added to and/or removed from a movie to the
+    aggregates stored on it, as a single UPDATE of a constant size.
+    """
+    deltas = {}
+    for value, delta in ((added, 1), (removed, -1)):
+        if value is None:
+            continue
+        deltas['rating_sum'] = deltas.get('rating_sum', 0) + delta * value
+        deltas['rating_count'] = deltas.get('rating_count', 0) + delta
+        bucket = f'histogram_{value}'
+        deltas[bucket] = deltas.get(bucket, 0) + delta
+    changes = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if changes:
+        Movie.objects.filter(pk=movie_id).update(**changes)
+
+
+def update_genre_counts(genre_ids=None):
+    """
+    Recount the movies of the given genres, or of all of them, with a
+    single UPDATE.
+    """
+    genres = Genre.objects.all() if genre_ids is None \
+        else Genre.objects.filter(pk__in=genre_ids)
+    counts = MovieGenre.objects.filter(genre=OuterRef('pk')).order_by().\
+        values('genre').annotate(number=Count('pk')).values('number')
+    genres.update(number_of_movies=Coalesce(Subquery(counts), 0))
@@ -0,0 +1,247 @@
+"""
+Full-response cache for anonymous GET requests to the catalog pages.
+
+Every cached page depends on one or more tags, e.g. 'movie:<slug>' or
+'genre:<slug>'. Each invalidated tag has a VersionStamp row in the
+database and the stamps are part of the page's cache key, so invalidating
+a tag makes every page depending on it miss in every process, the web
+workers as well as the task runner and the management commands writing to
+the catalog. The signals in movies/signals.py invalidate the tags touched
+by a write.
+
+When a page misses and another request is already rendering it, the last
+rendered copy is served instead of rendering it again, so a popular page
+that was just invalidated is rendered by one request at a time.
+
+Invalidating a tag updates its VersionStamp row as part of the transaction
+making the change. conditional_page() compares the stamps of a page's tags
+with If-None-Match and If-Modified-Since before the view runs, so an
+unchanged page is answered with 304 after a single lookup by primary key.
+"""
+import datetime
+import hashlib
+from functools import wraps
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, \
+    quote_etag
+from django.utils.http import http_date, parse_http_date_safe
+from movies.models import Movie, VersionStamp
+
+PAGE_CACHE_ALIAS = getattr(settings, 'PAGE_CACHE_ALIAS', 'default')
+PAGE_CACHE_TIMEOUT = getattr(settings, 'PAGE_CACHE_TIMEOUT', 600)
+# How long a stale copy is kept around to be served while a page is rendered.
+PAGE_CACHE_STALE_TIMEOUT = getattr(settings, 'PAGE_CACHE_STALE_TIMEOUT', 86400)
+PAGE_CACHE_LOCK_TIMEOUT = 30
+# max-age of the pages that shared caches are allowed to store.
+PUBLIC_PAGE_MAX_AGE = getattr(settings, 'PUBLIC_PAGE_MAX_AGE', 300)
+
+COUNTERS = ('hits', 'misses', 'stale')
+# Modification time of the tags that have no version stamp.
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def get_cache():
+    return caches[PAGE_CACHE_ALIAS]
+
+
+def _digest(text):
+    return hashlib.md5(text.encode()).hexdigest()
+
+
+def _count(counter):
+    cache = get_cache()
+    key = f'page-cache:{counter}'
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+def stats():
+    values = get_cache().get_many([f'page-cache:{counter}' for counter in COUNTERS])
+    return {counter: values.get(f'page-cache:{counter}', 0) for counter in COUNTERS}
+
+
+def reset_stats():
+    get_cache().delete_many([f'page-cache:{counter}' for counter in COUNTERS])
+
+
+def tag_stamps(tags):
+    """
+    Modification times of tags, from their version stamps. Tags that were
+    never invalidated have no stamp and count as unchanged since EPOCH, so
+    reading a page, e.g. of a slug that does not exist, never writes.
+    """
+    stamps = dict(VersionStamp.objects.filter(tag__in=tags).
+                  values_list('tag', 'modified'))
+    return {tag: stamps.get(tag, EPOCH) for tag in tags}
+
+
+def invalidate(*tags):
+    """
+    Invalidate every page depending on any of tags. The stamps are written
+    in the current transaction, so other processes see the change, and
+    concurrent invalidations of the same tags wait, until it commits.
+    """
+    tags = {tag for tag in tags if tag}
+    if not tags:
+        return
+    # Sorted, so concurrent transactions lock the stamp rows in the same order.
+    now = timezone.now()
+    VersionStamp.objects.bulk_create(
+        [VersionStamp(tag=tag, modified=now) for tag in sorted(tags)],
+        update_conflicts=True, unique_fields=['tag'], update_fields=['modified']
+    )
+
+
+def movie_tags(movie_id):
+    """Tags of every page that shows the movie with the given id."""
+    movie = Movie.objects.select_related('director').filter(pk=movie_id).first()
+    if not movie:
+        return [f'movie:{movie_id}']
+    return [f'movie:{movie.id}', f'movie:{movie.slug}',
+            f'director:{movie.director.slugged_name}'] + \
+        [f'actor:{slug}' for slug in movie.actors.values_list('slugged_name', flat=True)] + \
+        [f'genre:{slug}' for slug in movie.genres.values_list('slug', flat=True)]
+
+
+def is_cacheable(request, shared=False):
+    if not getattr(settings, 'PAGE_CACHE_ENABLED', True) or \
+            request.method not in ('GET', 'HEAD'):
+        return False
+    # Shared pages look the same to every visitor, so neither the session
+    # nor the messages are looked at, which would add Vary: Cookie.
+    return shared or (not request.user.is_authenticated and
+                      not len(get_messages(request)))
+
+
+def cache_anonymous_page(*tag_patterns, shared=False):
+    """
+    Cache the responses of a view for anonymous visitors, or for everyone
+    if shared is True. tag_patterns are formatted with the view's URL
+    keyword arguments, e.g. 'genre:{slug}'.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not is_cacheable(request, shared):
+                return view(request, *args, **kwargs)
+            cache = get_cache()
+            tags = [pattern.format(**kwargs) for pattern in tag_patterns]
+            path = _digest(request.get_full_path())
+            stamps = tag_stamps(tags)
+            key = 'page:' + _digest(path + ':'.join(
+                f'{tag}={stamps[tag].timestamp()}' for tag in sorted(tags)))
+            cached = cache.get(key)
+            if cached is not None:
+                _count('hits')
+                return _response(request, cached, 'HIT')
+            lock = f'page-lock:{path}'
+            locked = cache.add(lock, 1, timeout=PAGE_CACHE_LOCK_TIMEOUT)
+            if not locked:
+                stale = cache.get(f'page-stale:{path}')
+                if stale is not None:
+                    _count('stale')
+                    return _response(request, stale, 'STALE')
+            _count('misses')
+            try:
+                response = view(request, *args, **kwargs)
+                if hasattr(response, 'render') and callable(response.render):
+                    response = response.render()
+                if response.status_code == 200 and not response.streaming:
+                    validators = {header: response[header] for header in
+                                  ('ETag', 'Last-Modified') if response.has_header(header)}
+                    cached = (response.content, response['Content-Type'], validators)
+                    cache.set(key, cached, timeout=PAGE_CACHE_TIMEOUT)
+                    cache.set(f'page-stale:{path}', cached,
+                              timeout=PAGE_CACHE_STALE_TIMEOUT)
+            finally:
+                if locked:
+                    cache.delete(lock)
+            response['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+
+def _response(request, cached, status):
+    content, content_type, validators = cached
+    response = HttpResponse(content, content_type=content_type)
+    response['X-Cache'] = status
+    if not validators:
+        return response
+    for header, value in validators.items():
+        response[header] = value
+    return get_conditional_response(
+        request, etag=validators.get('ETag'),
+        last_modified=parse_http_date_safe(validators.get('Last-Modified', '')),
+        response=response
+    )
+
+
+def page_validators(request, tags, per_user):
+    """
+    ETag and Last-Modified (as a timestamp) of the page requested, from the
+    version stamps of its tags. Pages that differ between signed in users
+    get an ETag per user and no Last-Modified.
+    """
+    stamps = tag_stamps(tags)
+    parts = [request.get_full_path()] + \
+        [f'{tag}={stamps[tag].timestamp()}' for tag in sorted(tags)]
+    if per_user:
+        parts.append(f'user={request.user.pk}')
+    etag = quote_etag(_digest('\n'.join(parts)))
+    modified = [stamp for stamp in stamps.values() if stamp != EPOCH]
+    last_modified = None if per_user or not modified else \
+        int(max(modified).timestamp())
+    return etag, last_modified
+
+
+def conditional_page(*tag_patterns, shared=False):
+    """
+    Answer conditional GET requests to a view from the version stamps of
+    its tags before the view runs, and add ETag and Last-Modified to its
+    responses. tag_patterns are the same as for cache_anonymous_page.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or \
+                    (not shared and len(get_messages(request))):
+                return view(request, *args, **kwargs)
+            tags = [pattern.format(**kwargs) for pattern in tag_patterns]
+            per_user = not shared and request.user.is_authenticated
+            etag, last_modified = page_validators(request, tags, per_user)
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            return response
+        return wrapper
+    return decorator
+
+
+def public_page(max_age):
+    """
+    Allow shared caches to store the responses of a view that does not
+    depend on the visitor.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                patch_cache_control(response, public=True, max_age=max_age)
+            return response
+        return wrapper
+    return decorator
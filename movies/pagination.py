@@ -0,0 +1,118 @@
+"""
+Keyset (cursor) pagination for the listing pages.
+
+Instead of OFFSET, a page is selected with a WHERE clause on the ordering
+columns of the last (or first) row of the neighbouring page, so every page
+costs the same as the first one. The ordering has to end with a unique
+column, e.g. ['title', 'id'] or ['-published', '-id']; a nullable column is
+ordered with F('column').desc(nulls_last=True) or .asc(nulls_last=True).
+Cursors are signed, so they are opaque to clients and cannot be tampered
+with.
+"""
+from django.core import signing
+from django.db.models import F, Q
+
+CURSOR_SALT = 'movies.pagination'
+
+
+class KeysetPage:
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = [self.as_order_by(name) for name in ordering]
+        self.per_page = per_page
+        self.fields = [order_by.expression.name for order_by in self.ordering]
+
+    @staticmethod
+    def as_order_by(name):
+        if not isinstance(name, str):
+            return name
+        if name.startswith('-'):
+            return F(name[1:]).desc()
+        return F(name).asc()
+
+    def encode_cursor(self, direction, obj):
+        values = []
+        for name in self.fields:
+            # Rows of values() querysets are dicts.
+            value = obj[name] if isinstance(obj, dict) else getattr(obj, name)
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return signing.dumps([direction, values], salt=CURSOR_SALT, compress=True)
+
+    def decode_cursor(self, cursor):
+        """Return (direction, values) of a cursor or None if it is invalid."""
+        try:
+            direction, values = signing.loads(cursor, salt=CURSOR_SALT)
+        except (signing.BadSignature, TypeError, ValueError):
+            return None
+        if direction not in ('next', 'previous') or len(values) != len(self.fields):
+            return None
+        return direction, values
+
+    def keyset_filter(self, values, backwards):
+        """Rows strictly after values in the ordering (or before, if backwards)."""
+        condition = Q()
+        equal = Q()
+        for name, order_by, value in zip(self.fields, self.ordering, values):
+            descending = order_by.descending != backwards
+            # Walking backwards, nulls ordered last come first.
+            nulls_last = order_by.nulls_last and not backwards
+            nulls_first = order_by.nulls_last and backwards
+            if value is None:
+                if nulls_first:
+                    condition |= equal & Q(**{f'{name}__isnull': False})
+                equal &= Q(**{f'{name}__isnull': True})
+                continue
+            lookup = 'lt' if descending else 'gt'
+            after = Q(**{f'{name}__{lookup}': value})
+            if nulls_last:
+                after |= Q(**{f'{name}__isnull': True})
+            condition |= equal & after
+            equal &= Q(**{name: value})
+        return condition
+
+    def get_page(self, cursor=None):
+        decoded = self.decode_cursor(cursor) if cursor else None
+        if decoded is None:
+            rows = list(self.queryset.order_by(*self.ordering)[:self.per_page + 1])
+            has_next, has_previous = len(rows) > self.per_page, False
+            rows = rows[:self.per_page]
+        elif decoded[0] == 'next':
+            rows = list(self.queryset.filter(self.keyset_filter(decoded[1], False)).
+                        order_by(*self.ordering)[:self.per_page + 1])
+            has_next, has_previous = len(rows) > self.per_page, True
+            rows = rows[:self.per_page]
+        else:
+            reversed_ordering = [order_by.copy().reverse_ordering()
+                                 for order_by in self.ordering]
+            rows = list(self.queryset.filter(self.keyset_filter(decoded[1], True)).
+                        order_by(*reversed_ordering)[:self.per_page + 1])
+            has_next, has_previous = True, len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+        next_cursor = self.encode_cursor('next', rows[-1]) \
+            if rows and has_next else None
+        previous_cursor = self.encode_cursor('previous', rows[0]) \
+            if rows and has_previous else None
+        return KeysetPage(rows, next_cursor, previous_cursor)
@@ -0,0 +1,165 @@
+"""
+Item-item collaborative filtering over the ratings, computed offline by
+`manage.py compute_similar_movies` and stored in SimilarMovie.
+
+The ratings are loaded into a sparse users x movies matrix, centred on
+the mean rating of each user, and the similarity of two movies is the
+cosine of their columns (adjusted cosine), shrunk towards 0 when few
+users rated both. The matrix product is computed a block of movies at a
+time and only the top k neighbours of each movie are kept, so memory
+stays bounded by the block size.
+
+A full run recomputes every movie. An incremental run recomputes the
+movies rated since the last run and the movies listing one of them as
+similar, which is an approximation: another movie may have become similar
+to a changed one, and deleted ratings are not seen at all. The task
+runner does a full run every FULL_RUN_INTERVAL seconds to catch up.
+
+numpy and scipy are needed only here, they are imported when the job
+runs and the site works without them.
+"""
+import itertools
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+from movies import page_cache
+from movies.models import Movie, Rating, SimilarMovie
+from movies.tasks import task
+
+TOP_K = 20
+# Similarities are multiplied by common / (common + SHRINKAGE), where
+# common is the number of users who rated both movies.
+SHRINKAGE = 10
+BLOCK_SIZE = 512
+FULL_RUN_INTERVAL = 86400
+
+
+def require_scipy():
+    try:
+        import numpy
+        from scipy import sparse
+    except ImportError:
+        raise ImproperlyConfigured(
+            'Similar movies are computed with numpy and scipy, '
+            'install them with "pip install numpy scipy"')
+    return numpy, sparse
+
+
+def load_ratings():
+    """All ratings as numpy arrays of owner ids, movie ids and ratings."""
+    np, _ = require_scipy()
+    rows = Rating.objects.values_list('owner_id', 'movie_id', 'rating').order_by()
+    triples = np.fromiter(itertools.chain.from_iterable(rows.iterator(chunk_size=10000)),
+                          dtype=np.int64).reshape(-1, 3)
+    return triples[:, 0], triples[:, 1], triples[:, 2]
+
+
+def build_matrix(owners, movies, ratings):
+    """
+    Sparse users x movies matrix of ratings minus the mean rating of each
+    user, and the movie id of each column.
+    """
+    np, sparse = require_scipy()
+    users, user_index = np.unique(owners, return_inverse=True)
+    movie_ids, movie_index = np.unique(movies, return_inverse=True)
+    values = ratings.astype(np.float64)
+    means = np.bincount(user_index, weights=values) / np.bincount(user_index)
+    values -= means[user_index]
+    matrix = sparse.csc_matrix((values, (user_index, movie_index)),
+                               shape=(len(users), len(movie_ids)))
+    return matrix, movie_ids
+
+
+def top_k_neighbours(matrix, k=TOP_K, columns=None, shrinkage=SHRINKAGE,
+                     block_size=BLOCK_SIZE):
+    """
+    Yield (column, neighbour columns, scores) for the given columns of the
+    matrix (all by default), neighbours by descending score. Only positive
+    similarities are kept.
+    """
+    np, sparse = require_scipy()
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    # A movie rated only at the users' means has no signal, its column is 0.
+    norms[norms == 0] = 1
+    normalized = (matrix @ sparse.diags(1 / norms)).tocsc()
+    rows = normalized.T.tocsr()
+    rated = matrix.copy()
+    rated.data[:] = 1
+    rated_rows = rated.T.tocsr()
+    if columns is None:
+        columns = np.arange(matrix.shape[1])
+    for start in range(0, len(columns), block_size):
+        block = columns[start:start + block_size]
+        similarities = rows[block] @ normalized
+        if shrinkage:
+            common = (rated_rows[block] @ rated).tocsr()
+            common.data = common.data / (common.data + shrinkage)
+            similarities = similarities.multiply(common)
+        similarities = similarities.tocsr()
+        for i, column in enumerate(block):
+            begin, end = similarities.indptr[i], similarities.indptr[i + 1]
+            neighbours = similarities.indices[begin:end]
+            scores = similarities.data[begin:end]
+            keep = (scores > 0) & (neighbours != column)
+            neighbours, scores = neighbours[keep], scores[keep]
+            if len(scores) > k:
+                top = np.argpartition(-scores, k)[:k]
+                neighbours, scores = neighbours[top], scores[top]
+            order = np.argsort(-scores, kind='stable')
+            yield column, neighbours[order], scores[order]
+
+
+def changed_movies(since):
+    """
+    Ids of movies rated or re-rated since the given time, and of the
+    movies whose similar movies include one of them.
+    """
+    rated = set(Rating.objects.filter(updated__gte=since).
+                values_list('movie_id', flat=True).distinct())
+    return rated | set(SimilarMovie.objects.filter(similar_id__in=rated).
+                       values_list('movie_id', flat=True).distinct())
+
+
+def last_computed():
+    return SimilarMovie.objects.order_by('-computed').\
+        values_list('computed', flat=True).first()
+
+
+def compute_similar_movies(movie_ids=None, k=TOP_K, shrinkage=SHRINKAGE):
+    """
+    Recompute the similar movies of the given movies, or of all movies,
+    and return the number of movies refreshed. Neighbours are computed
+    against the whole rating matrix either way.
+    """
+    np, _ = require_scipy()
+    computed = timezone.now()
+    matrix, ids = build_matrix(*load_ratings())
+    if movie_ids is None:
+        columns = None
+        refreshed = set(ids.tolist())
+    else:
+        columns = np.flatnonzero(np.isin(ids, list(movie_ids)))
+        refreshed = set(movie_ids)
+    rows = []
+    for column, neighbours, scores in top_k_neighbours(matrix, k, columns, shrinkage):
+        rows.extend(
+            SimilarMovie(movie_id=int(ids[column]), similar_id=int(ids[neighbour]),
+                         rank=rank, score=float(score), computed=computed)
+            for rank, (neighbour, score) in enumerate(zip(neighbours, scores))
+        )
+    movies = Movie.objects.all() if movie_ids is None else \
+        Movie.objects.filter(id__in=refreshed)
+    # Movies whose ratings were all deleted lose their neighbours too.
+    stale = SimilarMovie.objects.all() if movie_ids is None else \
+        SimilarMovie.objects.filter(movie_id__in=refreshed)
+    with transaction.atomic():
+        stale.delete()
+        SimilarMovie.objects.bulk_create(rows, batch_size=2000)
+        page_cache.invalidate(*(f'movie:{slug}' for slug in
+                                movies.values_list('slug', flat=True)))
+    return len(refreshed)
+
+
+@task(every=FULL_RUN_INTERVAL)
+def refresh_similar_movies():
+    compute_similar_movies()
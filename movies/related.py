@@ -0,0 +1,194 @@
+"""
+Related movies by metadata, for movies without enough ratings to have
+similar movies (see movies/recommendations.py).
+
+The score of two movies is a weighted sum of the Jaccard similarities of
+their directors, actors and genres, and the TOP_K best of each movie are
+stored in RelatedMovie. Movies sharing a director or an actor are found
+through inverted indexes. Genre sets are few compared to movies, so
+movies are grouped by genre set and the groups ranked by similarity of
+the sets, which gives the best movies related by genres alone without
+scoring every pair of movies that share a genre.
+
+The signals in movies/signals.py refresh the lists of changed movies and
+of the movies they enter or leave in the task queue (movies/tasks.py).
+Bulk paths call rebuild_related_movies().
+"""
+import heapq
+import threading
+from collections import Counter, defaultdict
+from django.db import transaction
+from movies import page_cache
+from movies.models import Movie, MovieGenre, RelatedMovie
+from movies.tasks import task
+
+TOP_K = 12
+DIRECTOR_WEIGHT = 0.2
+ACTORS_WEIGHT = 0.5
+GENRES_WEIGHT = 0.3
+
+EMPTY = frozenset()
+
+
+def jaccard(first, second, common=None):
+    if common is None:
+        common = len(first & second)
+    if not common:
+        return 0.0
+    return common / (len(first) + len(second) - common)
+
+
+class RelatedIndex:
+    """
+    Directors and genres of all movies, and actors of all movies or, when
+    movie_ids are given, of the movies sharing an actor with them. Scores
+    are exact for pairs that include one of movie_ids.
+    """
+
+    def __init__(self, movie_ids=None):
+        Through = Movie.actors.through
+        self.directors = dict(Movie.objects.values_list('id', 'director_id'))
+        genres = defaultdict(set)
+        for movie_id, genre_id in MovieGenre.objects.values_list('movie_id', 'genre_id'):
+            genres[movie_id].add(genre_id)
+        self.genres = {movie_id: frozenset(genres[movie_id]) for movie_id in self.directors}
+        cast = Through.objects.all()
+        if movie_ids is not None:
+            cast = cast.filter(movie_id__in=Through.objects.filter(
+                actor_id__in=Through.objects.filter(movie_id__in=movie_ids).
+                values('actor_id')).values('movie_id'))
+        actors = defaultdict(set)
+        self.by_actor = defaultdict(list)
+        for movie_id, actor_id in cast.values_list('movie_id', 'actor_id'):
+            actors[movie_id].add(actor_id)
+            self.by_actor[actor_id].append(movie_id)
+        self.actors = {movie_id: frozenset(ids) for movie_id, ids in actors.items()}
+        self.by_director = defaultdict(list)
+        self.groups = defaultdict(list)
+        for movie_id in sorted(self.directors):
+            self.by_director[self.directors[movie_id]].append(movie_id)
+            self.groups[self.genres[movie_id]].append(movie_id)
+        self._ranked = {}
+
+    def ranked_groups(self, genres):
+        """Movies grouped by genre set, by descending genre similarity to genres."""
+        if genres not in self._ranked:
+            ranked = [(jaccard(genres, other), members)
+                      for other, members in self.groups.items()]
+            ranked = [group for group in ranked if group[0] > 0]
+            ranked.sort(key=lambda group: (-group[0], group[1][0]))
+            self._ranked[genres] = ranked
+        return self._ranked[genres]
+
+    def score(self, movie_id, other_id, common_actors=None):
+        actors = self.actors.get(movie_id, EMPTY)
+        return (
+            DIRECTOR_WEIGHT * (self.directors[movie_id] == self.directors[other_id]) +
+            ACTORS_WEIGHT * jaccard(actors, self.actors.get(other_id, EMPTY),
+                                    common_actors) +
+            GENRES_WEIGHT * jaccard(self.genres[movie_id], self.genres[other_id])
+        )
+
+    def related(self, movie_id, k=TOP_K):
+        """The k most related movies as a list of (movie id, score)."""
+        common_actors = Counter()
+        for actor_id in self.actors.get(movie_id, EMPTY):
+            common_actors.update(self.by_actor[actor_id])
+        candidates = {other_id: self.score(movie_id, other_id, common_actors[other_id])
+                      for other_id in set(common_actors) |
+                      set(self.by_director[self.directors[movie_id]])
+                      if other_id != movie_id}
+        # Movies related by genres alone come in descending order of score.
+        taken = 0
+        for similarity, members in self.ranked_groups(self.genres[movie_id]):
+            for other_id in members:
+                if other_id == movie_id or other_id in candidates:
+                    continue
+                candidates[other_id] = GENRES_WEIGHT * similarity
+                taken += 1
+                if taken == k:
+                    break
+            if taken == k:
+                break
+        return heapq.nlargest(k, candidates.items(), key=lambda item: (item[1], -item[0]))
+
+    def related_by_genres(self, movie_id):
+        """Movies sharing a genre with movie_id."""
+        for _, members in self.ranked_groups(self.genres[movie_id]):
+            yield from members
+
+
+def _save(lists):
+    """Replace the related movies of the movies in lists, movie id -> [(id, score)]."""
+    rows = [RelatedMovie(movie_id=movie_id, related_id=related_id, rank=rank, score=score)
+            for movie_id, related in lists.items()
+            for rank, (related_id, score) in enumerate(related)]
+    with transaction.atomic():
+        RelatedMovie.objects.filter(movie_id__in=lists).delete()
+        RelatedMovie.objects.bulk_create(rows, batch_size=2000)
+        page_cache.invalidate(*(f'movie:{slug}' for slug in Movie.objects.
+                                filter(id__in=lists).values_list('slug', flat=True)))
+
+
+def rebuild_related_movies(k=TOP_K):
+    index = RelatedIndex()
+    _save({movie_id: index.related(movie_id, k) for movie_id in index.directors})
+
+
+def refresh_related_movies(movie_ids, k=TOP_K):
+    """
+    Recompute the related movies of movie_ids and of the movies that list
+    one of them, and add movie_ids to the lists of other movies they now
+    get into.
+    """
+    movie_ids = set(movie_ids)
+    listing = set(RelatedMovie.objects.filter(related_id__in=movie_ids).
+                  values_list('movie_id', flat=True))
+    index = RelatedIndex(movie_ids | listing)
+    movie_ids &= index.directors.keys()
+    lists = {movie_id: index.related(movie_id, k)
+             for movie_id in (movie_ids | listing) & index.directors.keys()}
+    # The last of each full list, a movie gets in if it ranks before it.
+    last = {movie_id: (score, -related_id) for movie_id, related_id, score in
+            RelatedMovie.objects.filter(rank=k - 1).
+            values_list('movie_id', 'related_id', 'score')}
+    entering = defaultdict(list)
+    for movie_id in movie_ids:
+        others = set(index.related_by_genres(movie_id))
+        others.update(index.by_director[index.directors[movie_id]])
+        for actor_id in index.actors.get(movie_id, EMPTY):
+            others.update(index.by_actor[actor_id])
+        for other_id in others - lists.keys():
+            score = index.score(movie_id, other_id)
+            if score > 0 and (score, -movie_id) > last.get(other_id, (0, 0)):
+                entering[other_id].append((movie_id, score))
+    for other_id, related_id, score in RelatedMovie.objects.\
+            filter(movie_id__in=entering).values_list('movie_id', 'related_id', 'score'):
+        entering[other_id].append((related_id, score))
+    for other_id, related in entering.items():
+        lists[other_id] = heapq.nlargest(k, related, key=lambda item: (item[1], -item[0]))
+    _save(lists)
+
+
+_pending = threading.local()
+
+
+def schedule_refresh(movie_id):
+    """Refresh the related movies of movie_id in the task queue once the
+    transaction commits, once for all the changes of a transaction."""
+    if not hasattr(_pending, 'movie_ids'):
+        _pending.movie_ids = set()
+    _pending.movie_ids.add(movie_id)
+    transaction.on_commit(_refresh_pending)
+
+
+def _refresh_pending():
+    movie_ids = getattr(_pending, 'movie_ids', None)
+    if movie_ids:
+        _pending.movie_ids = set()
+        refresh_related.enqueue(sorted(movie_ids))
+
+
+@task()
+def refresh_related(movie_ids):
+    refresh_related_movies(movie_ids)
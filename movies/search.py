@@ -0,0 +1,141 @@
+"""
+Full-text search over movies, actors and directors.
+
+Every searchable object has a row in SearchDocument. On top of that table
+PostgreSQL keeps a weighted tsvector column with a GIN index and a trigram
+index on the title for typo tolerance, SQLite keeps an FTS5 index that is
+synced by triggers, both created by migration 0005_searchdocument. Other
+backends fall back to a plain icontains lookup.
+"""
+import re
+from django.db import connection
+from django.db.models import Q
+from movies.models import Movie, Actor, Director, SearchDocument
+
+# Upper bound on the number of results returned per kind of object,
+# so that a very common word cannot make the search page unbounded.
+SEARCH_RESULTS_LIMIT = 100
+
+TABLE = SearchDocument._meta.db_table
+FTS_TABLE = TABLE + '_fts'
+
+KIND_BY_MODEL = {
+    Movie: SearchDocument.MOVIE,
+    Actor: SearchDocument.ACTOR,
+    Director: SearchDocument.DIRECTOR,
+}
+
+
+def document_fields(obj):
+    """Return (kind, title, slug, body) of the search document of obj."""
+    if isinstance(obj, Movie):
+        names = [obj.director.name] + \
+            [actor.name for actor in obj.actors.all()]
+        return SearchDocument.MOVIE, obj.title, obj.slug, \
+            obj.synopsis + '\n' + ' '.join(names)
+    if isinstance(obj, Actor):
+        return SearchDocument.ACTOR, obj.name, obj.slugged_name, ''
+    if isinstance(obj, Director):
+        return SearchDocument.DIRECTOR, obj.name, obj.slugged_name, ''
+    raise TypeError(f'{type(obj).__name__} is not searchable')
+
+
+def index_object(obj):
+    kind, title, slug, body = document_fields(obj)
+    SearchDocument.objects.update_or_create(
+        kind=kind, object_id=obj.pk,
+        defaults={'title': title, 'slug': slug, 'body': body}
+    )
+
+
+def index_objects(objects, batch_size=1000):
+    """Create or update the search documents of many objects in bulk."""
+    documents = []
+    for obj in objects:
+        kind, title, slug, body = document_fields(obj)
+        documents.append(SearchDocument(
+            kind=kind, object_id=obj.pk, title=title, slug=slug, body=body
+        ))
+    SearchDocument.objects.bulk_create(
+        documents, batch_size=batch_size, update_conflicts=True,
+        unique_fields=['kind', 'object_id'], update_fields=['title', 'slug', 'body']
+    )
+
+
+def remove_object(obj):
+    SearchDocument.objects.filter(
+        kind=KIND_BY_MODEL[type(obj)], object_id=obj.pk
+    ).delete()
+
+
+def rebuild_index():
+    """Recreate every search document, returns the number of documents."""
+    documents = []
+    movies = Movie.objects.select_related('director').\
+        prefetch_related('actors').all()
+    for queryset in (movies, Actor.objects.all(), Director.objects.all()):
+        for obj in queryset.iterator(chunk_size=1000):
+            kind, title, slug, body = document_fields(obj)
+            documents.append(SearchDocument(
+                kind=kind, object_id=obj.pk, title=title, slug=slug, body=body
+            ))
+    SearchDocument.objects.all().delete()
+    SearchDocument.objects.bulk_create(documents, batch_size=1000)
+    return len(documents)
+
+
+def _fts5_query(query):
+    # Every word of the query has to match, as a prefix so that results
+    # show up while the user is still typing the last word.
+    words = re.findall(r'\w+', query)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _search_postgresql(query, kind, limit, offset):
+    sql = f"""
+        SELECT id, kind, object_id, title, slug
+        FROM {TABLE}, websearch_to_tsquery('english', %s) AS query
+        WHERE kind = %s AND (document @@ query OR title %% %s)
+        ORDER BY ts_rank(document, query) + similarity(title, %s) DESC, title
+        LIMIT %s OFFSET %s
+    """
+    params = [query, kind, query, query, limit, offset]
+    return list(SearchDocument.objects.raw(sql, params))
+
+
+def _search_sqlite(query, kind, limit, offset):
+    match = _fts5_query(query)
+    if not match:
+        return []
+    sql = f"""
+        SELECT d.id, d.kind, d.object_id, d.title, d.slug
+        FROM {FTS_TABLE} JOIN {TABLE} AS d ON d.id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH %s AND d.kind = %s
+        ORDER BY bm25({FTS_TABLE}, 10.0, 1.0), d.title
+        LIMIT %s OFFSET %s
+    """
+    return list(SearchDocument.objects.raw(sql, [match, kind, limit, offset]))
+
+
+def _search_fallback(query, kind, limit, offset):
+    return list(SearchDocument.objects.filter(
+        Q(kind=kind) & (Q(title__icontains=query) | Q(body__icontains=query))
+    ).order_by('title')[offset:offset + limit])
+
+
+BACKENDS = {
+    'postgresql': _search_postgresql,
+    'sqlite': _search_sqlite,
+}
+
+
+def search(query, kind, limit, offset=0):
+    """
+    Return up to limit SearchDocuments of the given kind matching query,
+    best matches first. Results past SEARCH_RESULTS_LIMIT are never returned.
+    """
+    limit = max(0, min(limit, SEARCH_RESULTS_LIMIT - offset))
+    if not limit:
+        return []
+    backend = BACKENDS.get(connection.vendor, _search_fallback)
+    return backend(query, kind, limit, offset)
@@ -0,0 +1,222 @@
+"""
+Synthetic catalog generation for benchmarks and the query budget tests.
+
+Everything is inserted with bulk_create, which bypasses Rating.save() and
+the signals in movies/signals.py, so refresh_derived_data() rebuilds the
+rating aggregates, genre counts, search documents, related movies and
+leaderboards afterwards.
+"""
+import datetime
+import random
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.db import transaction
+from django.template.defaultfilters import slugify
+from movies.models import Movie, Director, Actor, Genre, MovieGenre, Rating, \
+    Review, update_genre_counts
+from movies import autocomplete, facets
+from movies.leaderboards import compute_leaderboards
+from movies.related import rebuild_related_movies
+from movies.search import rebuild_index
+
+SEED_PASSWORD = 'seeded-password'
+
+GENRE_NAMES = [
+    'Drama', 'Comedy', 'Action', 'Thriller', 'Horror', 'Romance', 'Western',
+    'Fantasy', 'Animation', 'Documentary', 'Crime', 'Mystery', 'Musical',
+    'Adventure', 'War', 'History', 'Biography', 'Family', 'Sport', 'Noir'
+]
+
+WORDS = [
+    'silent', 'river', 'night', 'empire', 'golden', 'last', 'city', 'storm',
+    'shadow', 'garden', 'winter', 'broken', 'iron', 'secret', 'distant',
+    'burning', 'glass', 'wild', 'hidden', 'paper', 'lonely', 'summer'
+]
+
+
+# (label, url name, url arguments, visitors) of the pages requested by the
+# benchmarks and the query budget tests. url arguments is a function of the
+# objects returned by sample_objects(), visitors are 'anonymous' and/or
+# 'authenticated'.
+ROUTES = [
+    ('index', 'movies:index', lambda c: (), ('anonymous', 'authenticated')),
+    ('browse', 'movies:browse', lambda c: (), ('anonymous', 'authenticated')),
+    ('leaderboard', 'movies:leaderboard', lambda c: ('top-rated', ),
+     ('anonymous', 'authenticated')),
+    ('genre leaderboard', 'movies:genre-leaderboard',
+     lambda c: ('trending', c['genre'].slug), ('anonymous', 'authenticated')),
+    ('country leaderboard', 'movies:country-leaderboard',
+     lambda c: ('most-rated', c['movie'].country), ('anonymous', 'authenticated')),
+    ('genre page', 'movies:genre-movies', lambda c: (c['genre'].slug, ),
+     ('anonymous', 'authenticated')),
+    ('movie detail', 'movies:movie-detail', lambda c: (c['movie'].slug, ),
+     ('anonymous', 'authenticated')),
+    ('movie viewer', 'movies:movie-viewer', lambda c: (c['movie'].id, ),
+     ('anonymous', 'authenticated')),
+    ('director page', 'movies:director-page',
+     lambda c: (c['movie'].director.slugged_name, ), ('anonymous', 'authenticated')),
+    ('actor page', 'movies:actor-page', lambda c: (c['actor'].slugged_name, ),
+     ('anonymous', 'authenticated')),
+    ('rate movie', 'movies:rate-movie', lambda c: (c['movie'].id, ),
+     ('anonymous', 'authenticated')),
+    ('update rating', 'movies:rate-movie-update', lambda c: (c['movie'].id, ),
+     ('authenticated', )),
+    ('review list', 'movies:review-list', lambda c: (c['movie'].id, ),
+     ('anonymous', 'authenticated')),
+    ('review movie', 'movies:review-movie', lambda c: (c['movie'].id, ),
+     ('anonymous', 'authenticated')),
+    ('review detail', 'movies:review-detail', lambda c: (c['movie'].id, ),
+     ('authenticated', )),
+    ('search', 'movies:search', lambda c: (), ('anonymous', 'authenticated')),
+    ('autocomplete', 'movies:autocomplete', lambda c: (), ('anonymous', 'authenticated')),
+    ('api movie list', 'api:movie-list', lambda c: (), ('anonymous', 'authenticated')),
+    ('api movie detail', 'api:movie-detail', lambda c: (c['movie'].slug, ),
+     ('anonymous', 'authenticated')),
+    ('api movie ratings', 'api:movie-ratings', lambda c: (c['movie'].id, ),
+     ('anonymous', 'authenticated')),
+    ('api review list', 'api:review-list', lambda c: (c['movie'].id, ),
+     ('anonymous', 'authenticated')),
+    ('api leaderboard', 'api:leaderboard', lambda c: ('most-rated', ),
+     ('anonymous', 'authenticated')),
+    ('api genre list', 'api:genre-list', lambda c: (), ('anonymous', 'authenticated')),
+    ('api genre detail', 'api:genre-detail', lambda c: (c['genre'].slug, ),
+     ('anonymous', 'authenticated')),
+    ('api director list', 'api:director-list', lambda c: (),
+     ('anonymous', 'authenticated')),
+    ('api director detail', 'api:director-detail',
+     lambda c: (c['movie'].director.slugged_name, ), ('anonymous', 'authenticated')),
+    ('api actor list', 'api:actor-list', lambda c: (), ('anonymous', 'authenticated')),
+    ('api actor detail', 'api:actor-detail', lambda c: (c['actor'].slugged_name, ),
+     ('anonymous', 'authenticated')),
+    ('register', 'users:register', lambda c: (), ('anonymous', 'authenticated')),
+    ('login', 'users:login', lambda c: (), ('anonymous', 'authenticated')),
+    ('change user', 'users:change-user', lambda c: (), ('authenticated', )),
+    ('become user', 'users:become-user', lambda c: (), ('anonymous', 'authenticated')),
+    ('logout', 'users:logout', lambda c: (), ('anonymous', 'authenticated')),
+]
+
+QUERY_STRINGS = {
+    'browse': lambda c: {'genre': c['genre'].slug, 'country': c['movie'].country},
+    'search': lambda c: {'q': c['movie'].title.split()[1]},
+    'autocomplete': lambda c: {'q': c['movie'].title.split()[1]},
+    'api movie list': lambda c: {'include': 'director,actors,genres'},
+    'api movie detail': lambda c: {'include': 'director,actors,genres'},
+}
+
+
+class Catalog:
+    """Sizes of a synthetic catalog, with defaults good for quick checks."""
+
+    def __init__(self, movies=50, directors=10, actors=100, genres=8, users=30,
+                 actors_per_movie=4, genres_per_movie=2, ratings_per_movie=10,
+                 reviews_per_movie=3, seed=0):
+        self.movies = movies
+        self.directors = directors
+        self.actors = actors
+        self.genres = genres
+        self.users = users
+        self.actors_per_movie = min(actors_per_movie, actors)
+        self.genres_per_movie = min(genres_per_movie, genres)
+        self.ratings_per_movie = min(ratings_per_movie, users)
+        self.reviews_per_movie = min(reviews_per_movie, users)
+        self.seed = seed
+
+
+def _title(rng, number):
+    return ' '.join(rng.choice(WORDS) for _ in range(3)).title() + f' {number}'
+
+
+def seed_catalog(catalog, prefix='seed', batch_size=2000):
+    """
+    Insert a synthetic catalog and return it. prefix keeps names unique
+    when seeding several times into the same database.
+    """
+    rng = random.Random(catalog.seed)
+    with transaction.atomic():
+        directors = Director.objects.bulk_create([
+            Director(name=f'{prefix} director {i}',
+                     slugged_name=slugify(f'{prefix} director {i}'),
+                     photo='movies/images/seed.jpg')
+            for i in range(catalog.directors)
+        ], batch_size=batch_size)
+        actors = Actor.objects.bulk_create([
+            Actor(name=f'{prefix} actor {i}',
+                  slugged_name=slugify(f'{prefix} actor {i}'),
+                  photo='movies/images/seed.jpg')
+            for i in range(catalog.actors)
+        ], batch_size=batch_size)
+        genres = []
+        for i in range(catalog.genres):
+            name = GENRE_NAMES[i % len(GENRE_NAMES)]
+            if i >= len(GENRE_NAMES):
+                name += f' {i // len(GENRE_NAMES)}'
+            genre = Genre.objects.filter(name=name).first()
+            genres.append(genre or Genre(name=name, slug=slugify(name)))
+        Genre.objects.bulk_create([genre for genre in genres if genre.pk is None])
+        genres = list(Genre.objects.filter(name__in=[genre.name for genre in genres]))
+        User = get_user_model()
+        password = make_password(SEED_PASSWORD)
+        users = User.objects.bulk_create([
+            User(username=f'{prefix}_user_{i}', email=f'{prefix}_user_{i}@example.com',
+                 password=password)
+            for i in range(catalog.users)
+        ], batch_size=batch_size)
+        titles = [f'{prefix} ' + _title(rng, i) for i in range(catalog.movies)]
+        movies = Movie.objects.bulk_create([
+            Movie(title=title, slug=slugify(title),
+                  synopsis=' '.join(rng.choice(WORDS) for _ in range(40)),
+                  release_date=datetime.date(1950 + rng.randrange(74), rng.randint(1, 12), 1),
+                  country=rng.choice(Movie.COUNTRIES)[0],
+                  poster='movies/images/seed.jpg',
+                  director=rng.choice(directors))
+            for title in titles
+        ], batch_size=batch_size)
+        Through = Movie.actors.through
+        cast, movie_genres, ratings, reviews = [], [], [], []
+        for movie in movies:
+            for actor in rng.sample(actors, catalog.actors_per_movie):
+                cast.append(Through(movie_id=movie.id, actor_id=actor.id))
+            for genre in rng.sample(genres, catalog.genres_per_movie):
+                movie_genres.append(MovieGenre(movie_id=movie.id, genre_id=genre.id))
+            for user in rng.sample(users, catalog.ratings_per_movie):
+                ratings.append(Rating(movie=movie, owner=user,
+                                      rating=rng.randint(0, 10)))
+            for user in rng.sample(users, catalog.reviews_per_movie):
+                reviews.append(Review(movie=movie, owner=user, content=' '.join(
+                    rng.choice(WORDS) for _ in range(30))))
+        Through.objects.bulk_create(cast, batch_size=batch_size)
+        MovieGenre.objects.bulk_create(movie_genres, batch_size=batch_size)
+        Rating.objects.bulk_create(ratings, batch_size=batch_size)
+        Review.objects.bulk_create(reviews, batch_size=batch_size)
+        refresh_derived_data()
+    return {
+        'directors': directors, 'actors': actors, 'genres': genres,
+        'users': users, 'movies': movies
+    }
+
+
+def sample_objects(seeded):
+    """
+    Objects of a seeded catalog that the routes are requested for: a movie,
+    a user who rated and reviewed it, one of its actors and genres.
+    """
+    movie = seeded['movies'][0]
+    user = movie.ratings.first().owner
+    if not movie.reviews.filter(owner=user).exists():
+        movie.reviews.create(owner=user, content='Seeded review of the movie.')
+    return {
+        'movie': movie, 'user': user, 'actor': movie.actors.first(),
+        'genre': movie.genres.first()
+    }
+
+
+def refresh_derived_data():
+    call_command('reconcile_ratings', stdout=StringIO())
+    update_genre_counts()
+    rebuild_index()
+    rebuild_related_movies()
+    compute_leaderboards()
+    autocomplete.index.invalidate()
+    facets.index.invalidate()
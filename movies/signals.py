@@ -0,0 +1,322 @@
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, \
+    pre_delete, pre_save
+from django.dispatch import receiver
+from movies import autocomplete, facets, page_cache, related, search, thumbnails
+from movies.models import Movie, Actor, Director, Genre, LeaderboardEntry, \
+    MovieGenre, Rating, Review, update_genre_counts, update_movie_rating
+
+
+@receiver(post_delete, sender=Rating)
+def rating_deleted(sender, instance, **kwargs):
+    # Also fires for ratings removed by cascade, e.g. when a user is deleted,
+    # the collector runs the whole delete inside one transaction.
+    update_movie_rating(instance.movie_id, removed=instance.rating)
+
+
+def added_genres(instance, reverse, pk_set):
+    """Movie ids and genre ids of a Movie.genres or Genre.movies add()."""
+    if reverse:
+        return pk_set, {instance.pk}
+    return {instance.pk}, pk_set
+
+
+# Movie.genres.add() and set() insert MovieGenre rows with bulk_create and
+# only send m2m_changed, remove(), clear() and deleting a movie or a genre
+# delete them one at a time, as does GenreInline in the admin, which also
+# saves them one at a time. Counts are recounted rather than incremented,
+# so a change seen twice does not count twice.
+@receiver(m2m_changed, sender=MovieGenre)
+def genres_added(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'post_add' and pk_set:
+        update_genre_counts(added_genres(instance, reverse, pk_set)[1])
+
+
+@receiver(post_save, sender=MovieGenre)
+def genre_row_saved(sender, instance, created, **kwargs):
+    # A changed row may have moved the movie out of another genre.
+    update_genre_counts([instance.genre_id] if created else None)
+
+
+@receiver(post_delete, sender=MovieGenre)
+def genre_row_deleted(sender, instance, **kwargs):
+    update_genre_counts([instance.genre_id])
+
+
+@receiver(post_save, sender=Movie)
+def movie_saved(sender, instance, **kwargs):
+    search.index_object(instance)
+    transaction.on_commit(lambda: autocomplete.index.update(instance))
+
+
+@receiver(post_save, sender=Actor)
+@receiver(post_save, sender=Director)
+def person_saved(sender, instance, created, **kwargs):
+    search.index_object(instance)
+    transaction.on_commit(lambda: autocomplete.index.update(instance))
+    if not created:
+        # Names are part of the documents of the movies they appear in.
+        movies = Movie.objects.select_related('director').\
+            filter(Q(actors=instance) if sender is Actor else Q(director=instance))
+        for movie in movies.distinct():
+            search.index_object(movie)
+
+
+@receiver(post_delete, sender=Movie)
+@receiver(post_delete, sender=Actor)
+@receiver(post_delete, sender=Director)
+def searchable_deleted(sender, instance, **kwargs):
+    search.remove_object(instance)
+    transaction.on_commit(lambda: autocomplete.index.remove(instance))
+
+
+@receiver(m2m_changed, sender=Movie.actors.through)
+def movie_actors_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        search.index_object(instance)
+    elif pk_set:
+        for movie in Movie.objects.select_related('director').filter(pk__in=pk_set):
+            search.index_object(movie)
+
+
+# ActorInline in the admin saves and deletes through rows directly,
+# which does not send m2m_changed.
+@receiver(post_save, sender=Movie.actors.through)
+@receiver(post_delete, sender=Movie.actors.through)
+def movie_actor_row_changed(sender, instance, **kwargs):
+    movie = Movie.objects.select_related('director').\
+        filter(pk=instance.movie_id).first()
+    if movie:
+        search.index_object(movie)
+
+
+# Page cache invalidation. Pages are tagged in movies/views.py, the tags of
+# a movie cover its detail and review pages and the genre, director and
+# actor pages its card is shown on.
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def rating_changed(sender, instance, **kwargs):
+    page_cache.invalidate(*page_cache.movie_tags(instance.movie_id))
+
+
+@receiver(post_save, sender=Rating)
+def author_rating_saved(sender, instance, **kwargs):
+    Review.objects.filter(movie_id=instance.movie_id, owner_id=instance.owner_id).\
+        update(author_rating=instance.rating)
+
+
+@receiver(post_delete, sender=Rating)
+def author_rating_deleted(sender, instance, **kwargs):
+    Review.objects.filter(movie_id=instance.movie_id, owner_id=instance.owner_id).\
+        update(author_rating=None)
+
+
+@receiver(pre_save, sender=Review)
+def review_saving(sender, instance, **kwargs):
+    if instance._state.adding:
+        instance.author_rating = Rating.objects.filter(
+            movie_id=instance.movie_id, owner_id=instance.owner_id).\
+            values_list('rating', flat=True).first()
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def review_changed(sender, instance, **kwargs):
+    page_cache.invalidate(f'movie:{instance.movie_id}')
+
+
+@receiver(pre_save, sender=Movie)
+@receiver(pre_delete, sender=Movie)
+def movie_changing(sender, instance, **kwargs):
+    # Tags of the movie as it is before the change, e.g. under its old slug.
+    if instance.pk:
+        page_cache.invalidate('search', *page_cache.movie_tags(instance.pk))
+        # The boards link to the movie by its title and slug.
+        if LeaderboardEntry.objects.filter(movie_id=instance.pk).exists():
+            page_cache.invalidate('leaderboards')
+
+
+@receiver(post_save, sender=Movie)
+def movie_changed(sender, instance, **kwargs):
+    page_cache.invalidate('search', *page_cache.movie_tags(instance.pk))
+
+
+@receiver(pre_save, sender=Actor)
+@receiver(pre_save, sender=Director)
+@receiver(pre_delete, sender=Actor)
+@receiver(pre_delete, sender=Director)
+@receiver(post_save, sender=Actor)
+@receiver(post_save, sender=Director)
+def person_changed(sender, instance, **kwargs):
+    if not instance.pk:
+        return
+    kind = 'actor' if sender is Actor else 'director'
+    old_slug = sender.objects.filter(pk=instance.pk).\
+        values_list('slugged_name', flat=True).first()
+    tags = ['search', f'{kind}:{old_slug}', f'{kind}:{instance.slugged_name}']
+    if sender is Actor:
+        # Actors are only named on the detail pages of their movies.
+        for movie_id, slug in instance.movie_set.values_list('id', 'slug'):
+            tags += [f'movie:{movie_id}', f'movie:{slug}']
+    else:
+        for movie_id in instance.movies.values_list('id', flat=True):
+            tags += page_cache.movie_tags(movie_id)
+    page_cache.invalidate(*tags)
+
+
+@receiver(m2m_changed, sender=Movie.actors.through)
+def movie_actors_changing(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('pre_clear', 'post_add', 'post_remove'):
+        return
+    if not reverse:
+        actors = Actor.objects.filter(pk__in=pk_set) if pk_set is not None \
+            else instance.actors.all()
+        page_cache.invalidate(
+            *page_cache.movie_tags(instance.pk),
+            *[f'actor:{slug}' for slug in actors.values_list('slugged_name', flat=True)]
+        )
+    else:
+        movie_ids = pk_set if pk_set is not None else \
+            instance.movie_set.values_list('id', flat=True)
+        tags = [f'actor:{instance.slugged_name}']
+        for movie_id in movie_ids:
+            tags += page_cache.movie_tags(movie_id)
+        page_cache.invalidate(*tags)
+
+
+@receiver(post_save, sender=Movie.actors.through)
+@receiver(post_delete, sender=Movie.actors.through)
+def movie_actor_row_saved(sender, instance, **kwargs):
+    slug = Actor.objects.filter(pk=instance.actor_id).\
+        values_list('slugged_name', flat=True).first()
+    page_cache.invalidate(f'actor:{slug}', *page_cache.movie_tags(instance.movie_id))
+
+
+def genre_pages_changed(movie_ids, genre_ids):
+    tags = ['genres'] + [f'genre:{slug}' for slug in Genre.objects.
+                         filter(pk__in=genre_ids).values_list('slug', flat=True)]
+    for movie_id in movie_ids:
+        tags += page_cache.movie_tags(movie_id)
+    page_cache.invalidate(*tags)
+
+
+@receiver(m2m_changed, sender=MovieGenre)
+def movie_genres_changing(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'post_add' and pk_set:
+        genre_pages_changed(*added_genres(instance, reverse, pk_set))
+
+
+@receiver(post_save, sender=MovieGenre)
+@receiver(post_delete, sender=MovieGenre)
+def movie_genre_row_changed(sender, instance, **kwargs):
+    genre_pages_changed([instance.movie_id], [instance.genre_id])
+
+
+@receiver(pre_save, sender=Genre)
+@receiver(post_save, sender=Genre)
+def genre_renamed(sender, instance, **kwargs):
+    if not instance.pk:
+        return
+    old_slug = Genre.objects.filter(pk=instance.pk).\
+        values_list('slug', flat=True).first()
+    tags = ['genres', f'genre:{old_slug}', f'genre:{instance.slug}']
+    # Pages of its movies, their directors and actors name the genre too.
+    for movie_id in instance.movies.values_list('id', flat=True):
+        tags += page_cache.movie_tags(movie_id)
+    page_cache.invalidate(*tags)
+
+
+# Related movies, refreshed on commit for all the changes of a transaction.
+
+@receiver(post_save, sender=Movie)
+def movie_related_changed(sender, instance, **kwargs):
+    related.schedule_refresh(instance.pk)
+
+
+@receiver(m2m_changed, sender=Movie.actors.through)
+def movie_cast_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # pk_set is None on clear, the movies are gone by post_clear.
+        for movie_id in instance.movie_set.values_list('id', flat=True):
+            related.schedule_refresh(movie_id)
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        related.schedule_refresh(instance.pk)
+    elif pk_set:
+        for movie_id in pk_set:
+            related.schedule_refresh(movie_id)
+
+
+@receiver(post_save, sender=Movie.actors.through)
+@receiver(post_delete, sender=Movie.actors.through)
+def movie_cast_row_changed(sender, instance, **kwargs):
+    related.schedule_refresh(instance.movie_id)
+
+
+@receiver(m2m_changed, sender=MovieGenre)
+def movie_genres_added(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'post_add' and pk_set:
+        for movie_id in added_genres(instance, reverse, pk_set)[0]:
+            related.schedule_refresh(movie_id)
+
+
+@receiver(post_save, sender=MovieGenre)
+@receiver(post_delete, sender=MovieGenre)
+def movie_genre_row_related_changed(sender, instance, **kwargs):
+    related.schedule_refresh(instance.movie_id)
+
+
+# The facet index of the browse page, dropped in this process and rebuilt
+# on the next lookup, see movies/facets.py.
+
+@receiver(post_save, sender=Movie)
+@receiver(post_delete, sender=Movie)
+@receiver(post_save, sender=Director)
+@receiver(post_delete, sender=Director)
+@receiver(post_save, sender=MovieGenre)
+@receiver(post_delete, sender=MovieGenre)
+@receiver(m2m_changed, sender=MovieGenre)
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def catalog_changed(sender, **kwargs):
+    transaction.on_commit(facets.index.invalidate)
+
+
+# Renditions of posters and photos, made in the task queue, see
+# movies/thumbnails.py. Replaced and deleted images are also deleted there
+# rather than by django_cleanup in the request.
+
+@receiver(pre_save, sender=Movie)
+@receiver(pre_save, sender=Actor)
+@receiver(pre_save, sender=Director)
+def image_saving(sender, instance, **kwargs):
+    field = thumbnails.IMAGE_FIELDS[sender]
+    instance._previous_image = sender.objects.filter(pk=instance.pk).\
+        values_list(field, flat=True).first() if instance.pk else None
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_save, sender=Actor)
+@receiver(post_save, sender=Director)
+def image_saved(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_image', None)
+    if previous and previous != getattr(instance, thumbnails.IMAGE_FIELDS[sender]).name:
+        thumbnails.schedule_delete([previous])
+    if getattr(instance, thumbnails.IMAGE_FIELDS[sender]).name and \
+            not thumbnails.is_current(instance):
+        thumbnails.schedule(instance)
+
+
+@receiver(post_delete, sender=Movie)
+@receiver(post_delete, sender=Actor)
+@receiver(post_delete, sender=Director)
+def image_deleted(sender, instance, **kwargs):
+    thumbnails.schedule_delete([
+        getattr(instance, thumbnails.IMAGE_FIELDS[sender]).name,
+        *getattr(instance, thumbnails.thumbnails_field(sender)).get('files', [])
+    ])
@@ -0,0 +1,156 @@
+"""
+Database-backed task queue for slow side effects of requests.
+
+A function decorated with @task can be enqueued instead of run:
+
+    @task(max_attempts=5)
+    def generate_thumbnails(model, pk):
+        ...
+
+    generate_thumbnails.enqueue('movies.movie', 42, key='thumbnails:movies.movie:42')
+
+enqueue() inserts a Task row when the current transaction commits, so the
+work never runs for a change that was rolled back and the request returns
+without waiting for it. Arguments have to be JSON serializable. Pending
+tasks with the same key are enqueued once, e.g. saving a movie twice
+before a worker gets to it makes its thumbnails once.
+
+`manage.py run_tasks` claims due tasks in batches and runs them on a pool
+of threads, more workers can run side by side in other processes. A task
+that raises is retried up to max_attempts times, retry_delay seconds
+later and twice as long after each attempt, then left as failed with its
+traceback for the admin to look at. Succeeded tasks are deleted.
+
+A task decorated with @task(every=seconds) is periodic: run_tasks
+enqueues it when it starts and every run enqueues the next one, so the
+recomputations of the catalog need no cron. Periodic tasks take no
+arguments.
+
+With TASKS_RUN_INLINE = True tasks run when the transaction commits, in
+the process enqueueing them, e.g. to work without a worker in development.
+Periodic tasks are then left to their management commands.
+"""
+import datetime
+import logging
+import traceback
+import uuid
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from movies.models import Task
+
+logger = logging.getLogger(__name__)
+
+TASKS_RUN_INLINE = getattr(settings, 'TASKS_RUN_INLINE', False)
+# How long a claimed task is left to its worker before others may run it.
+TASK_LEASE = getattr(settings, 'TASK_LEASE', 600)
+
+registry = {}
+
+
+def task(max_attempts=5, retry_delay=30, every=None):
+    def decorator(function):
+        name = f'{function.__module__}.{function.__name__}'
+        function.task_name = name
+        function.max_attempts = max_attempts
+        function.retry_delay = retry_delay
+        function.every = every
+        function.enqueue = lambda *arguments, key=None, delay=0: \
+            enqueue(name, arguments, key=key, delay=delay)
+        registry[name] = function
+        return function
+    return decorator
+
+
+def schedule_periodic():
+    """Enqueue the periodic tasks that are not pending yet."""
+    if TASKS_RUN_INLINE:
+        return
+    for name, function in registry.items():
+        if function.every is not None:
+            enqueue(name, key=f'periodic:{name}')
+
+
+def enqueue(name, arguments=(), key=None, delay=0):
+    """Add a task when the current transaction commits."""
+    if TASKS_RUN_INLINE:
+        transaction.on_commit(lambda: registry[name](*arguments))
+        return
+
+    def insert():
+        run_after = timezone.now() + datetime.timedelta(seconds=delay)
+        # Conflicts with a pending task of the same key are ignored.
+        Task.objects.bulk_create([Task(
+            name=name, arguments=list(arguments), key=key, run_after=run_after
+        )], ignore_conflicts=True)
+        if key is not None:
+            # A pending one waiting to be retried starts over.
+            Task.objects.filter(key=key, status=Task.PENDING, attempts__gt=0).\
+                update(attempts=0, run_after=run_after, last_error='')
+    transaction.on_commit(insert)
+
+
+def claim(limit, lease=TASK_LEASE):
+    """Claim up to limit due tasks for this worker and return them."""
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    due = Task.objects.filter(
+        Q(status=Task.PENDING, run_after__lte=now) |
+        Q(status=Task.RUNNING, locked_until__lt=now)
+    )
+    with transaction.atomic():
+        # Rows other workers are claiming are skipped on PostgreSQL, the
+        # conditional update below settles races on other databases.
+        ids = list(due.select_for_update(skip_locked=True).
+                   order_by('run_after', 'id').values_list('id', flat=True)[:limit])
+        due.filter(id__in=ids).update(
+            status=Task.RUNNING, locked_by=token,
+            locked_until=now + datetime.timedelta(seconds=lease),
+            attempts=F('attempts') + 1
+        )
+    return list(Task.objects.filter(locked_by=token, status=Task.RUNNING).order_by('id'))
+
+
+def run(claimed):
+    """Run a claimed task, returns whether it succeeded."""
+    function = registry.get(claimed.name)
+    try:
+        if function is None:
+            raise LookupError(f'Unknown task {claimed.name}')
+        if claimed.attempts == 1 and function.every is not None:
+            # The next run is pending while this one runs, whether it
+            # succeeds or not.
+            enqueue(claimed.name, key=f'periodic:{claimed.name}', delay=function.every)
+        if claimed.attempts > function.max_attempts:
+            # Claimed again after the lease of every attempt ran out.
+            raise TimeoutError(f'Not finished in {claimed.attempts - 1} attempt(s)')
+        function(*claimed.arguments)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('Task %s %s failed (attempt %s)', claimed.pk, claimed.name,
+                       claimed.attempts)
+        retry = function is not None and claimed.attempts < function.max_attempts
+        changes = {'last_error': error, 'locked_by': '', 'locked_until': None}
+        if retry:
+            delay = function.retry_delay * 2 ** (claimed.attempts - 1)
+            changes.update(status=Task.PENDING,
+                           run_after=timezone.now() + datetime.timedelta(seconds=delay))
+        else:
+            changes['status'] = Task.FAILED
+        mine = Task.objects.filter(pk=claimed.pk, locked_by=claimed.locked_by)
+        try:
+            with transaction.atomic():
+                mine.update(**changes)
+        except IntegrityError:
+            # A pending task with the same key was added meanwhile, it
+            # retries this one.
+            mine.delete()
+        return False
+    else:
+        Task.objects.filter(pk=claimed.pk, locked_by=claimed.locked_by).delete()
+        return True
+    finally:
+        # Worker threads have their own connections, closed after each task
+        # like the request cycle does.
+        connections.close_all()
@@ -0,0 +1,29 @@
+from django import template
+from django.utils.html import format_html
+from movies import thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag
+def responsive_image(obj, alt, sizes='300px', css_class='', style=''):
+    """
+    The poster or photo of obj from its renditions, see movies/thumbnails.py,
+    or the original image while they are not made yet.
+    """
+    style = f'{style} height: auto;'.strip()
+    renditions = getattr(obj, thumbnails.thumbnails_field(type(obj)))
+    if not thumbnails.is_current(obj):
+        return format_html(
+            '<img src="{}" alt="{}" class="{}" style="{}" loading="lazy">',
+            thumbnails.image_url(obj), alt, css_class, style
+        )
+    width, height = thumbnails.size_of(thumbnails.DEFAULT_WIDTH)
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" '
+        'class="{}" style="{}" loading="lazy" decoding="async"></picture>',
+        renditions['srcset']['webp'], sizes, renditions['src'],
+        renditions['srcset']['jpeg'], sizes, width, height, alt, css_class, style
+    )
+
@@ -0,0 +1,469 @@
+import datetime
+import os
+import tempfile
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+from movies import exports, page_cache, recommendations, tasks
+from movies.models import Genre, LeaderboardEntry, Movie, Rating, SimilarMovie, \
+    Task, VersionStamp
+from movies.seeding import QUERY_STRINGS, ROUTES, Catalog, sample_objects, \
+    seed_catalog
+
+# Seeded rows store the URLs of their images, which are resolved by the
+# storage without uploading anything.
+STORAGE = 'django.core.files.storage.InMemoryStorage'
+
+# Number of queries of each page in ROUTES as (anonymous, authenticated),
+# as rendered, not as served by the page cache. Catalog pages include the
+# version stamp lookup of movies.page_cache.conditional_page.
+BUDGETS = {
+    'index': (2, 4),
+    'browse': (2, 4),
+    'leaderboard': (2, 4),
+    'genre leaderboard': (3, 5),
+    'country leaderboard': (2, 4),
+    'genre page': (4, 6),
+    'movie detail': (6, 6),
+    'movie viewer': (1, 3),
+    'director page': (5, 7),
+    'actor page': (5, 7),
+    'rate movie': (1, 4),
+    'update rating': (None, 4),
+    'review list': (4, 7),
+    'review movie': (1, 4),
+    'review detail': (None, 5),
+    'search': (4, 6),
+    'autocomplete': (0, 0),
+    'api movie list': (4, 4),
+    'api movie detail': (5, 5),
+    'api movie ratings': (2, 2),
+    'api review list': (3, 3),
+    'api leaderboard': (2, 2),
+    'api genre list': (2, 2),
+    'api genre detail': (2, 2),
+    'api director list': (1, 1),
+    'api director detail': (2, 2),
+    'api actor list': (1, 1),
+    'api actor detail': (2, 2),
+    'register': (0, 2),
+    'login': (0, 2),
+    'change user': (None, 2),
+    'become user': (0, 0),
+    'logout': (0, 4),
+}
+
+# Most rows each page in ROUTES may fetch, for either visitor, as counted
+# by RowCounter on the catalog of LargeCatalogQueryBudgetTests. A page that
+# starts loading more, e.g. every rating of a movie, goes over them.
+ROW_BUDGETS = {
+    'index': 6,
+    'browse': 20,
+    'leaderboard': 43,
+    'genre leaderboard': 29,
+    'country leaderboard': 9,
+    'genre page': 78,
+    'movie detail': 18,
+    'movie viewer': 3,
+    'director page': 43,
+    'actor page': 28,
+    'rate movie': 4,
+    'update rating': 4,
+    'review list': 15,
+    'review movie': 4,
+    'review detail': 5,
+    'search': 2,
+    'autocomplete': 0,
+    'api movie list': 269,
+    'api movie detail': 13,
+    'api movie ratings': 2,
+    'api review list': 11,
+    'api leaderboard': 41,
+    'api genre list': 4,
+    'api genre detail': 1,
+    'api director list': 4,
+    'api director detail': 1,
+    'api actor list': 25,
+    'api actor detail': 1,
+    'register': 2,
+    'login': 2,
+    'change user': 2,
+    'become user': 0,
+    'logout': 3,
+}
+
+# Routes that are not pages, checked by the tests of QueryBudgetTests below.
+OTHER_ROUTES = ['movies:rate-movie-delete', 'movies:review-delete', 'movies:export']
+
+
+def seed(size):
+    # The sample user rated and reviewed the sample movie, so that the
+    # update and detail pages render their full content. The cast, ratings
+    # and reviews of every movie grow with the catalog too.
+    return sample_objects(seed_catalog(Catalog(
+        movies=size, directors=max(2, size // 10), actors=size, genres=4,
+        users=max(30, size // 2), actors_per_movie=size // 5,
+        ratings_per_movie=size // 2, reviews_per_movie=size // 5, seed=size
+    )))
+
+
+class RowCounter:
+    """
+    Counts the rows fetched by the queries run on a connection, installed
+    with connection.execute_wrapper(). Only the rows Django reads count,
+    not the ones a query matches.
+    """
+
+    def __init__(self):
+        self.rows = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        cursor = context['cursor']
+        if 'fetchone' not in vars(cursor):
+            cursor.fetchone = self.counted(cursor.fetchone, lambda row: row is not None)
+            cursor.fetchmany = self.counted(cursor.fetchmany, len)
+            cursor.fetchall = self.counted(cursor.fetchall, len)
+        return result
+
+    def counted(self, fetch, count):
+        def counted_fetch(*args):
+            rows = fetch(*args)
+            self.rows += count(rows)
+            return rows
+        return counted_fetch
+
+
+def route_names():
+    names = set()
+    for namespace in ('movies', 'api', 'users'):
+        _, resolver = get_resolver().namespace_dict[namespace]
+        names.update(f'{namespace}:{name}' for name in resolver.reverse_dict
+                     if isinstance(name, str))
+    return names
+
+
+@override_settings(PAGE_CACHE_ENABLED=False, DEFAULT_FILE_STORAGE=STORAGE)
+class QueryBudgetTests(TestCase):
+    """
+    Every route runs a fixed number of queries, the same on a catalog twice
+    as large, see LargeCatalogQueryBudgetTests, and fetches a bounded
+    number of rows.
+    """
+    catalog_size = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sample = seed(cls.catalog_size)
+
+    def client_for(self, visitor):
+        client = Client()
+        if visitor == 'authenticated':
+            client.force_login(self.sample['user'])
+        return client
+
+    def test_every_route_has_a_budget(self):
+        names = {name for label, name, arguments, visitors in ROUTES}
+        self.assertEqual(route_names() - names - set(OTHER_ROUTES), set())
+        self.assertEqual({label for label, *rest in ROUTES}, set(BUDGETS))
+        self.assertEqual(set(ROW_BUDGETS), set(BUDGETS))
+
+    def test_pages(self):
+        for label, name, arguments, visitors in ROUTES:
+            url = reverse(name, args=arguments(self.sample))
+            params = QUERY_STRINGS.get(label, lambda c: {})(self.sample)
+            for visitor, budget in zip(('anonymous', 'authenticated'), BUDGETS[label]):
+                if visitor not in visitors:
+                    continue
+                with self.subTest(label, visitor=visitor):
+                    client = self.client_for(visitor)
+                    # The first request warms process-level caches (content
+                    # types, the autocomplete index), only the second one
+                    # is measured.
+                    client.get(url, params)
+                    client = self.client_for(visitor)
+                    counter = RowCounter()
+                    with self.assertNumQueries(budget), connection.execute_wrapper(counter):
+                        response = client.get(url, params)
+                    self.assertLessEqual(counter.rows, ROW_BUDGETS[label])
+                    self.assertLess(response.status_code, 400)
+
+    def test_delete_rating(self):
+        client = self.client_for('authenticated')
+        url = reverse('movies:rate-movie-delete', args=(self.sample['movie'].id, ))
+        with self.assertNumQueries(11):
+            response = client.post(url)
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(self.sample['movie'].ratings.filter(owner=self.sample['user']).exists())
+
+    def test_delete_review(self):
+        client = self.client_for('authenticated')
+        url = reverse('movies:review-delete', args=(self.sample['movie'].id, ))
+        with self.assertNumQueries(6):
+            response = client.post(url)
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(self.sample['movie'].reviews.filter(owner=self.sample['user']).exists())
+
+    def test_export(self):
+        staff = get_user_model().objects.create_user(
+            'staff', 'staff@example.com', 'password', is_staff=True)
+        client = Client()
+        client.force_login(staff)
+        url = reverse('movies:export', args=('ratings', ))
+        params = {'movie': self.sample['movie'].id, 'format': 'csv'}
+        with self.assertNumQueries(3):
+            response = client.get(url, params)
+            content = b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content.count(b'\n'), self.sample['movie'].ratings.count() + 1)
+
+
+class LargeCatalogQueryBudgetTests(QueryBudgetTests):
+    catalog_size = 40
+
+
+@override_settings(PAGE_CACHE_ENABLED=False, DEFAULT_FILE_STORAGE=STORAGE)
+class IndexViewTests(TestCase):
+
+    def get_index(self):
+        with self.assertNumQueries(BUDGETS['index'][0]):
+            return self.client.get(reverse('movies:index'))
+
+    def test_queries_do_not_grow_with_the_catalog(self):
+        seed_catalog(Catalog(movies=10, genres=4, seed=1), prefix='first')
+        self.get_index()
+        seed_catalog(Catalog(movies=10, genres=8, seed=2), prefix='second')
+        response = self.get_index()
+        genres = list(response.context['genres'])
+        self.assertEqual(len(genres), 8)
+        self.assertEqual(sum(genre.number_of_movies for genre in genres), 20 * 2)
+        self.assertEqual(genres, list(Genre.objects.order_by('name')))
+
+
+@override_settings(PAGE_CACHE_ENABLED=False, DEFAULT_FILE_STORAGE=STORAGE)
+class MovieDetailViewTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sample = sample_objects(seed_catalog(Catalog(
+            movies=10, actors=30, genres=6, users=30, actors_per_movie=8,
+            genres_per_movie=3, ratings_per_movie=20, reviews_per_movie=6
+        )))
+
+    def get_detail(self, client):
+        url = reverse('movies:movie-detail', args=(self.sample['movie'].slug, ))
+        client.get(url)
+        # The movie, its actors, genres, similar and related movies and the
+        # version stamp of the page.
+        with self.assertNumQueries(6):
+            return client.get(url)
+
+    def assert_movie_shown(self, response):
+        movie = self.sample['movie']
+        self.assertEqual(response.status_code, 200)
+        for actor in movie.actors.all():
+            self.assertContains(response, actor.name)
+        for genre in movie.genres.all():
+            self.assertContains(response, genre.name)
+        self.assertContains(response, f'Total number of ratings: {movie.ratings.count()}')
+
+    def test_anonymous(self):
+        self.assert_movie_shown(self.get_detail(self.client))
+
+    def test_authenticated(self):
+        self.client.force_login(self.sample['user'])
+        self.assert_movie_shown(self.get_detail(self.client))
+        # The rating and review of the viewer come from the viewer fragment.
+        url = reverse('movies:movie-viewer', args=(self.sample['movie'].id, ))
+        with self.assertNumQueries(BUDGETS['movie viewer'][1]):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(DEFAULT_FILE_STORAGE=STORAGE)
+class ExportRowsTests(TestCase):
+
+    def test_dates_are_whole_days_in_the_current_time_zone(self):
+        seed_catalog(Catalog(movies=1, users=4, ratings_per_movie=4))
+        day = datetime.date(2023, 5, 10)
+        ratings = list(Rating.objects.order_by('id'))
+        for rating, moment in zip(ratings, (
+                datetime.datetime(2023, 5, 9, 23, 59, 59),
+                datetime.datetime(2023, 5, 10, 0, 0),
+                datetime.datetime(2023, 5, 10, 23, 59, 59),
+                datetime.datetime(2023, 5, 11, 0, 0))):
+            Rating.objects.filter(pk=rating.pk).update(updated=timezone.make_aware(moment))
+        rows = exports.export_rows('ratings', since=day, until=day)
+        self.assertEqual([row['id'] for row in rows], [ratings[1].id, ratings[2].id])
+
+
+@override_settings(DEFAULT_FILE_STORAGE=STORAGE)
+class PeriodicTaskTests(TestCase):
+    name = 'movies.leaderboards.compute_leaderboards'
+
+    def test_every_run_schedules_the_next_one(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            tasks.schedule_periodic()
+            tasks.schedule_periodic()
+        self.assertEqual(Task.objects.filter(name=self.name).count(), 1)
+        seed_catalog(Catalog(movies=5))
+        LeaderboardEntry.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            claimed = [task for task in tasks.claim(10) if task.name == self.name]
+            self.assertTrue(tasks.run(claimed[0]))
+        self.assertTrue(LeaderboardEntry.objects.exists())
+        pending = Task.objects.get(name=self.name)
+        self.assertEqual(pending.status, Task.PENDING)
+        self.assertGreater(pending.run_after, claimed[0].run_after)
+
+
+@override_settings(DEFAULT_FILE_STORAGE=STORAGE)
+class SimilarMoviesTests(TestCase):
+
+    def test_changed_movies_include_the_movies_listing_them(self):
+        seed_catalog(Catalog(movies=20, users=30, ratings_per_movie=15))
+        recommendations.compute_similar_movies()
+        since = timezone.now()
+        rating = Rating.objects.filter(
+            movie__in=SimilarMovie.objects.values('similar')).first()
+        rating.rating = 10 - rating.rating
+        rating.save()
+        listing = set(SimilarMovie.objects.filter(similar=rating.movie_id).
+                      values_list('movie_id', flat=True))
+        self.assertTrue(listing)
+        self.assertEqual(recommendations.changed_movies(since),
+                         listing | {rating.movie_id})
+
+
+@override_settings(DEFAULT_FILE_STORAGE=STORAGE)
+class ImportCatalogTests(TestCase):
+
+    def test_malformed_records_are_skipped(self):
+        lines = [
+            '{"title": "First", "director": "Someone", "country": "US",'
+            ' "release_date": "2001-01-01", "actors": ["An Actor"], "genres": ["Drama"]}',
+            '[1]', '"x"', 'not json',
+            '{"title": 5, "director": "Someone", "country": "US", "release_date": "2001-01-01"}',
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.ndjson')
+            with open(path, 'w') as file:
+                file.write('\n'.join(lines))
+            stderr = StringIO()
+            call_command('import_catalog', path, stdout=StringIO(), stderr=stderr)
+        self.assertEqual(list(Movie.objects.values_list('title', flat=True)), ['First'])
+        self.assertEqual(len(stderr.getvalue().splitlines()), 4)
+
+    def test_replace_relations(self):
+        record = ('{"title": "First", "director": "Someone", "country": "US",'
+                  ' "release_date": "2001-01-01", "actors": %s, "genres": %s}')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.ndjson')
+            with open(path, 'w') as file:
+                file.write(record % ('["An Actor", "Another"]', '["Drama"]'))
+            call_command('import_catalog', path, stdout=StringIO())
+            with open(path, 'w') as file:
+                file.write(record % ('["Another", "A Third"]', '["Comedy"]'))
+            call_command('import_catalog', path, '--replace-relations', stdout=StringIO())
+        movie = Movie.objects.get(slug='first')
+        self.assertEqual(sorted(movie.actors.values_list('name', flat=True)),
+                         ['A Third', 'Another'])
+        self.assertEqual(list(movie.genres.values_list('name', flat=True)), ['Comedy'])
+        self.assertEqual(Genre.objects.get(name='Drama').number_of_movies, 0)
+        self.assertEqual(Genre.objects.get(name='Comedy').number_of_movies, 1)
+
+
+@override_settings(PAGE_CACHE_ENABLED=False, DEFAULT_FILE_STORAGE=STORAGE)
+class ReviewListViewTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sample = sample_objects(seed_catalog(Catalog(
+            movies=2, users=30, ratings_per_movie=15, reviews_per_movie=25)))
+        cls.movie = cls.sample['movie']
+
+    def get_page(self, sort, cursor=None):
+        query = {'sort': sort, 'cursor': cursor} if cursor else {'sort': sort}
+        response = self.client.get(
+            reverse('movies:review-list', args=(self.movie.id, )), query)
+        return response.context['page_obj']
+
+    def ratings_shown(self, sort):
+        """The author ratings of every page of sort, followed forwards."""
+        page = self.get_page(sort)
+        ratings = [review.author_rating for review in page]
+        while page.has_next:
+            page = self.get_page(sort, page.next_cursor)
+            ratings += [review.author_rating for review in page]
+        return ratings
+
+    def test_author_ratings_follow_the_ratings(self):
+        ratings = dict(self.movie.ratings.values_list('owner_id', 'rating'))
+        for review in self.movie.reviews.all():
+            self.assertEqual(review.author_rating, ratings.get(review.owner_id))
+        review = self.movie.reviews.exclude(owner_id__in=ratings).first()
+        rating = Rating.objects.create(movie=self.movie, owner=review.owner, rating=3)
+        review.refresh_from_db()
+        self.assertEqual(review.author_rating, 3)
+        rating.delete()
+        review.refresh_from_db()
+        self.assertIsNone(review.author_rating)
+
+    def test_sort_modes(self):
+        ratings = self.movie.reviews.values_list('author_rating', flat=True)
+        rated = sorted(rating for rating in ratings if rating is not None)
+        unrated = [None] * (len(ratings) - len(rated))
+        self.assertTrue(unrated)
+        self.assertEqual(self.ratings_shown('highest'), rated[::-1] + unrated)
+        self.assertEqual(self.ratings_shown('lowest'), rated + unrated)
+        self.assertEqual(len(self.ratings_shown('newest')), len(ratings))
+
+    def test_previous_pages(self):
+        for sort in ('newest', 'highest', 'lowest'):
+            first = self.get_page(sort)
+            second = self.get_page(sort, first.next_cursor)
+            previous = self.get_page(sort, second.previous_cursor)
+            with self.subTest(sort=sort):
+                self.assertEqual(list(previous), list(first))
+
+
+@override_settings(DEFAULT_FILE_STORAGE=STORAGE)
+class GenreRenameTests(TestCase):
+
+    def test_pages_of_its_movies_change(self):
+        sample = sample_objects(seed_catalog(Catalog(movies=3)))
+        movie, genre = sample['movie'], sample['genre']
+        tags = [f'movie:{movie.slug}', f'director:{movie.director.slugged_name}',
+                f'actor:{sample["actor"].slugged_name}']
+        VersionStamp.objects.bulk_create([VersionStamp(
+            tag=tag, modified=timezone.now() - datetime.timedelta(days=1)) for tag in tags],
+            update_conflicts=True, unique_fields=['tag'], update_fields=['modified'])
+        genre.name = genre.name + ' renamed'
+        genre.save()
+        changed = VersionStamp.objects.filter(
+            tag__in=tags, modified__gt=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(changed.count(), len(tags))
+
+
+@override_settings(DEFAULT_FILE_STORAGE=STORAGE)
+class PageCacheTests(TestCase):
+
+    def setUp(self):
+        page_cache.get_cache().clear()
+
+    def test_reading_pages_does_not_write_stamps(self):
+        for slug in ('no-such-movie', 'another-one'):
+            self.client.get(reverse('movies:movie-detail', args=(slug, )))
+            self.client.get(reverse('movies:actor-page', args=(slug, )))
+        self.assertFalse(VersionStamp.objects.exists())
+
+    def test_invalidated_pages_miss(self):
+        url = reverse('movies:index')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        page_cache.invalidate('genres')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
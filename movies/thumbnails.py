@@ -0,0 +1,190 @@
+"""
+Fixed-size renditions of posters and photos.
+
+Uploads are up to 5 MB and shown in cards 300px wide, so each image gets
+renditions WIDTHS wide at a 2:3 aspect ratio, in WebP and in JPEG for
+browsers without WebP. They are made with Pillow, saved with the default
+storage under movies/thumbnails/ and described, URLs included, in a
+JSONField of the row, e.g. Movie.poster_thumbnails:
+
+    {"source": "movies/images/poster.jpg",
+     "files": ["movies/thumbnails/poster-150.webp", ...],  # RENDITIONS order
+     "src": "<URL of the 300px JPEG>", "small": "<URL of the 150px JPEG>",
+     "srcset": {"webp": "<URL> 150w, <URL> 300w, ...", "jpeg": "..."}}
+
+so the {% responsive_image %} tag of movies/templatetags/images.py emits
+srcset and width/height without calling the storage. Renditions made
+from another file than the current one ("source") are out of date and
+the tag falls back to the original image.
+
+Saving an image in the admin does not wait for them: the signals in
+movies/signals.py enqueue them in the task queue of movies/tasks.py.
+`manage.py generate_thumbnails` makes the missing ones, e.g. for images
+inserted in bulk.
+"""
+import io
+import os
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+from movies import page_cache
+from movies.models import Movie, Director, Actor
+from movies.tasks import task
+
+WIDTHS = (150, 300, 600)
+DEFAULT_WIDTH = 300
+ASPECT_RATIO = (2, 3)
+FORMATS = {'webp': ('WEBP', {'quality': 80, 'method': 4}),
+           'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True})}
+RENDITIONS = [(extension, width) for width in WIDTHS for extension in FORMATS]
+IMAGE_FIELDS = {Movie: 'poster', Director: 'photo', Actor: 'photo'}
+DIRECTORY = 'movies/thumbnails'
+
+
+def size_of(width):
+    return width, width * ASPECT_RATIO[1] // ASPECT_RATIO[0]
+
+
+def thumbnails_field(model):
+    return f'{IMAGE_FIELDS[model]}_thumbnails'
+
+
+def is_current(obj):
+    """Whether the renditions of obj were made from its current image."""
+    image = getattr(obj, IMAGE_FIELDS[type(obj)])
+    return bool(image.name) and \
+        getattr(obj, thumbnails_field(type(obj))).get('source') == image.name
+
+
+def image_url(obj):
+    """URL of the image of obj, as stored on the row when it was saved."""
+    field = IMAGE_FIELDS[type(obj)]
+    return getattr(obj, f'{field}_url') or getattr(obj, field).url
+
+
+def thumbnail_url(obj):
+    """URL of the smallest JPEG rendition of obj, or of its image."""
+    if is_current(obj):
+        return getattr(obj, thumbnails_field(type(obj)))['small']
+    return image_url(obj)
+
+
+def describe(source, files):
+    """Thumbnails field of the renditions of source, files in RENDITIONS order."""
+    urls = {key: default_storage.url(name) for key, name in zip(RENDITIONS, files)}
+    return {
+        'source': source,
+        'files': files,
+        'src': urls[('jpeg', DEFAULT_WIDTH)],
+        'small': urls[('jpeg', min(WIDTHS))],
+        'srcset': {extension: ', '.join(f'{urls[(extension, width)]} {width}w'
+                                        for width in WIDTHS)
+                   for extension in FORMATS},
+    }
+
+
+def render(file):
+    """Encoded renditions of an image file, (extension, width) -> bytes."""
+    largest = size_of(max(WIDTHS))
+    with Image.open(file) as image:
+        # JPEGs are decoded at the smallest scale still larger than needed,
+        # a 4000px upload is read at 1000px.
+        image.draft('RGB', largest)
+        image = ImageOps.exif_transpose(image).convert('RGBA')
+    # Transparent parts are shown on white, JPEG has no transparency.
+    background = Image.new('RGB', image.size, 'white')
+    background.paste(image, mask=image.getchannel('A'))
+    image = background
+    image = ImageOps.fit(image, largest, Image.Resampling.LANCZOS)
+    renditions = {}
+    for width in sorted(WIDTHS, reverse=True):
+        image = image.resize(size_of(width), Image.Resampling.LANCZOS) \
+            if image.width != width else image
+        for extension, (format, options) in FORMATS.items():
+            output = io.BytesIO()
+            image.save(output, format, **options)
+            renditions[(extension, width)] = output.getvalue()
+    return renditions
+
+
+def invalidate_pages(obj):
+    if isinstance(obj, Movie):
+        page_cache.invalidate(*page_cache.movie_tags(obj.pk))
+    else:
+        kind = 'actor' if isinstance(obj, Actor) else 'director'
+        page_cache.invalidate(f'{kind}:{obj.slugged_name}')
+
+
+def generate(obj):
+    """Make the renditions of the current image of obj, returns whether it did."""
+    model = type(obj)
+    image = getattr(obj, IMAGE_FIELDS[model])
+    if not image.name:
+        return False
+    with image.open('rb') as file:
+        renditions = render(file)
+    stem = os.path.splitext(os.path.basename(image.name))[0]
+    names = {(extension, width): default_storage.save(
+        f'{DIRECTORY}/{stem}-{width}.{extension}', ContentFile(content))
+        for (extension, width), content in renditions.items()}
+    thumbnails = describe(image.name, [names[key] for key in RENDITIONS])
+    files = thumbnails['files']
+    field = thumbnails_field(model)
+    previous = getattr(obj, field).get('files', [])
+    # Only if the image was not replaced meanwhile, an update does not send
+    # the signals that would schedule the renditions again.
+    updated = model.objects.filter(pk=obj.pk, **{IMAGE_FIELDS[model]: image.name}).\
+        update(**{field: thumbnails})
+    if not updated:
+        delete_files(files)
+        return False
+    setattr(obj, field, thumbnails)
+    delete_files(name for name in previous if name not in files)
+    invalidate_pages(obj)
+    return True
+
+
+def delete_files(names):
+    for name in names:
+        default_storage.delete(name)
+
+
+def missing(model, everything=False):
+    """Objects of model whose renditions are missing or out of date."""
+    field = IMAGE_FIELDS[model]
+    objects = model.objects.exclude(**{field: ''}).order_by('pk')
+    return (obj for obj in objects.iterator(chunk_size=500)
+            if everything or not is_current(obj))
+
+
+@task()
+def generate_thumbnails(model, pk):
+    obj = apps.get_model(model).objects.filter(pk=pk).first()
+    if obj and not is_current(obj):
+        generate(obj)
+
+
+def in_use(name):
+    return any(model.objects.filter(**{field: name}).exists()
+               for model, field in IMAGE_FIELDS.items())
+
+
+@task()
+def delete_unused(names):
+    # Seeded and imported rows may share an image.
+    delete_files(name for name in names if not in_use(name))
+
+
+def schedule(obj):
+    """Make the renditions of obj in the task queue once the transaction commits."""
+    model = obj._meta.label_lower
+    generate_thumbnails.enqueue(model, obj.pk, key=f'thumbnails:{model}:{obj.pk}')
+
+
+def schedule_delete(names):
+    """Delete the files of names in the task queue once the transaction
+    commits, unless a row still refers to them."""
+    names = [name for name in names if name]
+    if names:
+        delete_unused.enqueue(names)
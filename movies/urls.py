@@ -7,7 +7,16 @@ urlpatterns = [
     path('', views.IndexView.as_view(), name='index'),
     path('genres/<str:slug>/',
          views.MoviesByGenreListView.as_view(), name='genre-movies'),
+    path('browse/', views.BrowseView.as_view(), name='browse'),
+    path('leaderboards/<slug:board>/',
+         views.LeaderboardView.as_view(), name='leaderboard'),
+    path('leaderboards/<slug:board>/genres/<str:genre>/',
+         views.LeaderboardView.as_view(), name='genre-leaderboard'),
+    path('leaderboards/<slug:board>/countries/<str:country>/',
+         views.LeaderboardView.as_view(), name='country-leaderboard'),
     path('movies/<slug:slug>/', views.MovieDetailView.as_view(), name='movie-detail'),
+    path('movies/<int:pk>/viewer/',
+         views.MovieViewerView.as_view(), name='movie-viewer'),
     path('directors/<str:slug>/',
          views.DirectorPageView.as_view(), name='director-page'),
     path('actors/<str:slug>/', views.ActorPageView.as_view(), name='actor-page'),
@@ -24,5 +33,8 @@ urlpatterns = [
          views.ReviewDetailView.as_view(), name='review-detail'),
     path('movies/<int:pk>/reviews/delete/',
          views.DeleteReviewView.as_view(), name='review-delete'),
-    path('search/', views.SearchResultsView.as_view(), name='search')
+    path('search/', views.SearchResultsView.as_view(), name='search'),
+    path('search/autocomplete/',
+         views.AutocompleteView.as_view(), name='autocomplete'),
+    path('exports/<str:kind>/', views.ExportView.as_view(), name='export')
 ]
@@ -1,86 +1,257 @@
+import datetime
 from typing import Any, Dict, Optional
 from django import http
 from django.db import models
-from django.db.models import Avg, Count
+from django.db.models import Exists, F, OuterRef, Prefetch, Subquery
 from django.db.models.query_utils import Q
 from django.db.models.query import QuerySet
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
-from django.http import HttpResponseRedirect, Http404
+from django.http import HttpResponseRedirect, HttpResponseBadRequest, Http404, \
+    JsonResponse, StreamingHttpResponse
 from django.urls import reverse
 from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control
+from django.utils.http import urlencode
 from django.views.generic import ListView, DetailView, View
-from taggit.models import Tag, TaggedItem
-from movies.models import Movie, Director, Actor, Rating, Review
+from movies.models import Movie, Director, Actor, Genre, Rating, Review, \
+    RelatedMovie, SearchDocument, SimilarMovie
+from movies import autocomplete, exports, facets, leaderboards
+from movies.page_cache import PUBLIC_PAGE_MAX_AGE, cache_anonymous_page, \
+    conditional_page, public_page
+from movies.pagination import KeysetPage, KeysetPaginator
+from movies.search import search
 from movies.forms import RateMovieForm, ReviewMovieForm
 
+SIMILAR_MOVIES_SHOWN = 6
+RELATED_MOVIES_SHOWN = 6
+
 
 class IndexView(ListView):
     template_name = 'movies/index.html'
     context_object_name = 'genres'
 
     def get_queryset(self):
-        tagged_items_ids = [t.tag_id for t in TaggedItem.objects.all()]
-        return Tag.objects.filter(id__in=tagged_items_ids)\
-            .order_by('name').all().annotate(number_of_movies=Count('taggit_taggeditem_items'))
+        return Genre.objects.filter(number_of_movies__gt=0).\
+            order_by('name').all()
+
+    @method_decorator(cache_anonymous_page('genres'))
+    @method_decorator(conditional_page('genres'))
+    def dispatch(self, request, *args, **kwargs):
+        return super().dispatch(request, *args, **kwargs)
 
 
 class MoviesByGenreListView(ListView):
     template_name = 'movies/movies_by_genre.html'
     context_object_name = 'movies'
+    ordering = ['title', 'id']
+    paginate_by = 24
 
     def get_queryset(self) -> QuerySet[Any]:
         genre_slug = self.kwargs['slug']
-        genre = Tag.objects.filter(slug=genre_slug).first()
+        genre = Genre.objects.filter(slug=genre_slug).first()
         if not genre:
             raise Http404
         self.genre = genre
         movies = Movie.objects.filter(genres=genre).\
-            select_related('director').all().annotate(
-            avg_rating=Avg('ratings__rating')
-        )
+            select_related('director').prefetch_related('genres').all()
         return movies
 
+    def paginate_queryset(self, queryset, page_size):
+        page = KeysetPaginator(queryset, self.ordering, page_size).\
+            get_page(self.request.GET.get('cursor'))
+        return None, page, page.object_list, True
+
     def get_context_data(self, **kwargs: Any) -> Dict[str, Any]:
         context = super().get_context_data(**kwargs)
         context['genre'] = self.genre
+        context['number_of_movies'] = self.genre.number_of_movies
+        return context
+
+    @method_decorator(cache_anonymous_page('genre:{slug}'))
+    @method_decorator(conditional_page('genre:{slug}'))
+    def dispatch(self, request, *args, **kwargs):
+        return super().dispatch(request, *args, **kwargs)
+
+
+class BrowseView(ListView):
+    # Filtering and facet counts come from the in-process index in
+    # movies/facets.py, only the movies of the page are queried.
+    template_name = 'movies/browse.html'
+    context_object_name = 'movies'
+    paginate_by = 24
+
+    def get_queryset(self):
+        return Movie.objects.select_related('director').prefetch_related('genres')
+
+    def paginate_queryset(self, queryset, page_size):
+        try:
+            offset = max(int(self.request.GET.get('cursor', 0)), 0)
+        except ValueError:
+            offset = 0
+        self.filters, movie_ids, self.count, self.facets = \
+            facets.index.browse(self.request.GET, offset, page_size)
+        movies = {movie.id: movie for movie in queryset.filter(id__in=movie_ids)}
+        movies = [movies[movie_id] for movie_id in movie_ids if movie_id in movies]
+        next_cursor = str(offset + page_size) if offset + page_size < self.count else None
+        previous_cursor = str(max(offset - page_size, 0)) if offset else None
+        page = KeysetPage(movies, next_cursor, previous_cursor)
+        return None, page, movies, True
+
+    def link(self, **changes):
+        return '?' + urlencode(self.filters.query(**changes))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        filters = self.filters
+        links = {
+            'genre': lambda slug, selected: self.link(genre=[
+                genre for genre in filters.genres if genre != slug
+            ] if selected else filters.genres + [slug]),
+            'country': lambda code, selected: self.link(country=None if selected else code),
+            'director': lambda slug, selected: self.link(director=None if selected else slug),
+            'decade': lambda decade, selected: self.link(
+                year_from=None if selected else decade,
+                year_to=None if selected else decade + 9),
+            'rating': lambda threshold, selected: self.link(
+                min_rating=None if selected else threshold),
+        }
+        context['facets'] = {
+            name: [(label, count, selected, links[name](value, selected))
+                   for value, label, count, selected in options]
+            for name, options in self.facets.items()
+        }
+        context['filters'] = filters
+        context['number_of_movies'] = self.count
+        query = filters.query()
+        context['extra_query'] = urlencode(query) + '&' if query else ''
         return context
 
 
+class LeaderboardView(ListView):
+    template_name = 'movies/leaderboard.html'
+    context_object_name = 'entries'
+
+    def get_queryset(self):
+        board = self.kwargs['board']
+        genre = self.kwargs.get('genre')
+        country = self.kwargs.get('country')
+        if board not in leaderboards.BOARDS:
+            raise Http404
+        self.scope_label = None
+        if genre:
+            self.scope_label = Genre.objects.filter(slug=genre).\
+                values_list('name', flat=True).first()
+        elif country:
+            self.scope_label = dict(Movie.COUNTRIES).get(country)
+        if (genre or country) and not self.scope_label:
+            raise Http404
+        return leaderboards.leaderboard(
+            board, leaderboards.scope_name(genre=genre, country=country))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['board'] = self.kwargs['board']
+        context['board_name'] = leaderboards.BOARDS[self.kwargs['board']]
+        context['boards'] = leaderboards.BOARDS
+        context['genre'] = self.kwargs.get('genre')
+        context['country'] = self.kwargs.get('country')
+        context['scope_label'] = self.scope_label
+        context['countries'] = Movie.COUNTRIES
+        return context
+
+    @method_decorator(cache_anonymous_page('leaderboards'))
+    @method_decorator(conditional_page('leaderboards'))
+    def dispatch(self, request, *args, **kwargs):
+        return super().dispatch(request, *args, **kwargs)
+
+
 class MovieDetailView(DetailView):
+    # The page is the same for every visitor, the parts that depend on the
+    # visitor are served by MovieViewerView. The movie comes with its rating
+    # aggregates and director in one query, everything the template shows
+    # of it in one batched query each, so the page takes the same number of
+    # queries whatever the size of the cast:
+    #   the movie, actors, genres, similar movies, related movies
+    # (and the version stamp of the page cache). movies/tests.py pins it.
     model = Movie
-    queryset = Movie.objects.select_related('director').\
-        all().annotate(avg_rating=Avg('ratings__rating'))
+    queryset = Movie.objects.select_related('director').prefetch_related(
+        Prefetch('actors', queryset=Actor.objects.only('name', 'slugged_name')),
+        'genres',
+        # Precomputed by compute_similar_movies and kept up to date by
+        # movies/related.py, read on their (movie, rank) indexes.
+        Prefetch('similar_movies', to_attr='similar_shown',
+                 queryset=SimilarMovie.objects.select_related('similar').
+                 only('movie_id', 'similar__title', 'similar__slug', 'similar__poster',
+                      'similar__poster_url', 'similar__poster_thumbnails')
+                 [:SIMILAR_MOVIES_SHOWN]),
+        Prefetch('related_movies', to_attr='related_shown',
+                 queryset=RelatedMovie.objects.select_related('related').
+                 only('movie_id', 'related__title', 'related__slug', 'related__poster',
+                      'related__poster_url', 'related__poster_thumbnails')
+                 [:RELATED_MOVIES_SHOWN]),
+    )
     template_name = 'movies/movie_detail.html'
     slug_field = 'slug'
     slug_url_kwarg = 'slug'
 
-    def get_context_data(self, **kwargs: Any) -> Dict[str, Any]:
-        current_user = self.request.user
+    @method_decorator(public_page(PUBLIC_PAGE_MAX_AGE))
+    @method_decorator(cache_anonymous_page('movie:{slug}', shared=True))
+    @method_decorator(conditional_page('movie:{slug}', shared=True))
+    def dispatch(self, request, *args, **kwargs):
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        if current_user.is_authenticated:
-            rating = Rating.objects.\
-                filter(
-                    Q(movie__slug=self.kwargs['slug']) &
-                    Q(owner=current_user)
-                ).first()
-            if rating:
-                context['rating'] = rating
-            else:
-                context['rating'] = None
-        else:
-            context['rating'] = None
-        context['number_of_ratings'] = Rating.objects.\
-            filter(movie__slug=self.kwargs['slug']).all().count()
+        context['similar_movies'] = [
+            similar.similar for similar in self.object.similar_shown]
+        context['related_movies'] = [
+            related.related for related in self.object.related_shown]
         return context
 
-    def dispatch(self, request, *args, **kwargs):
-        return super().dispatch(request, *args, **kwargs)
+
+class MovieViewerView(View):
+    """Visitor specific fragments of the movie detail page."""
+
+    def get_movie(self, pk, user):
+        # The visitor's rating and whether they reviewed the movie come
+        # with the movie, as subqueries on the (movie, owner) indexes.
+        movie = Movie.objects.filter(id=pk).only('id')
+        if user.is_authenticated:
+            movie = movie.annotate(
+                viewer_rating=Subquery(Rating.objects.filter(
+                    movie=OuterRef('pk'), owner=user).values('rating')[:1]),
+                viewer_has_review=Exists(Review.objects.filter(
+                    movie=OuterRef('pk'), owner=user))
+            )
+        return movie.first()
+
+    def get(self, request, *args, **kwargs):
+        movie = self.get_movie(self.kwargs['pk'], self.request.user)
+        if not movie:
+            raise Http404
+        context = {'movie': movie,
+                   'rating': getattr(movie, 'viewer_rating', None),
+                   'user_has_review': getattr(movie, 'viewer_has_review', False)}
+        response = JsonResponse({
+            'rating': render_to_string('movies/includes/viewer_rating.html',
+                                       context, request),
+            'messages': render_to_string('movies/includes/messages.html',
+                                         {}, request),
+            'navbar': render_to_string('movies/includes/navbar_user.html',
+                                       {}, request)
+        })
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
 
 
 class DirectorPageView(View):
     template_name = 'movies/director_page.html'
+    ordering = ['title', 'id']
+    paginate_by = 24
 
     def get(self, request, *args, **kwargs):
         director_slugged_name = self.kwargs['slug']
@@ -89,14 +260,24 @@ class DirectorPageView(View):
         if not director:
             raise Http404
         movies = Movie.objects.select_related('director').\
-            filter(director=director).all().order_by('title').\
-            annotate(avg_rating=Avg('ratings__rating'))
-        return render(request, self.template_name, {'movies': movies,
+            prefetch_related('genres').filter(director=director).all()
+        page = KeysetPaginator(movies, self.ordering, self.paginate_by).\
+            get_page(request.GET.get('cursor'))
+        return render(request, self.template_name, {'movies': page.object_list,
+                                                    'page_obj': page,
+                                                    'number_of_movies': movies.count(),
                                                     'director': director})
 
+    @method_decorator(cache_anonymous_page('director:{slug}'))
+    @method_decorator(conditional_page('director:{slug}'))
+    def dispatch(self, request, *args, **kwargs):
+        return super().dispatch(request, *args, **kwargs)
+
 
 class ActorPageView(View):
     template_name = 'movies/actor_page.html'
+    ordering = ['title', 'id']
+    paginate_by = 24
 
     def get(self, request, *args, **kwargs):
         actor_slugged_name = self.kwargs['slug']
@@ -106,11 +287,19 @@ class ActorPageView(View):
         if not actor:
             raise Http404
         movies = Movie.objects.select_related('director').\
-            filter(actors=actor).all().order_by('title').\
-            annotate(avg_rating=Avg('ratings__rating'))
-        return render(request, self.template_name, {'movies': movies,
+            prefetch_related('genres').filter(actors=actor).all()
+        page = KeysetPaginator(movies, self.ordering, self.paginate_by).\
+            get_page(request.GET.get('cursor'))
+        return render(request, self.template_name, {'movies': page.object_list,
+                                                    'page_obj': page,
+                                                    'number_of_movies': movies.count(),
                                                     'actor': actor})
 
+    @method_decorator(cache_anonymous_page('actor:{slug}'))
+    @method_decorator(conditional_page('actor:{slug}'))
+    def dispatch(self, request, *args, **kwargs):
+        return super().dispatch(request, *args, **kwargs)
+
 
 class RateMovieView(View):
     form_class = RateMovieForm
@@ -263,39 +452,50 @@ class DeleteRatingView(View):
 
 class ReviewListView(View):
     template_name = 'movies/review_list.html'
+    # Sort mode -> ordering, each served by an index of Review. The rating
+    # orders list the reviews whose authors have not rated the movie last.
+    sort_modes = {
+        'newest': ['-published', '-id'],
+        'highest': [F('author_rating').desc(nulls_last=True), '-published', '-id'],
+        'lowest': [F('author_rating').asc(nulls_last=True), '-published', '-id']
+    }
+    paginate_by = 20
 
     def get_movie(self, pk):
         return Movie.objects.filter(id=pk).first()
 
+    def get_reviews(self, movie):
+        return Review.objects.select_related('owner').filter(movie__id=movie.id)
+
     def get(self, request, *args, **kwargs):
         movie = self.get_movie(self.kwargs['pk'])
         if not movie:
             raise Http404
-        reviews_ratings = []
-        reviews = list(Review.objects.select_related('owner').
-                       filter(movie__id=movie.id).all().order_by('-published'))
-        reviews_owner_ids = [review.owner.id for review in reviews]
-        ratings = list(Rating.objects.
-                       filter(
-                           Q(movie__id=movie.id) &
-                           Q(owner__id__in=reviews_owner_ids)
-                       ).all())
-        ratings_owner_ids = [rating.owner.id for rating in ratings]
-        for review in reviews:
-            if review.owner.id in ratings_owner_ids:
-                rating_index = ratings_owner_ids.index(review.owner.id)
-                rating = ratings[rating_index]
-                reviews_ratings.append([review, rating])
-            else:
-                reviews_ratings.append([review, None])
-        if self.request.user.is_authenticated and (self.request.user.id in reviews_owner_ids):
-            user_has_review = True
+        sort = request.GET.get('sort')
+        if sort not in self.sort_modes:
+            sort = 'newest'
+        reviews = self.get_reviews(movie)
+        page = KeysetPaginator(reviews, self.sort_modes[sort], self.paginate_by).\
+            get_page(request.GET.get('cursor'))
+        number_of_reviews = Review.objects.filter(movie__id=movie.id).count()
+        if self.request.user.is_authenticated:
+            user_has_review = Review.objects.filter(
+                movie__id=movie.id, owner=self.request.user).exists()
         else:
             user_has_review = False
-        return render(request, self.template_name, {'reviews_ratings': reviews_ratings,
+        return render(request, self.template_name, {'reviews': page.object_list,
+                                                    'page_obj': page,
+                                                    'sort': sort,
+                                                    'extra_query': f'sort={sort}&',
+                                                    'number_of_reviews': number_of_reviews,
                                                     'user_has_review': user_has_review,
                                                     'movie': movie})
 
+    @method_decorator(cache_anonymous_page('movie:{pk}'))
+    @method_decorator(conditional_page('movie:{pk}'))
+    def dispatch(self, request, *args, **kwargs):
+        return super().dispatch(request, *args, **kwargs)
+
 
 class ReviewMovieView(View):
     template_name = 'movies/review_movie.html'
@@ -466,35 +666,101 @@ class DeleteReviewView(View):
 
 class SearchResultsView(View):
     template_name = 'movies/search_results.html'
+    kinds = {
+        'actors': SearchDocument.ACTOR,
+        'directors': SearchDocument.DIRECTOR,
+        'movies': SearchDocument.MOVIE
+    }
+    preview_size = 10
+    paginate_by = 20
+
+    def get_page_number(self):
+        try:
+            return max(1, int(self.request.GET.get('page', 1)))
+        except ValueError:
+            return 1
 
     def get(self, request, *args, **kwargs):
-        results = {
-            'actors': [],
-            'directors': [],
-            'movies': []
-        }
         query = self.request.GET.get('q')
-        if query:
-            actors = Actor.objects.filter(
-                Q(name__icontains=query)
-            ).order_by('name').all()
-            results['actors'] = actors
-            ####################################
-            directors = Director.objects.filter(
-                Q(name__icontains=query)
-            ).order_by('name').all()
-            results['directors'] = directors
-            #####################################
-            movies = Movie.objects.filter(
-                Q(title__icontains=query)
-            ).all().order_by('title')
-            results['movies'] = movies
-            number_of_results = len(
-                results['actors']) + len(results['directors']) + len(results['movies'])
-            return render(request, self.template_name, {'results': results,
-                                                        'query': query,
-                                                        'number_of_results': number_of_results})
-        return render(request, 'movies/empty_search.html')
+        if not query:
+            return render(request, 'movies/empty_search.html')
+        kind = self.request.GET.get('kind')
+        if kind in self.kinds:
+            # All results of a single kind, one page at a time.
+            page = self.get_page_number()
+            offset = (page - 1) * self.paginate_by
+            found = search(query, self.kinds[kind],
+                           self.paginate_by + 1, offset)
+            return render(request, self.template_name, {
+                'query': query,
+                'kind': kind,
+                'documents': found[:self.paginate_by],
+                'page': page,
+                'has_previous': page > 1,
+                'has_next': len(found) > self.paginate_by
+            })
+        results = {}
+        has_more = {}
+        for name, document_kind in self.kinds.items():
+            found = search(query, document_kind, self.preview_size + 1)
+            results[name] = found[:self.preview_size]
+            has_more[name] = len(found) > self.preview_size
+        number_of_results = sum(len(found) for found in results.values())
+        return render(request, self.template_name, {'results': results,
+                                                    'has_more': has_more,
+                                                    'query': query,
+                                                    'number_of_results': number_of_results})
+
+    @method_decorator(cache_anonymous_page('search'))
+    @method_decorator(conditional_page('search'))
+    def dispatch(self, request, *args, **kwargs):
+        return super().dispatch(request, *args, **kwargs)
+
+
+class AutocompleteView(View):
+    limit = 10
+
+    def get(self, request, *args, **kwargs):
+        query = self.request.GET.get('q', '')
+        return JsonResponse({
+            'results': autocomplete.index.lookup(query, self.limit)
+        })
+
+
+class ExportView(View):
+    """Streams all ratings or reviews, filtered by movie and date, to staff."""
+
+    def parse_date(self, name):
+        value = self.request.GET.get(name)
+        return datetime.date.fromisoformat(value) if value else None
+
+    def get(self, request, *args, **kwargs):
+        kind = self.kwargs['kind']
+        if kind not in exports.EXPORTS:
+            raise Http404
+        file_format = request.GET.get('format', 'ndjson')
+        if file_format not in exports.FORMATS:
+            return HttpResponseBadRequest('format must be ndjson or csv')
+        movie_id = request.GET.get('movie')
+        if movie_id is not None and not movie_id.isdigit():
+            return HttpResponseBadRequest('movie must be the id of a movie')
+        try:
+            since, until = self.parse_date('since'), self.parse_date('until')
+        except ValueError:
+            return HttpResponseBadRequest('since and until must be YYYY-MM-DD dates')
+        compress = request.GET.get('gzip') == '1'
+        rows = exports.export_rows(kind, movie_id, since, until)
+        response = StreamingHttpResponse(
+            exports.encode(exports.render(kind, rows, file_format), compress),
+            content_type='application/gzip' if compress else exports.FORMATS[file_format]
+        )
+        filename = f'{kind}.{file_format}' + ('.gz' if compress else '')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    @method_decorator(staff_member_required)
+    def dispatch(self, request, *args, **kwargs):
+        return super().dispatch(request, *args, **kwargs)
 
 
 def error_404_handler(request, exception):